@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Compares the JSON codecs of pyrate.jsoncodec on Twitter and Mailchimp shaped payloads.
+
+Usage: python benchmarks/bench_codecs.py [--number N]
+"""
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pyrate import jsoncodec
+
+
+def tweet(i):
+    return {
+        'created_at': 'Wed Aug 27 13:08:45 +0000 2008',
+        'id': 1000000000 + i,
+        'id_str': str(1000000000 + i),
+        'text': u'Just setting up my pyrate ☃ #%d http://t.co/abc' % i,
+        'truncated': False,
+        'entities': {'hashtags': [{'text': 'pyrate', 'indices': [10, 17]}], 'urls': [], 'user_mentions': []},
+        'user': {'id': 12345, 'screen_name': 'pyrate', 'name': 'Pyrate', 'followers_count': 1024,
+                 'description': 'A python wrapper for restful web apis', 'lang': 'en', 'verified': False},
+        'retweet_count': i % 17,
+        'favorite_count': i % 5,
+        'coordinates': None,
+        'geo': {'type': 'Point', 'coordinates': [47.3769, 8.5417]},
+    }
+
+
+def member(i):
+    return {
+        'email': {'email': 'member%d@example.com' % i},
+        'email_type': 'html',
+        'merge_vars': {'FNAME': 'First%d' % i, 'LNAME': u'L\xe4st', 'groupings': [{'id': 1, 'groups': ['A', 'B']}],
+                       'mc_language': 'de', 'optin_ip': '127.0.0.1'},
+    }
+
+
+PAYLOADS = {
+    'twitter timeline (200 tweets)': [tweet(i) for i in range(200)],
+    'mailchimp batch-subscribe (1000 members)': {'apikey': 'key-us2', 'id': 'abc123', 'double_optin': False,
+                                                 'batch': [member(i) for i in range(1000)]},
+}
+
+
+def available_codecs():
+    for name in jsoncodec.PREFERENCE:
+        try:
+            yield jsoncodec.get_codec(name)
+        except ImportError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--number', type=int, default=50, help='Iterations per measurement')
+    args = parser.parse_args()
+
+    for label, payload in sorted(PAYLOADS.items()):
+        encoded = jsoncodec.get_codec('stdlib').dumps(payload)
+        print('%s, %d bytes' % (label, len(encoded)))
+        print('  %-10s %12s %12s' % ('codec', 'dumps (ms)', 'loads (ms)'))
+        for codec in available_codecs():
+            dumps = min(timeit.repeat(lambda: codec.dumps(payload), number=args.number, repeat=3))
+            loads = min(timeit.repeat(lambda: codec.loads(encoded), number=args.number, repeat=3))
+            print('  %-10s %12.3f %12.3f' % (codec.name, dumps * 1000 / args.number, loads * 1000 / args.number))
+        print('')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures the cold import time of pyrate's entry points, as paid by short-lived CLI and serverless processes.
+
+Each module is imported in fresh interpreters, timing the import statement only. Heavy optional dependencies
+(OAuth, ijson, sqlite3, aiohttp, ...) must stay unloaded until used, the benchmark fails if one of them gets
+imported.
+
+Usage:
+    python benchmarks/bench_import.py                  # run and compare against the saved baselines
+    python benchmarks/bench_import.py --save           # run and save the results as new baselines
+    python benchmarks/bench_import.py -k twitter       # only run scenarios containing 'twitter'
+
+Baselines are machine specific and share ``baselines.json`` with bench_overhead.py, under ``import.`` names.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+# Modules that must not be loaded by importing the scenarios
+DEFERRED = ('requests_oauthlib', 'oauthlib', 'ijson', 'sqlite3', 'aiohttp', 'concurrent.futures', 'orjson',
+            'ujson', 'simdjson')
+
+SCENARIOS = {
+    'import.pyrate': 'import pyrate',
+    'import.pyrate.get_service': "import pyrate; pyrate.get_service('github', 'user', 'password')",
+    'import.pyrate.main': 'import pyrate.main',
+    'import.pyrate.services.github': 'import pyrate.services.github',
+    'import.pyrate.services.twitter': 'import pyrate.services.twitter',
+    'import.pyrate.scripts.cliutils': 'import pyrate.scripts.cliutils',
+}
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+%s
+elapsed = time.perf_counter() - start
+print(repr((elapsed, sorted(name for name in %r if name in sys.modules))))
+'''
+
+
+def run(code):
+    env = dict(os.environ)
+    # Measure with bytecode caching, like an installed package
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+    output = subprocess.check_output([sys.executable, '-c', PROBE % (code, DEFERRED)], cwd=ROOT, env=env)
+    return eval(output.decode('ascii'))
+
+
+def measure(code, repeat):
+    run(code)  # Writes the bytecode caches
+    times, loaded = [], []
+    for _ in range(repeat):
+        elapsed, loaded = run(code)
+        times.append(elapsed)
+    times.sort()
+    return {'ms': times[len(times) // 2] * 1e3, 'min_ms': times[0] * 1e3}, loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='pattern', default='', help='Only run scenarios containing this string')
+    parser.add_argument('--repeat', type=int, default=15, help='Interpreters started per scenario')
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baselines')
+    parser.add_argument('--baselines', default=BASELINES, help='Baselines file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown against the baselines, as a fraction (default 0.25)')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    results, regressions, leaks = {}, [], []
+    print('%-34s %12s %12s %10s  %s' % ('scenario', 'median ms', 'min ms', 'vs base', 'deferred modules loaded'))
+    for name, code in sorted(SCENARIOS.items()):
+        if args.pattern not in name:
+            continue
+
+        result, loaded = measure(code, args.repeat)
+        results[name] = result
+        change = ''
+        if name in baselines:
+            ratio = result['ms'] / baselines[name]['ms'] - 1
+            change = '%+.1f%%' % (ratio * 100)
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += ' !'
+        if loaded:
+            leaks.append(name)
+        print('%-34s %12.1f %12.1f %10s  %s' % (name, result['ms'], result['min_ms'], change, ', '.join(loaded)))
+
+    if leaks:
+        print('\n%d scenario(s) load deferred modules: %s' % (len(leaks), ', '.join(leaks)))
+        return 1
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('\nSaved %d baselines to %s' % (len(results), args.baselines))
+    elif regressions:
+        print('\n%d scenario(s) slower than baseline by more than %d%%: %s' % (
+            len(regressions), args.threshold * 100, ', '.join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
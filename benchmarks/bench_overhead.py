@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Measures the client-side cost of pyrate calls against an in-process null transport.
+
+Every service is exercised through its verbs and convenience methods while the network is replaced by a requests
+adapter answering instantly with a canned response, so only pyrate's own work is measured: url building, header
+and body merging, build_content, auth (including OAuth1 signing), encoding and decoding.
+
+Usage:
+    python benchmarks/bench_overhead.py                  # run and compare against the saved baselines
+    python benchmarks/bench_overhead.py --save           # run and save the results as new baselines
+    python benchmarks/bench_overhead.py -k twitter       # only run scenarios containing 'twitter'
+
+Baselines are machine specific, save them on the box that runs the comparison. The exit status is 1 when a
+scenario got slower than its baseline by more than the threshold.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from pyrate.services import basecamp, github, harvest, mailchimp, twitter
+
+BASELINES = os.path.join(os.path.dirname(__file__), 'baselines.json')
+
+
+class NullAdapter(BaseAdapter):
+    """A requests transport adapter that never touches the network.
+
+    :param body: The JSON document every request is answered with
+    """
+
+    def __init__(self, body=None):
+        super(NullAdapter, self).__init__()
+        self.content = json.dumps({'id': '1', 'data': []} if body is None else body).encode('utf-8')
+
+    def send(self, request, **kwargs):
+        response = requests.Response()
+        response.status_code = 200
+        response.headers = CaseInsensitiveDict({'Content-Type': 'application/json; charset=utf-8'})
+        response._content = self.content
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+def null_pyrate(factory, body=None):
+    h = factory()
+    h.get_session().mount('https://', NullAdapter(body))
+    # Pacing is not overhead, and would stall the benchmark
+    h.content_creation_limits = None
+    return h
+
+
+def scenarios():
+    gh = null_pyrate(lambda: github.GithubPyrate('user', 'password'), {'current_user_url': 'x', 'name': 'repo'})
+    tw = null_pyrate(lambda: twitter.TwitterPyrate('key', 'secret', 'token', 'token-secret'), {'id': 1})
+    mc = null_pyrate(lambda: mailchimp.MailchimpPyrate('apikey-us2'), {'msg': "Everything's Chimpy!"})
+    mc.storeListIndex([{'id': '8a4d2d7a2b', 'name': 'List'}])
+    hv = null_pyrate(lambda: harvest.HarvestPyrate('user', 'password', 'org'), {'company': 'x', 'user': 'y'})
+    bc = null_pyrate(lambda: basecamp.BasecampPyrate('user', 'password', '123'), {'email_address': 'user'})
+
+    result = {}
+    for name, h in (('github', gh), ('twitter', tw), ('mailchimp', mc), ('harvest', hv), ('basecamp', bc)):
+        result['%s.get' % name] = lambda h=h: h.get('some/resource', {'page': 2})
+        result['%s.post' % name] = lambda h=h: h.post('some/resource', {'name': 'value', 'flag': True})
+        result['%s.put' % name] = lambda h=h: h.put('some/resource', {'name': 'value'})
+        result['%s.delete' % name] = lambda h=h: h.delete('some/resource')
+        result['%s.options' % name] = lambda h=h: h.options('some/resource')
+        if len(h.connection_check_method) == 4:
+            result['%s.check_connection' % name] = h.check_connection
+
+    result['github.get_my_orgs'] = gh.get_my_orgs
+    result['github.create_repo'] = lambda: gh.create_repo('repo', 'description', 'org', private=True)
+    result['github.delete_repo'] = lambda: gh.delete_repo('repo', 'org')
+    result['github.archive_repos[100]'] = lambda: list(gh.archive_repos(['repo%d' % i for i in range(100)], 'org',
+                                                                        max_in_flight=8))
+    result['twitter.tweet'] = lambda: tw.tweet('Hello from the benchmark', loc_lat=47.37, loc_long=8.54)
+    result['mailchimp.subscribeToList'] = lambda: mc.subscribeToList('8a4d2d7a2b', 'user@example.com',
+                                                                     {'FNAME': 'First'})
+    result['mailchimp.unsubscribeFromList'] = lambda: mc.unsubscribeFromList('8a4d2d7a2b', 'user@example.com')
+    return result
+
+
+def measure(func, min_time):
+    # Warm up (sessions, codecs, lazy imports), then time batches until min_time has passed
+    for _ in range(10):
+        func()
+
+    calls, elapsed = 0, 0.0
+    batch = 10
+    while elapsed < min_time:
+        start = time.perf_counter()
+        for _ in range(batch):
+            func()
+        elapsed += time.perf_counter() - start
+        calls += batch
+        batch *= 2
+
+    tracemalloc.start()
+    try:
+        func()
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        func()
+        after, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    per_call = elapsed / calls
+    return {'us_per_call': per_call * 1e6, 'calls_per_s': 1 / per_call, 'peak_kib_per_call': (peak - before) / 1024.0}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('-k', dest='pattern', default='', help='Only run scenarios containing this string')
+    parser.add_argument('--min-time', type=float, default=0.2, help='Seconds spent timing each scenario')
+    parser.add_argument('--save', action='store_true', help='Save the results as the new baselines')
+    parser.add_argument('--baselines', default=BASELINES, help='Baselines file')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Allowed slowdown against the baselines, as a fraction (default 0.25)')
+    args = parser.parse_args()
+
+    baselines = {}
+    if os.path.exists(args.baselines):
+        with open(args.baselines) as f:
+            baselines = json.load(f)
+
+    results, regressions = {}, []
+    print('%-34s %12s %12s %14s %10s' % ('scenario', 'us/call', 'calls/s', 'peak KiB/call', 'vs base'))
+    for name, func in sorted(scenarios().items()):
+        if args.pattern not in name:
+            continue
+
+        result = results[name] = measure(func, args.min_time)
+        change = ''
+        if name in baselines:
+            ratio = result['us_per_call'] / baselines[name]['us_per_call'] - 1
+            change = '%+.1f%%' % (ratio * 100)
+            if ratio > args.threshold:
+                regressions.append(name)
+                change += ' !'
+        print('%-34s %12.1f %12.0f %14.1f %10s' % (name, result['us_per_call'], result['calls_per_s'],
+                                                   result['peak_kib_per_call'], change))
+
+    if args.save:
+        baselines.update(results)
+        with open(args.baselines, 'w') as f:
+            json.dump(baselines, f, indent=2, sort_keys=True)
+            f.write('\n')
+        print('\nSaved %d baselines to %s' % (len(results), args.baselines))
+    elif regressions:
+        print('\n%d scenario(s) slower than baseline by more than %d%%: %s' % (
+            len(regressions), args.threshold * 100, ', '.join(regressions)))
+        return 1
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
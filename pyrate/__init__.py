@@ -1 +1,4 @@
 __version__ = "0.4.0"
+
+# Only the registry is imported here, services (and requests) are imported when first asked for
+from pyrate.registry import available_services, get_service, get_service_class, register_service
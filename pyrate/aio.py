@@ -0,0 +1,608 @@
+"""Asyncio engine for pyrate, built on aiohttp.
+
+Only importable on Python 3.6+; the synchronous classes in :mod:`pyrate.main` stay usable without it.
+"""
+import asyncio
+import datetime
+from itertools import islice
+
+from requests.models import PreparedRequest, Response
+from requests.structures import CaseInsensitiveDict
+
+from pyrate.graphql import GraphQLBatch
+from pyrate.instrumentation import clock, RequestRecord
+from pyrate.jsonstream import get_ijson, iter_json_items
+from pyrate.main import CallError, Pyrate, add_query_params
+from pyrate.streaming import _CLOSED, _Failure, MessageParser, StreamConsumer
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+__docformat__ = 'sphinx en'
+
+# Items decoded per trip to the worker thread by AsyncPyrate.do_stream without ijson
+STREAM_BATCH = 100
+
+
+def run_many(do, calls, max_workers, as_completed=False):
+    """Runs the coroutine ``do(method, content, http_method=http_method)`` for each call as tasks of the running
+    event loop, see :func:`AsyncPyrate.do_many`."""
+
+    results = _iter_many(do, calls, max_workers)
+    if as_completed:
+        return results
+    return _gather_many(results)
+
+
+async def _gather_many(results):
+    results = dict([item async for item in results])
+    return [results[index] for index in range(len(results))]
+
+
+async def _iter_many(do, calls, max_workers):
+    pending = set()
+    try:
+        for index, call in enumerate(calls):
+            pending.add(asyncio.ensure_future(_do_call(do, index, call)))
+
+            # Keep a bounded window of running calls
+            if len(pending) >= max_workers:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    yield task.result()
+
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def _do_call(do, index, call):
+    method, content, http_method = (tuple(call) + (None, None))[:3]
+    try:
+        return index, await do(method, content, http_method=http_method)
+    except Exception as e:
+        return index, CallError(call, e)
+
+
+class AsyncSingleFlight(object):
+    """Awaitable counterpart of :class:`pyrate.singleflight.SingleFlight`, for a single event loop.
+
+    The shared request runs in its own task, so a caller being cancelled does not cancel it for the others.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._tasks = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    async def do(self, key, function, *args):
+        task = self._tasks.get(key)
+        if task is None:
+            task = self._tasks[key] = asyncio.ensure_future(function(*args))
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            self.shared += 1
+        return await asyncio.shield(task)
+
+
+class AsyncPyrate(Pyrate):
+    """Awaitable counterpart of :class:`pyrate.main.Pyrate`.
+
+    :func:`do`, the proxy functions, :func:`check_connection` and :func:`do_many` are awaitable; :func:`iter_pages`,
+    :func:`iter_items` and :func:`do_stream` are async generators. Each instance owns an aiohttp connection pool
+    (sized by ``pool_connections``/``pool_maxsize``) and a semaphore that caps the number of requests it has in
+    flight.
+
+    Identical requests in flight are coalesced per instance (instances do not share event loops), unless
+    :attr:`single_flight <pyrate.main.Pyrate.single_flight>` is None. Requests go through the response cache,
+    retry policy, rate limiters, hooks and metrics like synchronous ones; waits for the limiters and backoffs are
+    awaited. Request bodies are not compressed and the ``transport`` of the instance is not used.
+
+    :param int max_concurrency: Maximum number of requests in flight for this instance
+    """
+
+    max_concurrency = 100
+    client_session = None
+
+    def __init__(self, *args, **kwargs):
+        if aiohttp is None:
+            raise ImportError("AsyncPyrate requires aiohttp (pip install aiohttp)")
+
+        super(AsyncPyrate, self).__init__(*args, **kwargs)
+        self._semaphore = None
+        self._flights = AsyncSingleFlight()
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' for %s" % type(self).__name__)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def get_client_session(self):
+        """Returns the aiohttp session of this instance, creating it on first use.
+
+        Must be called from within the running event loop.
+
+        :rtype: :class:`aiohttp.ClientSession`
+        """
+
+        if self.client_session is None or self.client_session.closed:
+            connector = aiohttp.TCPConnector(limit=self.pool_connections * self.pool_maxsize,
+                                             limit_per_host=self.pool_maxsize,
+                                             force_close=not self.keep_alive)
+            self.client_session = aiohttp.ClientSession(connector=connector)
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        return self.client_session
+
+    async def close(self):
+        session, self.client_session = self.client_session, None
+        if session is not None:
+            await session.close()
+
+    async def check_connection(self):
+        res = await self.do(self.connection_check_method[1], http_method=self.connection_check_method[0])
+        if res and self.connection_check_method[2] in res:
+            if self.connection_check_method[3]:
+                if res[self.connection_check_method[2]] == self.connection_check_method[3]:
+                    return True
+            else:
+                return True
+
+        raise Exception("Check connection failed:\n%s" % res)
+
+    async def do(self, method, content=None, headers=None, http_method=None, return_format=None):
+        return await self.do_request(*self.build_request(method, content, headers, http_method, return_format))
+
+    async def iter_pages(self, method, content=None, headers=None, http_method=None, return_format=None,
+                         prefetch=False, paginator=None):
+        """Async generator over all pages of a listing, see :func:`pyrate.main.Pyrate.iter_pages`.
+
+        :param bool prefetch: Fetch the next page in a task while the current one is consumed
+        """
+
+        paginator = paginator or self.paginator
+        if paginator is None:
+            raise NotImplementedError("%s does not define a paginator" % type(self).__name__)
+
+        http_method, url, headers, body, return_format = self.build_request(method, content, headers, http_method,
+                                                                            return_format)
+
+        async def fetch(request):
+            page_url, page_content = request
+            response = await self.send_request(http_method, page_url, headers, page_content)
+            page = self.handle_response(response, return_format)
+            return page, paginator.next_request(page_url, page_content, response, page)
+
+        # A page equal to the previous one means the service ignored the pagination parameters
+        request, previous = paginator.first_request(url, body), object()
+        if not prefetch:
+            while request is not None:
+                page, request = await fetch(request)
+                if page == previous:
+                    return
+                previous = page
+                yield page
+            return
+
+        task = asyncio.ensure_future(fetch(request))
+        try:
+            while task is not None:
+                page, request = await task
+                if page == previous:
+                    return
+                previous = page
+                task = asyncio.ensure_future(fetch(request)) if request is not None else None
+                yield page
+        finally:
+            if task is not None:
+                task.cancel()
+
+    async def iter_items(self, method, content=None, headers=None, http_method=None, return_format=None,
+                         prefetch=False, paginator=None, items_key=None):
+        """Async generator over the items of all pages of a listing, see :func:`iter_pages`."""
+
+        paginator = paginator or self.paginator
+        async for page in self.iter_pages(method, content, headers, http_method, return_format, prefetch, paginator):
+            for item in paginator.items(page, items_key):
+                yield item
+
+    async def do_stream(self, method, content=None, headers=None, http_method=None, return_format=None, path=None):
+        """Async generator over the items of a large JSON array response, decoded while the body is being
+        downloaded, see :func:`pyrate.main.Pyrate.do_stream`.
+
+        ijson decodes the body as it is read; without it, the pure Python decoder runs on a worker thread, pulling
+        the chunks from the event loop. Streamed requests are paced by the rate limiter but not retried, cached or
+        recorded in the metrics.
+        """
+
+        http_method, url, headers, body, return_format = self.build_request(method, content, headers, http_method,
+                                                                            return_format)
+        rate_limiter = self.get_rate_limiter()
+        if rate_limiter is not None:
+            family = self.rate_limit_family(url)
+            await self.throttle(rate_limiter.reserve(family))
+
+        url, headers, body = self.prepare_request(http_method, url, headers, body)
+        session = self.get_client_session()
+        async with self._semaphore:
+            async with session.request(http_method, url, data=body, headers=headers) as r:
+                if rate_limiter is not None:
+                    rate_limiter.update(family, r.headers, r.status)
+                if r.status >= 400:
+                    self.build_response(r, await r.read()).raise_for_status()
+
+                path = self.stream_path if path is None else path
+                ijson = get_ijson()
+                if ijson is not None:
+                    async for item in ijson.items(r.content, '.'.join(tuple(path) + ('item',)), use_float=True):
+                        yield item
+                    return
+
+                loop = asyncio.get_event_loop()
+
+                def chunks():
+                    while True:
+                        chunk = asyncio.run_coroutine_threadsafe(r.content.readany(), loop).result()
+                        if not chunk:
+                            return
+                        yield chunk
+
+                items = iter_json_items(chunks(), path)
+                while True:
+                    # A batch of items per trip to the worker thread
+                    batch = await loop.run_in_executor(None, list, islice(items, STREAM_BATCH))
+                    for item in batch:
+                        yield item
+                    if len(batch) < STREAM_BATCH:
+                        return
+
+    def do_many(self, calls, max_workers=None, as_completed=False):
+        """Runs many calls concurrently as tasks of the running event loop, see :func:`pyrate.main.Pyrate.do_many`.
+
+        Returns a coroutine of the list of results in call order, or with ``as_completed`` an async generator of
+        ``(index, result)`` pairs in completion order::
+
+            results = await h.do_many(calls)
+            async for index, result in h.do_many(calls, as_completed=True):
+                ...
+
+        :param int max_workers: Number of calls running at once, defaults to :attr:`max_concurrency`
+        """
+
+        return run_many(self.do, calls, max_workers or self.max_concurrency, as_completed)
+
+    async def do_request(self, http_method, url, headers, body, return_format):
+        http_method = http_method.upper()
+        if http_method not in ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'):
+            raise Exception("Invalid request method")
+
+        key = self.coalesce_key(http_method, url, headers, body)
+        if key is None:
+            response = await self.send_request(http_method, url, headers, body)
+        else:
+            response = await self._flights.do(key, self.send_request, http_method, url, headers, body)
+        return self.handle_response(response, return_format)
+
+    async def send_request(self, http_method, url, headers, body):
+        """Awaitable :func:`pyrate.main.Pyrate.send_request`, going through the response cache for GET requests.
+
+        :rtype: :class:`requests.Response`
+        """
+
+        if http_method.upper() == 'GET':
+            url, body = add_query_params(url, body), None
+
+        if self.cache is None or http_method.upper() != 'GET':
+            return await self.send_uncached_request(http_method, url, headers, body)
+
+        key = self.cache_key(url, headers)
+        entry = self.cache.get(key)
+        if entry is not None and entry.is_fresh():
+            self._count('hits')
+            return entry.to_response()
+
+        response = await self.send_uncached_request('GET', url, self.revalidation_headers(entry, headers), None)
+        return self.store_response(key, entry, url, response)
+
+    async def send_uncached_request(self, http_method, url, headers, body):
+        """Sends a request over the network, retrying it as allowed by :attr:`retry_policy`. Backoffs are awaited
+        with :func:`asyncio.sleep` rather than the ``sleep`` of the policy.
+
+        :rtype: :class:`requests.Response`
+        """
+
+        policy = self.retry_policy
+        if policy is not None and policy.budget is not None:
+            policy.budget.record_request()
+
+        attempt = 0
+        while True:
+            try:
+                r = await self.send_once(http_method, url, headers, body)
+            except aiohttp.ClientConnectionError:
+                if policy is None or not policy.should_retry(http_method, attempt):
+                    raise
+                delay = policy.backoff(attempt)
+            else:
+                if policy is None or not policy.should_retry(http_method, attempt, r):
+                    return r
+                delay = policy.backoff(attempt, r)
+
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def send_once(self, http_method, url, headers, body):
+        """Sends a request once, waiting for the rate limiters without blocking the event loop, timing it and
+        dispatching the hooks.
+
+        :rtype: :class:`requests.Response`
+        """
+
+        record = RequestRecord(self.get_service_name(), self.endpoint_label(url), http_method.upper(), url)
+        self.dispatch_hook('request', record)
+        record.start()
+
+        try:
+            rate_limiter = self.get_rate_limiter()
+            if rate_limiter is not None:
+                family = self.rate_limit_family(url)
+                start = clock()
+                await self.throttle(rate_limiter.reserve(family))
+                record.timing['throttle'] = clock() - start
+
+            if self.creates_content(http_method, url):
+                content_limiter = self.get_content_limiter()
+                if content_limiter is not None:
+                    start = clock()
+                    await self.throttle(content_limiter.reserve())
+                    record.timing['throttle'] += clock() - start
+
+            # Signed again for every attempt
+            url, headers, body = self.prepare_request(http_method, url, headers, body)
+            session = self.get_client_session()
+            start = clock()
+            async with self._semaphore:
+                record.timing['queue_wait'] = clock() - start
+                async with session.request(http_method, url, data=body, headers=headers) as r:
+                    record.mark_headers(r)
+                    elapsed = clock() - start
+                    content = await r.read()
+                    response = self.build_response(r, content)
+            response.elapsed = datetime.timedelta(seconds=elapsed)
+            response.request = self.build_prepared_request(http_method, url, headers, body)
+        except Exception as e:
+            record.finish(error=e)
+            self.record_request(record)
+            self.dispatch_hook('error', record)
+            raise
+
+        if rate_limiter is not None:
+            rate_limiter.update(family, response.headers, response.status_code)
+
+        record.finish(response)
+        self.record_request(record)
+        self.dispatch_hook('response', record)
+        return response
+
+    async def throttle(self, delay):
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def prepare_request(self, http_method, url, headers, body):
+        """Encodes and authenticates a request for aiohttp.
+
+        :rtype: tuple ``(url, headers, body)``
+        """
+
+        headers = dict(headers or {})
+        if http_method == 'GET':
+            url, body = add_query_params(url, body), None
+        else:
+            body = self.encode_body(body)
+            if isinstance(body, dict):
+                body = urlencode(body)
+                headers.setdefault('Content-Type', 'application/x-www-form-urlencoded')
+
+        auth = self.get_auth()
+        if auth is not None:
+            url, headers, body = auth.sign(http_method, url, headers, body)
+
+        return url, headers, body
+
+    def build_prepared_request(self, http_method, url, headers, body):
+        request = PreparedRequest()
+        request.method, request.url, request.body = http_method, url, body
+        request.headers = CaseInsensitiveDict(headers)
+        return request
+
+    def build_response(self, client_response, content):
+        """Wraps an aiohttp response in a :class:`requests.Response` so :func:`handle_response` and its overrides
+        work unchanged."""
+
+        response = Response()
+        response.status_code = client_response.status
+        response.reason = client_response.reason
+        response.headers = CaseInsensitiveDict(client_response.headers)
+        response.url = str(client_response.url)
+        response.encoding = client_response.charset
+        response._content = content
+        response._content_consumed = True
+        return response
+
+    #Proxy functions for usability
+    async def get(self, method, content=None, headers=None, return_format=None):
+        return await self.do(method, content, headers, 'GET', return_format)
+
+    async def post(self, method, content=None, headers=None, return_format=None):
+        return await self.do(method, content, headers, 'POST', return_format)
+
+    async def put(self, method, content=None, headers=None, return_format=None):
+        return await self.do(method, content, headers, 'PUT', return_format)
+
+    async def patch(self, method, content=None, headers=None, return_format=None):
+        return await self.do(method, content, headers, 'PATCH', return_format)
+
+    async def delete(self, method, content=None, headers=None, return_format=None):
+        return await self.do(method, content, headers, 'DELETE', return_format)
+
+    async def options(self, method, content=None, headers=None, return_format=None):
+        return await self.do(method, content, headers, 'OPTIONS', return_format)
+
+
+class AsyncGraphQLBatch(GraphQLBatch):
+    """Awaitable counterpart of :class:`pyrate.graphql.GraphQLBatch`, returned by ``graphql_batch`` of the async
+    pyrates. The queries of a batch are sent concurrently::
+
+        async with h.graphql_batch() as batch:
+            repo = batch.add('repository(owner: $owner, name: $name) { stargazerCount }', owner='me', name='x')
+        repo.result()
+    """
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' for %s" % type(self).__name__)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            await self.execute()
+
+    async def execute(self):
+        lookups, self.pending = self.pending, []
+        queries = [self.build_query(chunk) for chunk in self.chunks(lookups)]
+        responses = await asyncio.gather(*[self.pyrate.graphql(query, variables) for query, variables in queries])
+
+        failure = None
+        for chunk, response in zip(self.chunks(lookups), responses):
+            error = self.answer(chunk, response)
+            failure = failure or error
+
+        if failure is not None:
+            raise failure
+
+
+class AsyncStream(StreamConsumer):
+    """Async iterator over the decoded messages of a streaming endpoint, read by a task of the running event loop.
+
+    See :class:`pyrate.streaming.StreamConsumer` for the options. The connection is opened when iteration starts and
+    closed by :func:`close` (or leaving the ``async with`` block).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncStream, self).__init__(*args, **kwargs)
+        self.queue = None
+        self.task = None
+        self._closed_event = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        self.start()
+        item = await self.queue.get()
+        if item is _CLOSED:
+            raise StopAsyncIteration
+        if isinstance(item, _Failure):
+            raise item.exception
+        return item
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.close()
+
+    def start(self):
+        if self.task is None:
+            self.queue = asyncio.Queue(self.queue_size)
+            self._closed_event = asyncio.Event()
+            self.task = asyncio.ensure_future(self.run())
+
+    async def close(self):
+        self.closed = True
+        if self.task is None:
+            return
+
+        self._closed_event.set()
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+        # Wake up the consumer, nobody needs the queued messages anymore
+        while True:
+            try:
+                self.queue.put_nowait(_CLOSED)
+                return
+            except asyncio.QueueFull:
+                self.queue.get_nowait()
+
+    async def wait(self, delay):
+        try:
+            await asyncio.wait_for(self._closed_event.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self):
+        try:
+            await self.consume()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            await self.queue.put(_Failure(e))
+        else:
+            await self.queue.put(_CLOSED)
+
+    async def consume(self):
+        pyrate = self.pyrate
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=self.connect_timeout, sock_read=self.stall_timeout)
+
+        while not self.closed:
+            self.check_reconnect()
+            self.connections += 1
+
+            # Signed again for every connection
+            url, headers, body = pyrate.prepare_request(self.http_method, self.url, self.headers, self.content)
+            try:
+                async with pyrate.get_client_session().request(self.http_method, url, data=body, headers=headers,
+                                                               timeout=timeout) as r:
+                    if r.status != 200:
+                        await self.wait(self.check_status(r.status, await r.read()))
+                        continue
+
+                    self.backoff.reset()
+                    parser = MessageParser(self.delimited)
+                    async for chunk in r.content.iter_any():
+                        for raw in parser.feed(chunk):
+                            message = self.decode(raw)
+                            if message is not None:
+                                self.received += 1
+                                await self.put(message)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                # Stalled or dropped
+                pass
+
+            await self.wait(self.backoff.network_error())
+
+    async def put(self, message):
+        if not self.offer(self.queue, message, asyncio.QueueFull):
+            await self.queue.put(message)
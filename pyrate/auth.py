@@ -0,0 +1,251 @@
+"""Authentication schemes of the services.
+
+A provider is created once per pyrate (see :func:`pyrate.main.Pyrate.get_auth`) and shared by all its calls and
+threads. Static credentials (:attr:`AuthProvider.headers` and :attr:`AuthProvider.content`) are compiled into the
+request template, so they cost nothing per call. Providers that sign each request do so in ``__call__`` for
+requests and in :func:`AuthProvider.sign` for the asyncio engine.
+"""
+from base64 import b64encode
+import binascii
+import hashlib
+import hmac
+import os
+import sys
+import threading
+import time
+
+from requests.auth import AuthBase
+
+try:
+    from urllib.parse import parse_qsl, quote, urlparse, urlunparse
+except ImportError:
+    from urllib import quote
+    from urlparse import parse_qsl, urlparse, urlunparse
+
+__docformat__ = 'sphinx en'
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+
+def basic_auth_header(user, password):
+    """Returns the ``Authorization`` header value for HTTP Basic Authentification."""
+
+    # Messing around with Python3's strictness about strings
+    if sys.version_info >= (3, 0):
+        if not isinstance(user, str):
+            user = user.decode('utf-8')
+
+        if not isinstance(password, str):
+            password = password.decode('utf-8')
+
+        return 'Basic ' + b64encode((user + ":" + password).encode('utf-8')).decode('utf-8')
+
+    else:
+        return 'Basic ' + b64encode(user + ":" + password).rstrip()
+
+
+class AuthProvider(AuthBase):
+    """Base class of the authentication schemes.
+
+    :param dict headers: Headers added to every request
+    :param dict content: Content added to every request (query string for GET requests, body otherwise)
+    """
+
+    headers = None
+    content = None
+
+    def identity(self):
+        """Returns a string identifying the credentials, used by :func:`pyrate.main.Pyrate.auth_identity`."""
+        raise NotImplementedError('Please implement in subclass')
+
+    def __call__(self, r):
+        return r
+
+    def sign(self, http_method, url, headers, body):
+        """Authenticates a request of the asyncio engine. ``headers`` is a copy owned by the request.
+
+        :rtype: tuple ``(url, headers, body)``
+        """
+
+        return url, headers, body
+
+
+class BasicAuth(AuthProvider):
+    """HTTP Basic Authentification, the header is encoded once."""
+
+    def __init__(self, user, password):
+        self.user = user
+        self.headers = {'Authorization': basic_auth_header(user, password)}
+
+    def identity(self):
+        return 'basic:' + self.headers['Authorization']
+
+
+class ApiKeyAuth(AuthProvider):
+    """A static API key.
+
+    :param string key: The API key
+    :param string name: Name of the header or parameter holding the key
+    :param string location: ``'header'`` or ``'content'``
+    """
+
+    def __init__(self, key, name='apikey', location='content'):
+        if location not in ('header', 'content'):
+            raise ValueError("Invalid API key location: %r" % (location,))
+
+        self.key = key
+        if location == 'header':
+            self.headers = {name: key}
+        else:
+            self.content = {name: key}
+
+    def identity(self):
+        return 'apikey:' + self.key
+
+
+def oauth_escape(value):
+    """Percent-encodes a value as required by OAuth (RFC 5849, section 3.6)."""
+
+    if not isinstance(value, bytes):
+        value = value.encode('utf-8')
+    return quote(value, safe='~')
+
+
+def oauth_base_uri(url):
+    """Returns the base string URI of ``url`` (RFC 5849, section 3.4.1.2)."""
+
+    parts = urlparse(url)
+    scheme, port = parts.scheme.lower(), parts.port
+    netloc = parts.hostname
+    if port is not None and (scheme, port) not in (('http', 80), ('https', 443)):
+        netloc += ':%d' % port
+    return urlunparse((scheme, netloc, parts.path or '/', parts.params, '', '')).replace(' ', '%20')
+
+
+class OAuth1Auth(AuthProvider):
+    """OAuth 1.0a request signing (HMAC-SHA1, credentials in the ``Authorization`` header).
+
+    The credentials are escaped and the signing key derived once, so each request only pays for its own parameters.
+    Form-encoded bodies are signed, other bodies (e.g. JSON) are not, as with requests_oauthlib.
+    """
+
+    def __init__(self, consumer_key, consumer_secret, token, token_secret):
+        self.consumer_key = consumer_key
+        self.token = token
+        self.key = (oauth_escape(consumer_secret) + '&' + oauth_escape(token_secret)).encode('ascii')
+        self.oauth_params = (('oauth_consumer_key', consumer_key), ('oauth_signature_method', 'HMAC-SHA1'),
+                             ('oauth_token', token), ('oauth_version', '1.0'))
+        self.escaped_params = [(oauth_escape(k), oauth_escape(v)) for k, v in self.oauth_params]
+
+    def identity(self):
+        return 'oauth1:' + self.consumer_key + ':' + self.token
+
+    def authorization(self, http_method, url, body_params=(), nonce=None, timestamp=None):
+        """Returns the ``Authorization`` header of a request.
+
+        :param list body_params: ``(name, value)`` pairs of a form-encoded body
+        """
+
+        if nonce is None:
+            nonce = binascii.hexlify(os.urandom(16)).decode('ascii')
+        if timestamp is None:
+            timestamp = str(int(time.time()))
+
+        oauth_params = [('oauth_nonce', nonce), ('oauth_timestamp', timestamp)]
+        params = self.escaped_params + [(oauth_escape(k), oauth_escape(v)) for k, v in oauth_params]
+
+        query = url.partition('?')[2]
+        for k, v in parse_qsl(query, keep_blank_values=True) + list(body_params):
+            params.append((oauth_escape(k), oauth_escape(v)))
+        params.sort()
+
+        base = '&'.join((http_method.upper(), oauth_escape(oauth_base_uri(url)),
+                         oauth_escape('&'.join(k + '=' + v for k, v in params))))
+        signature = b64encode(hmac.new(self.key, base.encode('utf-8'), hashlib.sha1).digest()).decode('ascii')
+
+        oauth_params.append(('oauth_signature', signature))
+        return 'OAuth ' + ', '.join('%s="%s"' % (oauth_escape(k), oauth_escape(v))
+                                    for k, v in list(self.oauth_params) + oauth_params)
+
+    def body_params(self, content_type, body):
+        if not body or FORM_CONTENT_TYPE not in (content_type or ''):
+            return ()
+        if isinstance(body, bytes):
+            body = body.decode('utf-8')
+        return parse_qsl(body, keep_blank_values=True)
+
+    def __call__(self, r):
+        body_params = self.body_params(r.headers.get('Content-Type'), r.body)
+        r.headers['Authorization'] = self.authorization(r.method, r.url, body_params)
+        return r
+
+    def sign(self, http_method, url, headers, body):
+        body_params = self.body_params(headers.get('Content-Type'), body)
+        headers['Authorization'] = self.authorization(http_method, url, body_params)
+        return url, headers, body
+
+
+class BearerAuth(AuthProvider):
+    """Bearer tokens, optionally refreshed before they expire.
+
+    The token is refreshed ``refresh_margin`` seconds ahead of its expiry, by a single thread while the others wait
+    for the new token.
+
+    :param string token: The current token, None to fetch one with ``refresh`` on first use
+    :param float expires_at: Unix time the token expires at, None if it does not expire
+    :param refresh: Function returning a new ``(token, expires_in)`` pair, ``expires_in`` in seconds or None
+    :param int refresh_margin: Seconds before the expiry the token is refreshed
+    :param string account: Stable name of the account, used as identity since tokens change
+    """
+
+    def __init__(self, token=None, expires_at=None, refresh=None, refresh_margin=60, account=None, clock=time.time):
+        if token is None and refresh is None:
+            raise ValueError("BearerAuth needs a token or a refresh function")
+
+        self.refresh_function = refresh
+        self.refresh_margin = refresh_margin
+        self.account = account
+        self.clock = clock
+        self._lock = threading.Lock()
+        # (header, expires_at), replaced as a whole so readers never see half of a refresh
+        self._state = (None if token is None else 'Bearer ' + token, expires_at)
+
+    def identity(self):
+        return 'bearer:' + (self.account or '%x' % id(self))
+
+    def expired(self, state):
+        header, expires_at = state
+        if header is None:
+            return True
+        return (expires_at is not None and self.refresh_function is not None
+                and self.clock() >= expires_at - self.refresh_margin)
+
+    def get_header(self):
+        state = self._state
+        if self.expired(state):
+            self.refresh(state)
+        return self._state[0]
+
+    def refresh(self, state=None):
+        """Fetches a new token, unless the token has been replaced since ``state`` was read."""
+
+        with self._lock:
+            if state is not None and self._state is not state:
+                return
+
+            token, expires_in = self.refresh_function()
+            expires_at = None if expires_in is None else self.clock() + expires_in
+            self._state = ('Bearer ' + token, expires_at)
+
+    def invalidate(self):
+        """Fetches a new token right away, e.g. after the server rejected the current one."""
+
+        self.refresh(self._state)
+
+    def __call__(self, r):
+        r.headers['Authorization'] = self.get_header()
+        return r
+
+    def sign(self, http_method, url, headers, body):
+        headers['Authorization'] = self.get_header()
+        return url, headers, body
@@ -0,0 +1,279 @@
+"""Response caching for GET calls, see :attr:`pyrate.main.Pyrate.cache`."""
+from collections import OrderedDict
+import json
+import os
+import re
+import threading
+import time
+import zlib
+
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+__docformat__ = 'sphinx en'
+
+
+class CacheEntry(object):
+    """A cached response together with its validators.
+
+    :param int status_code: HTTP status of the cached response
+    :param dict headers: Response headers
+    :param bytes content: Response body
+    :param string url: The requested url
+    :param string encoding: Encoding of the body as detected by requests
+    :param float expires_at: Timestamp after which the entry needs to be revalidated
+    """
+
+    def __init__(self, status_code, headers, content, url, encoding, expires_at):
+        self.status_code = status_code
+        self.headers = dict(headers)
+        self.content = content
+        self.url = url
+        self.encoding = encoding
+        self.expires_at = expires_at
+
+    @classmethod
+    def from_response(cls, response, ttl):
+        return cls(response.status_code, response.headers, response.content, response.url, response.encoding,
+                   time.time() + ttl)
+
+    @property
+    def etag(self):
+        return CaseInsensitiveDict(self.headers).get('ETag')
+
+    @property
+    def last_modified(self):
+        return CaseInsensitiveDict(self.headers).get('Last-Modified')
+
+    @property
+    def size(self):
+        return len(self.content or b'') + sum(len(k) + len(v) for k, v in self.headers.items())
+
+    def is_fresh(self):
+        return time.time() < self.expires_at
+
+    def to_response(self):
+        response = Response()
+        response.status_code = self.status_code
+        response.headers = CaseInsensitiveDict(self.headers)
+        response._content = self.content
+        response.url = self.url
+        response.encoding = self.encoding
+        return response
+
+
+class ResponseCache(object):
+    """Base class of the cache backends.
+
+    Backends store :class:`CacheEntry` objects by key, this class decides how long they stay fresh.
+
+    :param int default_ttl: Seconds a response stays fresh when no pattern in ``ttls`` matches
+    :param dict ttls: Regular expressions searched in the request url, mapped to their TTL in seconds
+    """
+
+    def __init__(self, default_ttl=60, ttls=None):
+        self.default_ttl = default_ttl
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls or {}).items()]
+
+    def ttl_for(self, url):
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+
+        return self.default_ttl
+
+    def get(self, key):
+        raise NotImplementedError('Please implement in subclass')
+
+    def set(self, key, entry):
+        raise NotImplementedError('Please implement in subclass')
+
+    def delete(self, key):
+        raise NotImplementedError('Please implement in subclass')
+
+    def clear(self):
+        raise NotImplementedError('Please implement in subclass')
+
+
+class MemoryCache(ResponseCache):
+    """In-memory LRU cache, bounded by number of entries and total size.
+
+    :param int max_entries: Maximum number of cached responses
+    :param int max_bytes: Maximum total size of the cached responses
+    """
+
+    def __init__(self, max_entries=1000, max_bytes=50 * 1024 * 1024, default_ttl=60, ttls=None):
+        super(MemoryCache, self).__init__(default_ttl, ttls)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                # Re-insert as most recently used
+                self._entries[key] = entry
+            return entry
+
+    def set(self, key, entry):
+        if entry.size > self.max_bytes:
+            self.delete(key)
+            return
+
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+
+            self._entries[key] = entry
+            self.size += entry.size
+
+            while len(self._entries) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def delete(self, key):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.size -= entry.size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class SQLiteCache(ResponseCache):
+    """On-disk LRU cache in an SQLite database, shared by all processes and threads using the same file.
+
+    The database runs in WAL mode, so readers are not blocked by writers. Bodies are stored zlib-compressed when
+    that makes them smaller. Once the cached responses exceed ``max_bytes``, the least recently used are evicted.
+
+    :param string path: Path of the database file, created if missing
+    :param int max_bytes: Maximum total size of the cached responses, as stored
+    :param int compress_level: zlib compression level, 0 to store bodies uncompressed
+    :param int min_compress_size: Bodies smaller than this are stored uncompressed
+    :param float timeout: Seconds to wait for a lock held by another process
+    """
+
+    # Seconds between updates of the last access time of an entry, to spare most reads a write
+    touch_interval = 1.0
+
+    schema = (
+        'CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, status_code INTEGER, headers TEXT, content BLOB, '
+        'compressed INTEGER, url TEXT, encoding TEXT, expires_at REAL, size INTEGER, accessed_at REAL)',
+        'CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)',
+        # Total size maintained by triggers, so that it is correct whichever process writes
+        'CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER)',
+        'INSERT OR IGNORE INTO totals VALUES (0, 0)',
+        'CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN '
+        'UPDATE totals SET size = size + NEW.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN '
+        'UPDATE totals SET size = size - OLD.size; END',
+        'CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN '
+        'UPDATE totals SET size = size - OLD.size + NEW.size; END',
+    )
+
+    def __init__(self, path, max_bytes=200 * 1024 * 1024, compress_level=6, min_compress_size=512, timeout=30,
+                 default_ttl=60, ttls=None):
+        super(SQLiteCache, self).__init__(default_ttl, ttls)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.compress_level = compress_level
+        self.min_compress_size = min_compress_size
+        self.timeout = timeout
+        self._local = threading.local()
+
+        with self.connect() as db:
+            for statement in self.schema:
+                db.execute(statement)
+
+    def __len__(self):
+        return self.connect().execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def __getstate__(self):
+        # Connections stay with their process
+        state = dict(self.__dict__)
+        del state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    @property
+    def size(self):
+        return self.connect().execute('SELECT size FROM totals').fetchone()[0]
+
+    def connect(self):
+        """Returns the connection of the current thread, connections are not shared with forked processes."""
+
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            import sqlite3
+
+            db = sqlite3.connect(self.path, timeout=self.timeout)
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute('PRAGMA synchronous=NORMAL')
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def get(self, key):
+        db = self.connect()
+        row = db.execute('SELECT status_code, headers, content, compressed, url, encoding, expires_at, accessed_at '
+                         'FROM entries WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+
+        status_code, headers, content, compressed, url, encoding, expires_at, accessed_at = row
+        now = time.time()
+        if now - accessed_at >= self.touch_interval:
+            with db:
+                db.execute('UPDATE entries SET accessed_at = ? WHERE key = ?', (now, key))
+
+        content = bytes(content) if content is not None else None
+        if compressed:
+            content = zlib.decompress(content)
+        return CacheEntry(status_code, json.loads(headers), content, url, encoding, expires_at)
+
+    def set(self, key, entry):
+        content, compressed = entry.content, False
+        if content and self.compress_level and len(content) >= self.min_compress_size:
+            packed = zlib.compress(content, self.compress_level)
+            if len(packed) < len(content):
+                content, compressed = packed, True
+
+        headers = json.dumps(entry.headers)
+        size = len(content or b'') + len(headers)
+        if size > self.max_bytes:
+            self.delete(key)
+            return
+
+        import sqlite3
+
+        db = self.connect()
+        with db:
+            # Not INSERT OR REPLACE, which would skip the delete trigger
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+            db.execute('INSERT INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                       (key, entry.status_code, headers, None if content is None else sqlite3.Binary(content),
+                        compressed, entry.url, entry.encoding, entry.expires_at, size, time.time()))
+            while db.execute('SELECT size FROM totals').fetchone()[0] > self.max_bytes:
+                db.execute('DELETE FROM entries WHERE key = (SELECT key FROM entries ORDER BY accessed_at LIMIT 1)')
+
+    def delete(self, key):
+        db = self.connect()
+        with db:
+            db.execute('DELETE FROM entries WHERE key = ?', (key,))
+
+    def clear(self):
+        db = self.connect()
+        with db:
+            db.execute('DELETE FROM entries')
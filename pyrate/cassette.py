@@ -0,0 +1,235 @@
+"""Recording and replaying of HTTP exchanges, see :attr:`pyrate.main.Pyrate.adapter`.
+
+A :class:`CassetteAdapter` in record mode sends requests over the network and stores the responses in a
+:class:`Cassette`; in replay mode it answers from the cassette without any network access, optionally after an
+injected latency. Requests are matched on method, url (query parameters in any order) and body::
+
+    h.adapter = CassetteAdapter(Cassette('github.cassette'), record=True)
+    ...
+    h.close()  # saves the cassette
+
+Cassettes are gzipped JSON lines. Request headers are not stored, so credentials sent in headers stay out of them;
+request bodies are only stored as a hash.
+"""
+import base64
+import gzip
+import hashlib
+import io
+import json
+import os
+import random
+import threading
+import time
+
+from urllib3.response import HTTPResponse
+
+from pyrate.instrumentation import InstrumentedAdapter
+
+try:
+    from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+except ImportError:
+    from urllib import urlencode
+    from urlparse import parse_qsl, urlsplit, urlunsplit
+
+__docformat__ = 'sphinx en'
+
+# Response headers describing the transfer rather than the content, recomputed on replay
+TRANSFER_HEADERS = ('connection', 'content-encoding', 'content-length', 'keep-alive', 'set-cookie',
+                    'transfer-encoding')
+
+
+class CassetteMissError(Exception):
+    """A request has no recorded exchange in the cassette being replayed."""
+    pass
+
+
+def normalize_url(url):
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((parts.scheme, parts.netloc.lower(), parts.path, query, ''))
+
+
+def request_key(method, url, body):
+    """Returns the key matching requests with the same method, url and body."""
+
+    if body is None:
+        body = b''
+    elif not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    digest = hashlib.sha1(body).hexdigest()
+    return '%s %s %s' % (method.upper(), normalize_url(url), digest)
+
+
+class Exchange(object):
+    """A recorded response, with the request it answered.
+
+    :param list headers: Response headers as ``(name, value)`` pairs, without :data:`TRANSFER_HEADERS`
+    :param bytes content: Decoded response body
+    :param float elapsed: Seconds the server took to answer
+    """
+
+    def __init__(self, key, method, url, status, reason, headers, content, elapsed=0.0):
+        self.key = key
+        self.method = method
+        self.url = url
+        self.status = status
+        self.reason = reason
+        self.headers = headers
+        self.content = content
+        self.elapsed = elapsed
+
+    def __repr__(self):
+        return '<Exchange %s %s %s>' % (self.method, self.url, self.status)
+
+    @classmethod
+    def from_response(cls, request, response):
+        headers = [(k, v) for k, v in response.headers.items() if k.lower() not in TRANSFER_HEADERS]
+        return cls(request_key(request.method, request.url, request.body), request.method, request.url,
+                   response.status_code, response.reason, headers, response.content or b'',
+                   response.elapsed.total_seconds())
+
+    def to_dict(self):
+        data = {'key': self.key, 'method': self.method, 'url': self.url, 'status': self.status,
+                'reason': self.reason, 'headers': self.headers, 'elapsed': self.elapsed}
+        try:
+            data['text'] = self.content.decode('utf-8')
+        except UnicodeDecodeError:
+            data['base64'] = base64.b64encode(self.content).decode('ascii')
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        if 'text' in data:
+            content = data['text'].encode('utf-8')
+        else:
+            content = base64.b64decode(data['base64'])
+        return cls(data['key'], data['method'], data['url'], data['status'], data['reason'],
+                   [tuple(header) for header in data['headers']], content, data.get('elapsed', 0.0))
+
+
+class Cassette(object):
+    """Exchanges by request, replayed in the order they were recorded.
+
+    Once the exchanges recorded for a request are used up, the last one is replayed for every further identical
+    request, so a short recording can feed a long load test.
+
+    :param string path: File the cassette is loaded from (if it exists) and saved to
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.exchanges = {}
+        self.recorded = 0
+        self.replayed = 0
+        self._cursors = {}
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return sum(len(exchanges) for exchanges in self.exchanges.values())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.save()
+
+    def add(self, exchange):
+        with self._lock:
+            self.exchanges.setdefault(exchange.key, []).append(exchange)
+            self.recorded += 1
+
+    def play(self, method, url, body):
+        """Returns the next exchange recorded for a request.
+
+        :raises CassetteMissError: if the request was never recorded
+        """
+
+        key = request_key(method, url, body)
+        exchanges = self.exchanges.get(key)
+        if not exchanges:
+            raise CassetteMissError("No recorded exchange for %s %s" % (method, url))
+
+        with self._lock:
+            cursor = self._cursors.get(key, 0)
+            self._cursors[key] = cursor + 1
+            self.replayed += 1
+        return exchanges[min(cursor, len(exchanges) - 1)]
+
+    def rewind(self):
+        """Replays the exchanges from the start again."""
+
+        with self._lock:
+            self._cursors.clear()
+
+    def load(self, path=None):
+        path = path or self.path
+        with gzip.open(path, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    exchange = Exchange.from_dict(json.loads(line.decode('utf-8')))
+                    self.exchanges.setdefault(exchange.key, []).append(exchange)
+
+    def save(self, path=None):
+        path = path or self.path
+        if path is None:
+            raise ValueError("The cassette has no path to save to")
+
+        with self._lock:
+            exchanges = [exchange for recorded in self.exchanges.values() for exchange in recorded]
+        with gzip.open(path, 'wb') as f:
+            for exchange in exchanges:
+                f.write(json.dumps(exchange.to_dict(), sort_keys=True).encode('utf-8') + b'\n')
+
+
+class CassetteAdapter(InstrumentedAdapter):
+    """Transport adapter recording exchanges into a cassette, or replaying them from it.
+
+    :param cassette: The :class:`Cassette`
+    :param bool record: Whether to send requests over the network and record them, instead of replaying
+    :param latency: Seconds to wait before answering a replayed request, ``'recorded'`` for the time the server
+        took when it was recorded, None to answer right away
+    :param float jitter: Maximum seconds added at random to the latency
+    :param sleep: Function called with the seconds to wait
+    """
+
+    def __init__(self, cassette, record=False, latency=None, jitter=0.0, sleep=time.sleep, **kwargs):
+        super(CassetteAdapter, self).__init__(**kwargs)
+        self.cassette = cassette
+        self.record = record
+        self.latency = latency
+        self.jitter = jitter
+        self.sleep = sleep
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        if self.record:
+            response = super(CassetteAdapter, self).send(request, stream, timeout, verify, cert, proxies)
+            try:
+                exchange = Exchange.from_response(request, response)
+            finally:
+                response.close()
+            self.cassette.add(exchange)
+            return self.replay(request, exchange)
+
+        exchange = self.cassette.play(request.method, request.url, request.body)
+        delay = exchange.elapsed if self.latency == 'recorded' else (self.latency or 0.0)
+        if self.jitter:
+            delay += random.uniform(0, self.jitter)
+        if delay > 0:
+            self.sleep(delay)
+        return self.replay(request, exchange)
+
+    def replay(self, request, exchange):
+        """Returns a :class:`requests.Response` to ``request`` made from a recorded exchange."""
+
+        headers = list(exchange.headers)
+        headers.append(('Content-Length', str(len(exchange.content))))
+        raw = HTTPResponse(body=io.BytesIO(exchange.content), headers=headers, status=exchange.status,
+                           reason=exchange.reason, preload_content=False, decode_content=False)
+        return self.build_response(request, raw)
+
+    def close(self):
+        super(CassetteAdapter, self).close()
+        if self.record and self.cassette.path is not None:
+            self.cassette.save()
@@ -0,0 +1,56 @@
+"""Compression of request and response bodies, see :attr:`pyrate.main.Pyrate.compress_requests`.
+
+Responses are negotiated with every encoding urllib3 can decode here: gzip and deflate always, brotli (``br``) with
+the ``brotli`` package installed and zstd with ``zstandard``. urllib3 decodes them chunk by chunk as the body is
+read, also when it is streamed.
+"""
+import struct
+import zlib
+
+__docformat__ = 'sphinx en'
+
+_accept_encoding = None
+
+
+def accept_encoding():
+    """Returns the ``Accept-Encoding`` header value listing the encodings that can be decoded."""
+
+    global _accept_encoding
+    if _accept_encoding is None:
+        from urllib3.util.request import ACCEPT_ENCODING
+        _accept_encoding = ', '.join(ACCEPT_ENCODING.split(','))
+    return _accept_encoding
+
+
+def gzip_compress(data, level=6):
+    """Returns ``data`` compressed in the gzip format."""
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+
+def gzip_size(data):
+    """Returns the uncompressed size of gzip compressed ``data``, read from its trailer (modulo 4 GiB)."""
+
+    return struct.unpack('<I', data[-4:])[0]
+
+
+def request_bytes_saved(request):
+    """Returns the bytes saved by compressing the body of a sent :class:`requests.PreparedRequest`."""
+
+    body = getattr(request, 'body', None)
+    if not isinstance(body, bytes) or len(body) < 18 or request.headers.get('Content-Encoding') != 'gzip':
+        return 0
+    return max(0, gzip_size(body) - len(body))
+
+
+def response_bytes_saved(response, size):
+    """Returns the bytes saved by the content encoding of a :class:`requests.Response` whose body (``size``
+    bytes decoded) has been read."""
+
+    if not response.headers.get('Content-Encoding'):
+        return 0
+    tell = getattr(response.raw, 'tell', None)
+    if tell is None:
+        return 0
+    return max(0, size - tell())
@@ -0,0 +1,204 @@
+"""Batching of GraphQL lookups, see :func:`pyrate.services.github.GithubPyrate.graphql_batch`.
+
+Many small lookups are merged into one query, each under its own alias, so that one round trip answers dozens of
+callers. Queries are kept within a budget of aliases and nodes (the items of the connections a lookup asks for,
+which is what services like Github charge rate limit points for).
+"""
+import re
+
+__docformat__ = 'sphinx en'
+
+VARIABLE = re.compile(r'\$([A-Za-z_][A-Za-z0-9_]*)')
+
+# GraphQL types of the variables, by Python type
+VARIABLE_TYPES = [(bool, 'Boolean!'), (int, 'Int!'), (float, 'Float!'), (str, 'String!')]
+
+
+class GraphQLError(Exception):
+    """The server answered a lookup (or a whole query) with errors.
+
+    :param list errors: The error objects of the response
+    """
+
+    def __init__(self, errors):
+        super(GraphQLError, self).__init__('; '.join(error.get('message', repr(error)) for error in errors))
+        self.errors = errors
+
+
+def variable_type(value):
+    for python_type, graphql_type in VARIABLE_TYPES:
+        if isinstance(value, python_type):
+            return graphql_type
+    raise TypeError("Cannot infer the GraphQL type of %r, pass it in types" % (value,))
+
+
+class Lookup(object):
+    """One field of a batch, answered once its query has been sent.
+
+    :param string field: The field with its selection, e.g. ``repository(owner: $owner, name: $name) { id }``
+    :param dict variables: Values of the variables used in ``field``
+    :param dict types: GraphQL types of variables, where they cannot be inferred from the value (e.g. ``ID!``)
+    :param int nodes: Number of nodes the field asks for, 1 unless it pages through connections
+    """
+
+    def __init__(self, field, variables=None, types=None, nodes=1):
+        self.field = field
+        self.variables = variables or {}
+        self.types = types or {}
+        self.nodes = nodes
+        self.done = False
+        self.data = None
+        self.errors = None
+
+    def __repr__(self):
+        return '<Lookup %s%s>' % (self.field.split('{', 1)[0].strip(), ' done' if self.done else '')
+
+    def render(self, alias):
+        """Returns the aliased field, its variable declarations and values, with variables renamed after the
+        alias."""
+
+        declarations, values = [], {}
+        for name in sorted(set(VARIABLE.findall(self.field))):
+            value = self.variables[name]
+            declarations.append('$%s_%s: %s' % (alias, name, self.types.get(name) or variable_type(value)))
+            values['%s_%s' % (alias, name)] = value
+
+        field = VARIABLE.sub(lambda match: '$%s_%s' % (alias, match.group(1)), self.field)
+        return '%s: %s' % (alias, field), declarations, values
+
+    def resolve(self, data, errors=None):
+        self.data = data
+        self.errors = errors or None
+        self.done = True
+
+    def result(self):
+        """Returns the data of the field, None if it does not exist.
+
+        :raises GraphQLError: if the server answered the field with errors
+        """
+
+        if not self.done:
+            raise RuntimeError("The batch of this lookup has not been executed yet")
+        if self.errors:
+            raise GraphQLError(self.errors)
+        return self.data
+
+
+class GraphQLBatch(object):
+    """Collects lookups and sends them in as few queries as the budget allows.
+
+    ``rateLimit { cost remaining resetAt }`` is added to each query (unless ``rate_limit_field`` is None); the
+    points spent are summed up in :attr:`cost`.
+
+    :param pyrate: The pyrate sending the queries, through its ``graphql`` method
+    :param int max_aliases: Maximum number of lookups per query
+    :param int max_nodes: Maximum number of nodes per query
+    """
+
+    rate_limit_field = 'rateLimit { cost remaining resetAt }'
+
+    def __init__(self, pyrate, max_aliases=100, max_nodes=10000):
+        self.pyrate = pyrate
+        self.max_aliases = max_aliases
+        self.max_nodes = max_nodes
+        self.pending = []
+        self.queries = 0
+        self.cost = 0
+        self.rate_limit = None
+
+    def __len__(self):
+        return len(self.pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.execute()
+
+    def add(self, field, types=None, nodes=1, **variables):
+        """Adds a lookup to the batch.
+
+        >>> repo = batch.add('repository(owner: $owner, name: $name) { stargazerCount }', owner='me', name='x')
+
+        :rtype: :class:`Lookup`, answered by :func:`execute`
+        """
+
+        lookup = Lookup(field, variables, types, nodes)
+        self.pending.append(lookup)
+        return lookup
+
+    def chunks(self, lookups):
+        """Splits lookups into the groups sent as one query each."""
+
+        chunk, nodes = [], 0
+        for lookup in lookups:
+            if chunk and (len(chunk) >= self.max_aliases or nodes + lookup.nodes > self.max_nodes):
+                yield chunk
+                chunk, nodes = [], 0
+            chunk.append(lookup)
+            nodes += lookup.nodes
+        if chunk:
+            yield chunk
+
+    def build_query(self, lookups):
+        """Returns the query answering ``lookups`` and its variables, the lookup at index ``i`` aliased ``q<i>``."""
+
+        fields, declarations, variables = [], [], {}
+        for index, lookup in enumerate(lookups):
+            field, field_declarations, field_variables = lookup.render('q%d' % index)
+            fields.append(field)
+            declarations.extend(field_declarations)
+            variables.update(field_variables)
+        if self.rate_limit_field:
+            fields.append(self.rate_limit_field)
+
+        header = 'query(%s)' % ', '.join(declarations) if declarations else 'query'
+        return '%s {\n  %s\n}' % (header, '\n  '.join(fields)), variables
+
+    def execute(self):
+        """Sends the pending lookups and answers them.
+
+        :raises GraphQLError: if a query failed as a whole (its lookups are answered with the error as well)
+        """
+
+        lookups, self.pending = self.pending, []
+        failure = None
+        for chunk in self.chunks(lookups):
+            query, variables = self.build_query(chunk)
+            error = self.answer(chunk, self.pyrate.graphql(query, variables))
+            failure = failure or error
+
+        if failure is not None:
+            raise failure
+
+    def answer(self, chunk, response):
+        """Answers the lookups of ``chunk`` from the response to their query.
+
+        :rtype: :class:`GraphQLError` if the query failed as a whole, else None
+        """
+
+        self.queries += 1
+        if not isinstance(response, dict):
+            response = {'errors': [{'message': 'Invalid response: %r' % (response,)}]}
+        elif 'data' not in response and 'errors' not in response:
+            # Rejected before execution, e.g. bad credentials
+            response = {'errors': [{'message': response.get('message') or 'Invalid response: %r' % (response,)}]}
+        data = response.get('data') or {}
+        errors = {}
+        for error in response.get('errors') or []:
+            path = error.get('path') or [None]
+            errors.setdefault(path[0], []).append(error)
+
+        for index, lookup in enumerate(chunk):
+            alias = 'q%d' % index
+            lookup.resolve(data.get(alias), errors.get(alias) or (None if data else errors.get(None)))
+
+        rate_limit = data.get('rateLimit')
+        if rate_limit:
+            self.rate_limit = rate_limit
+            self.cost += rate_limit.get('cost') or 0
+
+        if not data and errors:
+            return GraphQLError(response['errors'])
+        return None
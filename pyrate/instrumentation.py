@@ -0,0 +1,298 @@
+"""Request hooks, timings and metrics, see :attr:`pyrate.main.Pyrate.hooks` and :attr:`pyrate.main.Pyrate.metrics`.
+
+Connection level timings (waiting for a pooled connection, TCP connect, TLS handshake) are taken by the urllib3
+pool and connection classes of :class:`InstrumentedAdapter` and attributed to the request being sent by the
+current thread.
+"""
+import threading
+import time
+
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from pyrate.compression import request_bytes_saved, response_bytes_saved
+
+__docformat__ = 'sphinx en'
+
+try:
+    clock = time.perf_counter
+except AttributeError:
+    clock = time.time
+
+PHASES = ('throttle', 'queue_wait', 'connect', 'tls', 'ttfb', 'body_read')
+
+# Endpoint under which the requests of a service are recorded once it has max_endpoints endpoints
+OTHER_ENDPOINT = ':other'
+
+# Upper bounds (in seconds) of the latency histogram buckets
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, float('inf'))
+
+_local = threading.local()
+
+
+def current_timing():
+    """Returns the timing dict of the request being sent by this thread, None if there is none."""
+    return getattr(_local, 'timing', None)
+
+
+class RequestRecord(object):
+    """Everything known about one request, passed to the hooks.
+
+    ``timing`` maps the names in :data:`PHASES` and ``total`` to seconds: time spent waiting for the rate
+    limiter, waiting for a pooled connection, connecting, in the TLS handshake, until the response headers arrived
+    and reading the body. ``request_bytes_saved`` and ``response_bytes_saved`` count the bytes compression kept
+    off the wire.
+    """
+
+    def __init__(self, service, endpoint, http_method, url):
+        self.service = service
+        self.endpoint = endpoint
+        self.http_method = http_method
+        self.url = url
+        self.timing = dict((phase, 0.0) for phase in PHASES)
+        self.timing['total'] = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.request_bytes_saved = 0
+        self.response_bytes_saved = 0
+        self.status_code = None
+        self.response = None
+        self.error = None
+        self.started_at = None
+        self.headers_at = None
+
+    def start(self):
+        self.started_at = clock()
+        _local.timing = self.timing
+
+    def mark_headers(self, response, *args, **kwargs):
+        # requests 'response' hook: runs once the headers are in, before the body is read
+        self.headers_at = clock()
+        return response
+
+    def finish(self, response=None, error=None):
+        _local.timing = None
+        now = clock()
+        timing = self.timing
+        timing['total'] = now - self.started_at
+
+        if response is not None:
+            self.response = response
+            self.status_code = response.status_code
+            body = getattr(response.request, 'body', None)
+            self.request_bytes = len(body) if body else 0
+            self.request_bytes_saved = request_bytes_saved(response.request)
+            if getattr(response, '_content_consumed', False):
+                self.response_bytes = len(response.content or b'')
+                self.response_bytes_saved = response_bytes_saved(response, self.response_bytes)
+
+            if self.headers_at is not None:
+                timing['body_read'] = now - self.headers_at
+            timing['ttfb'] = max(0.0, response.elapsed.total_seconds() - timing['queue_wait'] - timing['connect'] -
+                                 timing['tls'])
+        self.error = error
+
+
+class Metrics(object):
+    """Latency histograms and counters per service and endpoint.
+
+    :param int max_endpoints: Maximum number of endpoints per service, requests to further endpoints are recorded
+        under :data:`OTHER_ENDPOINT` so that the series stay bounded
+    """
+
+    def __init__(self, buckets=BUCKETS, max_endpoints=200):
+        self.buckets = buckets
+        self.max_endpoints = max_endpoints
+        self._endpoints = {}
+        self._histograms = {}
+        self._statuses = {}
+        self._errors = {}
+        self._phases = {}
+        self._bytes = {}
+        self._saved = {}
+        self._lock = threading.Lock()
+
+    def record(self, record):
+        key = (record.service, record.endpoint)
+        total = record.timing['total']
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None and self._endpoints.get(record.service, 0) >= self.max_endpoints:
+                key = (record.service, OTHER_ENDPOINT)
+                histogram = self._histograms.get(key)
+            if histogram is None:
+                if key[1] != OTHER_ENDPOINT:
+                    self._endpoints[record.service] = self._endpoints.get(record.service, 0) + 1
+                histogram = self._histograms[key] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if total <= bound:
+                    histogram['buckets'][i] += 1
+                    break
+            histogram['sum'] += total
+            histogram['count'] += 1
+
+            phases = self._phases.setdefault(key, dict((phase, 0.0) for phase in PHASES))
+            for phase in PHASES:
+                phases[phase] += record.timing[phase]
+
+            sizes = self._bytes.setdefault(key, {'sent': 0, 'received': 0})
+            sizes['sent'] += record.request_bytes
+            sizes['received'] += record.response_bytes
+            if record.request_bytes_saved or record.response_bytes_saved:
+                saved = self._saved.setdefault(key, {'sent': 0, 'received': 0})
+                saved['sent'] += record.request_bytes_saved
+                saved['received'] += record.response_bytes_saved
+
+            if record.error is not None:
+                error_key = key + (type(record.error).__name__,)
+                self._errors[error_key] = self._errors.get(error_key, 0) + 1
+            else:
+                status_key = key + (record.status_code,)
+                self._statuses[status_key] = self._statuses.get(status_key, 0) + 1
+
+    def as_dict(self):
+        """Returns the metrics as ``{service: {endpoint: {...}}}``. Histogram buckets are cumulative, keyed by
+        their upper bound, like in Prometheus."""
+
+        result = {}
+        with self._lock:
+            for (service, endpoint), histogram in self._histograms.items():
+                cumulative, buckets = 0, {}
+                for bound, count in zip(self.buckets, histogram['buckets']):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                result.setdefault(service, {})[endpoint] = {
+                    'latency': {'buckets': buckets, 'sum': histogram['sum'], 'count': histogram['count']},
+                    'phases': dict(self._phases[(service, endpoint)]),
+                    'bytes': dict(self._bytes[(service, endpoint)]),
+                    'bytes_saved': dict(self._saved.get((service, endpoint), {'sent': 0, 'received': 0})),
+                    'statuses': {},
+                    'errors': {},
+                }
+            for (service, endpoint, status), count in self._statuses.items():
+                result[service][endpoint]['statuses'][status] = count
+            for (service, endpoint, error), count in self._errors.items():
+                result[service][endpoint]['errors'][error] = count
+        return result
+
+    def to_prometheus(self, prefix='pyrate'):
+        """Returns the metrics in the Prometheus text exposition format."""
+
+        def labels(service, endpoint, **extra):
+            pairs = [('service', service), ('endpoint', endpoint)] + sorted(extra.items())
+            return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                                     for k, v in pairs)
+
+        def bound(value):
+            return '+Inf' if value == float('inf') else repr(value)
+
+        data = self.as_dict()
+        lines = [
+            '# HELP %s_request_duration_seconds Duration of requests.' % prefix,
+            '# TYPE %s_request_duration_seconds histogram' % prefix,
+        ]
+        for service, endpoints in sorted(data.items()):
+            for endpoint, metrics in sorted(endpoints.items()):
+                latency = metrics['latency']
+                for upper in self.buckets:
+                    lines.append('%s_request_duration_seconds_bucket%s %d' % (
+                        prefix, labels(service, endpoint, le=bound(upper)), latency['buckets'][upper]))
+                lines.append('%s_request_duration_seconds_sum%s %r' % (prefix, labels(service, endpoint),
+                                                                       latency['sum']))
+                lines.append('%s_request_duration_seconds_count%s %d' % (prefix, labels(service, endpoint),
+                                                                         latency['count']))
+
+        counters = [
+            ('request_phase_seconds_total', 'Time spent per phase of requests.', 'phases', 'phase'),
+            ('request_bytes_total', 'Bytes of request and response bodies.', 'bytes', 'direction'),
+            ('request_bytes_saved_total', 'Bytes saved by compressing request and response bodies.', 'bytes_saved',
+             'direction'),
+            ('responses_total', 'Responses per status code.', 'statuses', 'status'),
+            ('request_errors_total', 'Requests that failed without a response.', 'errors', 'error'),
+        ]
+        for name, help_text, field, label in counters:
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s counter' % (prefix, name))
+            for service, endpoints in sorted(data.items()):
+                for endpoint, metrics in sorted(endpoints.items()):
+                    for key, value in sorted(metrics[field].items()):
+                        lines.append('%s_%s%s %s' % (prefix, name, labels(service, endpoint, **{label: key}),
+                                                     repr(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._statuses.clear()
+            self._errors.clear()
+            self._phases.clear()
+            self._bytes.clear()
+            self._saved.clear()
+            self._endpoints.clear()
+
+
+class _TimedConnectionMixin(object):
+    # Splits the time spent in connect() into TCP connect (_new_conn) and TLS handshake (the rest)
+
+    _tcp_time = 0.0
+
+    def _new_conn(self):
+        start = clock()
+        try:
+            return super(_TimedConnectionMixin, self)._new_conn()
+        finally:
+            self._tcp_time = clock() - start
+
+    def connect(self):
+        start = clock()
+        super(_TimedConnectionMixin, self).connect()
+        timing = current_timing()
+        if timing is not None:
+            elapsed = clock() - start
+            if self.handshakes:
+                timing['connect'] += self._tcp_time
+                timing['tls'] += max(0.0, elapsed - self._tcp_time)
+            else:
+                timing['connect'] += elapsed
+
+
+class TimedHTTPConnection(_TimedConnectionMixin, HTTPConnection):
+    handshakes = False
+
+
+class TimedHTTPSConnection(_TimedConnectionMixin, HTTPSConnection):
+    handshakes = True
+
+
+class _TimedPoolMixin(object):
+    # Measures the wait for a free connection when the pool is exhausted
+
+    def _get_conn(self, timeout=None):
+        start = clock()
+        conn = super(_TimedPoolMixin, self)._get_conn(timeout)
+        timing = current_timing()
+        if timing is not None:
+            timing['queue_wait'] += clock() - start
+        return conn
+
+
+class TimedHTTPConnectionPool(_TimedPoolMixin, HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(_TimedPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class InstrumentedAdapter(HTTPAdapter):
+    """:class:`requests.adapters.HTTPAdapter` whose pools report connection timings."""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(InstrumentedAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': TimedHTTPConnectionPool,
+            'https': TimedHTTPSConnectionPool,
+        }
@@ -0,0 +1,135 @@
+"""Pluggable JSON encoding and decoding.
+
+The fastest installed library is used by default: orjson, then simdjson (decoding only), then ujson, falling back
+to the standard library. Codecs can be picked globally with :func:`set_default_codec` or per service class with
+:attr:`pyrate.main.Pyrate.json_codec`.
+
+orjson and simdjson decode integers wider than 64 bits as floats, losing precision; pick the ``'stdlib'`` codec for
+services returning such numbers. Documents a codec fails to encode or decode are handed to the standard library.
+"""
+import functools
+import json
+import threading
+
+__docformat__ = 'sphinx en'
+
+
+class JSONCodec(object):
+    """Base class of the codecs. Encoding goes straight to UTF-8 bytes, decoding accepts bytes or text."""
+
+    name = None
+
+    def dumps(self, obj):
+        raise NotImplementedError('Please implement in subclass')
+
+    def loads(self, data):
+        raise NotImplementedError('Please implement in subclass')
+
+    def __repr__(self):
+        return '<%s>' % type(self).__name__
+
+
+class StdlibCodec(JSONCodec):
+    name = 'stdlib'
+
+    def __init__(self):
+        self.encoder = json.JSONEncoder(separators=(',', ':'))
+
+    def dumps(self, obj):
+        return self.encoder.encode(obj).encode('utf-8')
+
+    def loads(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """Integers wider than 64 bits are rejected when encoding and decoded as floats."""
+
+    name = 'orjson'
+
+    def __init__(self):
+        import orjson
+        # Like the standard library, encode int, float and bool keys as strings
+        self.dumps = functools.partial(orjson.dumps, option=orjson.OPT_NON_STR_KEYS)
+        self.loads = orjson.loads
+
+
+class UjsonCodec(JSONCodec):
+    name = 'ujson'
+
+    def __init__(self):
+        import ujson
+        self.ujson = ujson
+
+    def dumps(self, obj):
+        return self.ujson.dumps(obj, ensure_ascii=False).encode('utf-8')
+
+    def loads(self, data):
+        return self.ujson.loads(data)
+
+
+class SimdjsonCodec(StdlibCodec):
+    """Decodes with simdjson, which has no encoder of its own."""
+
+    name = 'simdjson'
+
+    def __init__(self):
+        super(SimdjsonCodec, self).__init__()
+        import simdjson
+        self.loads = simdjson.loads
+
+
+CODECS = {
+    'orjson': OrjsonCodec,
+    'simdjson': SimdjsonCodec,
+    'ujson': UjsonCodec,
+    'stdlib': StdlibCodec,
+}
+
+PREFERENCE = ('orjson', 'simdjson', 'ujson', 'stdlib')
+
+_codecs = {}
+_codecs_lock = threading.Lock()
+_default = None
+
+
+def get_codec(name=None):
+    """Returns the codec called ``name``, or the default codec if ``name`` is None.
+
+    :raises ImportError: if the library behind the codec is not installed
+    :rtype: :class:`JSONCodec`
+    """
+
+    if name is None:
+        return _default or get_best_codec()
+
+    with _codecs_lock:
+        codec = _codecs.get(name)
+        if codec is None:
+            codec = _codecs[name] = CODECS[name]()
+        return codec
+
+
+def get_best_codec():
+    """Returns the first codec of :data:`PREFERENCE` whose library is installed."""
+
+    global _default
+    for name in PREFERENCE:
+        try:
+            codec = get_codec(name)
+        except ImportError:
+            continue
+        _default = _default or codec
+        return codec
+
+
+def set_default_codec(codec):
+    """Sets the codec used by all services that do not pick their own.
+
+    :param codec: A codec name, a :class:`JSONCodec` instance, or None to use the fastest installed one
+    """
+
+    global _default
+    _default = get_codec(codec) if isinstance(codec, str) else codec
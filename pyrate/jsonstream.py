@@ -0,0 +1,151 @@
+"""Incremental decoding of large JSON responses, see :func:`pyrate.main.Pyrate.do_stream`.
+
+Only the elements of one array are decoded at a time, so memory use is bounded by the largest element rather
+than by the whole document. ijson (an event-driven parser on top of yajl) is used when installed, otherwise a pure
+Python parser built on :meth:`json.JSONDecoder.raw_decode`.
+"""
+import codecs
+import json
+
+__docformat__ = 'sphinx en'
+
+_UNLOADED = object()
+# Imported on first use, see get_ijson
+ijson = _UNLOADED
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+DELIMITERS = WHITESPACE + ',:]}'
+
+
+def get_ijson():
+    """Returns the ijson module, None if it is not installed."""
+
+    global ijson
+    if ijson is _UNLOADED:
+        try:
+            import ijson as module
+        except ImportError:
+            module = None
+        ijson = module
+    return ijson
+
+
+def iter_response_items(response, path=()):
+    """Yields the elements of the array at ``path`` (a sequence of object keys) in the body of a streamed
+    :class:`requests.Response`."""
+
+    ijson = get_ijson()
+    if ijson is not None:
+        # Let urllib3 undo any content encoding before the parser sees the bytes
+        response.raw.decode_content = True
+        prefix = '.'.join(tuple(path) + ('item',))
+        return ijson.items(response.raw, prefix, use_float=True)
+
+    return iter_json_items(response.iter_content(CHUNK_SIZE), path)
+
+
+def iter_json_items(chunks, path=()):
+    """Yields the elements of the array at ``path`` in the JSON document made of the byte ``chunks``."""
+
+    reader = _Reader(chunks)
+    for key in path:
+        reader.expect('{')
+        while True:
+            if reader.peek() == '}':
+                raise KeyError(key)
+            found = reader.value()
+            reader.expect(':')
+            if found == key:
+                break
+            reader.value()
+            if reader.read_char() == '}':
+                raise KeyError(key)
+
+    reader.expect('[')
+    if reader.peek() == ']':
+        return
+
+    while True:
+        yield reader.value()
+        char = reader.read_char()
+        if char == ']':
+            return
+        if char != ',':
+            raise ValueError("Expected ',' or ']' at offset %d, got %r" % (reader.offset, char))
+
+
+class _Reader(object):
+    # A text buffer over the chunks, refilled on demand and trimmed as it is consumed
+
+    decoder = json.JSONDecoder()
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.consumed = 0
+        self.eof = False
+
+    @property
+    def offset(self):
+        return self.consumed + self.pos
+
+    def fill(self):
+        if self.eof:
+            return False
+
+        # Drop what has been consumed before growing the buffer
+        self.consumed += self.pos
+        self.buffer = self.buffer[self.pos:]
+        self.pos = 0
+
+        try:
+            chunk = next(self.chunks)
+        except StopIteration:
+            self.eof = True
+            self.buffer += self.text_decoder.decode(b'', True)
+        else:
+            self.buffer += self.text_decoder.decode(chunk)
+        return True
+
+    def skip_whitespace(self):
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return
+
+    def peek(self):
+        self.skip_whitespace()
+        if self.pos >= len(self.buffer):
+            raise ValueError("Unexpected end of JSON document")
+        return self.buffer[self.pos]
+
+    def read_char(self):
+        char = self.peek()
+        self.pos += 1
+        return char
+
+    def expect(self, expected):
+        char = self.read_char()
+        if char != expected:
+            raise ValueError("Expected %r at offset %d, got %r" % (expected, self.offset - 1, char))
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except ValueError:
+                if not self.fill():
+                    raise
+                continue
+
+            # A number (or literal) not followed by a delimiter may continue in the next chunk
+            if (end == len(self.buffer) or self.buffer[end] not in DELIMITERS) and self.fill():
+                continue
+
+            self.pos = end
+            return value
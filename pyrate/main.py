@@ -1,10 +1,181 @@
-from base64 import b64encode
+import hashlib
 import json
+import re
 import requests
-import sys
+import threading
+
+from pyrate.auth import basic_auth_header
+from pyrate.cache import CacheEntry
+from pyrate.compression import accept_encoding, gzip_compress
+from pyrate import jsoncodec
+from pyrate.instrumentation import clock, InstrumentedAdapter, Metrics, RequestRecord
+from pyrate.jsonstream import iter_response_items
+from pyrate.ratelimit import get_rate_limiter, get_window_limiter
+from pyrate.retry import RetryPolicy
+from pyrate.singleflight import SingleFlight
+from pyrate.template import expand_endpoint, RequestTemplate
+from pyrate.transport import create_transport, HTTP_METHODS, RequestsTransport
+
+try:
+    from urllib.parse import urlencode, urlparse
+except ImportError:
+    from urllib import urlencode
+    from urlparse import urlparse
 
 __docformat__ = 'sphinx en'
 
+_shared_sessions = {}
+_shared_sessions_lock = threading.Lock()
+
+
+class PyrateSession(requests.Session):
+    """A :class:`requests.Session` reading the proxy and CA bundle settings of the environment once per host.
+
+    requests looks them up on every request, scanning all environment variables, which costs more than the rest
+    of a call. Changes to the environment are picked up by new sessions only.
+    """
+
+    def __init__(self):
+        super(PyrateSession, self).__init__()
+        self._environments = {}
+
+    def merge_environment_settings(self, url, proxies, stream, verify, cert):
+        if not self.trust_env or proxies:
+            return super(PyrateSession, self).merge_environment_settings(url, proxies, stream, verify, cert)
+
+        parts = urlparse(url)
+        key = (parts.scheme, parts.netloc, stream, verify, cert, self.stream, self.verify, self.cert,
+               tuple(sorted(self.proxies.items())))
+        settings = self._environments.get(key)
+        if settings is None:
+            settings = super(PyrateSession, self).merge_environment_settings(url, {}, stream, verify, cert)
+            self._environments[key] = settings
+
+        return dict(settings, proxies=dict(settings['proxies']))
+
+
+def create_session(pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True, adapter=None):
+    """Creates a :class:`PyrateSession` backed by a connection pool.
+
+    :param int pool_connections: Number of per-host connection pools to cache
+    :param int pool_maxsize: Maximum number of connections kept open per host
+    :param bool pool_block: Whether to block instead of opening more than ``pool_maxsize`` connections to a host
+    :param bool keep_alive: Whether connections should be kept open between requests
+    :param adapter: The transport adapter to send requests with, instead of a new
+        :class:`pyrate.instrumentation.InstrumentedAdapter` with the pool settings
+    :rtype: :class:`requests.Session`
+    """
+
+    session = PyrateSession()
+    if adapter is None:
+        adapter = InstrumentedAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize,
+                                      pool_block=pool_block)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers['Accept-Encoding'] = accept_encoding()
+    if not keep_alive:
+        session.headers['Connection'] = 'close'
+
+    return session
+
+
+def get_shared_session(url, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+    """Returns the session shared by all instances talking to the host of ``url`` with the same pool settings.
+
+    :rtype: :class:`requests.Session`
+    """
+
+    host = urlparse(url).netloc
+    key = (host, pool_connections, pool_maxsize, pool_block, keep_alive)
+
+    with _shared_sessions_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            session = create_session(pool_connections, pool_maxsize, pool_block, keep_alive)
+            _shared_sessions[key] = session
+
+    return session
+
+
+def add_query_params(url, params):
+    """Appends ``params`` to the query string of ``url``, sorted so equal params give equal urls."""
+
+    if not params:
+        return url
+
+    return url + ('&' if '?' in url else '?') + urlencode(sorted(params.items()), doseq=True)
+
+
+def close_shared_sessions():
+    """Closes all shared sessions and empties the registry."""
+
+    with _shared_sessions_lock:
+        sessions = list(_shared_sessions.values())
+        _shared_sessions.clear()
+
+    for session in sessions:
+        session.close()
+
+
+def run_many(do, calls, max_workers, as_completed=False):
+    """Runs ``do(method, content, http_method=http_method)`` for each call on a thread pool, see
+    :func:`Pyrate.do_many`."""
+
+    results = _iter_many(do, calls, max_workers)
+    if as_completed:
+        return results
+
+    results = dict(results)
+    return [results[index] for index in range(len(results))]
+
+
+def _iter_many(do, calls, max_workers):
+    from concurrent import futures
+
+    executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+    pending = set()
+    try:
+        for index, call in enumerate(calls):
+            pending.add(executor.submit(_do_call, do, index, call))
+
+            # Keep a bounded window of submitted calls
+            if len(pending) >= max_workers * 2:
+                done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        for future in futures.as_completed(pending):
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _do_call(do, index, call):
+    method, content, http_method = (tuple(call) + (None, None))[:3]
+    try:
+        return index, do(method, content, http_method=http_method)
+    except Exception as e:
+        return index, CallError(call, e)
+
+
+class CallError(object):
+    """Stands in for the result of a call that raised an exception in :func:`Pyrate.do_many`.
+
+    :param tuple call: The call as it was passed to :func:`Pyrate.do_many`
+    :param exception: The exception raised by the call
+    """
+
+    def __init__(self, call, exception):
+        self.call = call
+        self.exception = exception
+
+    def __repr__(self):
+        return '<CallError %r: %r>' % (self.call, self.exception)
+
+
 class Pyrate(object):
     """This is the main class
 
@@ -15,9 +186,45 @@ class Pyrate(object):
     :param string default_http_method: Default HTTP method (will be used if none else is specified in request)
     :param string default_return_format: Default return format (will be used if none else is specified in request)
     :param string connection_check_method: Used by :func:`check_connection`
-    :param string auth_type: The authentification type. Obsolete.
+    :param string auth_type: The authentification type. Obsolete, see :attr:`auth`.
+    :param auth: The :class:`pyrate.auth.AuthProvider` of this instance, created by :func:`create_auth` on first use
     :param string base_url: The base url for all api requests
     :param bool send_json: Whether the request body should be encoded with json
+    :param int pool_connections: Number of per-host connection pools to cache
+    :param int pool_maxsize: Maximum number of connections kept open per host
+    :param bool pool_block: Whether to wait for a free connection instead of exceeding ``pool_maxsize``
+    :param bool keep_alive: Whether connections should be kept open between requests
+    :param bool share_session: Whether to use the session registry shared by all instances talking to the same host
+    :param transport: The :class:`pyrate.transport.Transport` sending the requests, or the name of one
+        (``'requests'``, ``'urllib3'`` or ``'http2'``) created with the pool settings; None for ``'requests'``
+    :param adapter: A transport adapter for the session of this instance (never shared), e.g. a
+        :class:`pyrate.cassette.CassetteAdapter`; None for a pooled :class:`pyrate.instrumentation.InstrumentedAdapter`
+    :param cache: A :class:`pyrate.cache.ResponseCache` for GET responses, caching is disabled if None
+    :param paginator: The :class:`pyrate.pagination.Paginator` used by :func:`iter_pages`
+    :param bool rate_limit: Whether to pace requests according to the rate limit headers of the service
+    :param rate_limiter: The :class:`pyrate.ratelimit.RateLimiter` to use, defaults to the one shared by all
+        instances with the same credentials
+    :param tuple content_creation_limits: ``(calls, seconds)`` windows limiting the requests that create content,
+        for services with undisclosed (secondary) rate limits, None for no limits
+    :param tuple content_creation_methods: HTTP methods subject to ``content_creation_limits``
+    :param content_limiter: The :class:`pyrate.ratelimit.WindowLimiter` enforcing ``content_creation_limits``,
+        defaults to the one shared by all instances with the same credentials
+    :param retry_policy: The :class:`pyrate.retry.RetryPolicy` for failed requests, None to never retry
+    :param tuple stream_path: Keys leading to the item array in responses decoded by :func:`do_stream`
+    :param json_codec: Name of the :mod:`pyrate.jsoncodec` codec (or a codec instance) used to encode bodies and
+        decode responses, None for the default codec
+    :param string service_name: Name of the service in metrics
+    :param list endpoint_labels: ``(pattern, template)`` pairs labelling the endpoints in metrics, e.g.
+        ``(r'repos/[^/]+/[^/]+', 'repos/{owner}/{name}')``, so that they do not get a series per resource
+    :param list user_scoped_endpoints: Patterns of the endpoints whose result depends on the user of the credentials,
+        see :class:`pyrate.pool.CredentialPool`
+    :param bool collect_metrics: Whether to record every request in :attr:`metrics`
+    :param single_flight: The :class:`pyrate.singleflight.SingleFlight` coalescing identical requests in flight,
+        shared by all instances by default, None to send every request
+    :param tuple coalesce_methods: HTTP methods whose requests may be coalesced
+    :param bool compress_requests: Whether to gzip request bodies, for services accepting ``Content-Encoding: gzip``
+    :param int compress_min_size: Size in bytes from which request bodies are compressed
+    :param int compress_level: zlib compression level of request bodies
     """
 
     http_methods = ['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS']
@@ -28,16 +235,232 @@ class Pyrate(object):
     default_return_format = None
     connection_check_method = None
     auth_type = None
+    auth = None
     base_url = None
+    stream_url = None
     send_json = False
+    pool_connections = 10
+    pool_maxsize = 10
+    pool_block = False
+    keep_alive = True
+    share_session = False
+    transport = None
+    adapter = None
+    session = None
+    cache = None
+    paginator = None
+    rate_limit = False
+    rate_limiter = None
+    content_creation_limits = None
+    content_creation_methods = ('POST', 'PUT')
+    content_limiter = None
+    retry_policy = RetryPolicy()
+    stream_path = ()
+    json_codec = None
+    service_name = None
+    user_scoped_endpoints = []
+    endpoint_labels = []
+    collect_metrics = True
+    single_flight = SingleFlight()
+    coalesce_methods = ('GET', 'OPTIONS')
+    compress_requests = False
+    compress_min_size = 1024
+    compress_level = 6
 
     def __init__(self):
+        self._session_lock = threading.Lock()
+        self._transport_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._auth_lock = threading.Lock()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'revalidations': 0}
+        self.hooks = {'request': [], 'response': [], 'error': []}
+        self.metrics = Metrics()
+        self._template = None
+        self._identity = None
+        self._transport = None
         self.default_http_method = self.http_methods[0]
         try:
             self.default_return_format = self.return_formats[0]
         except IndexError:
             self.default_return_format = ''
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_session(self):
+        """Returns the pooled session used for all requests of this instance, creating it on first use.
+
+        :rtype: :class:`requests.Session`
+        """
+
+        if self.session is None:
+            with self._session_lock:
+                if self.session is None:
+                    if self.adapter is not None:
+                        self.session = create_session(keep_alive=self.keep_alive, adapter=self.adapter)
+                    elif self.share_session:
+                        self.session = get_shared_session(self.base_url, self.pool_connections, self.pool_maxsize,
+                                                          self.pool_block, self.keep_alive)
+                    else:
+                        self.session = create_session(self.pool_connections, self.pool_maxsize, self.pool_block,
+                                                      self.keep_alive)
+        return self.session
+
+    def close(self):
+        """Releases the connections held by this instance. Shared sessions stay open for the other instances
+        (see :func:`close_shared_sessions`)."""
+
+        with self._transport_lock:
+            transport, self._transport = self._transport, None
+        if transport is not None and transport is not self.transport:
+            # Created from a name, transports passed in are closed by their owner
+            transport.close()
+
+        with self._session_lock:
+            session, self.session = self.session, None
+
+        if session is not None and (self.adapter is not None or not self.share_session):
+            session.close()
+
+    def get_transport(self):
+        """Returns the transport sending the requests of this instance, creating it on first use.
+
+        :rtype: :class:`pyrate.transport.Transport`
+        """
+
+        if self._transport is None:
+            with self._transport_lock:
+                if self._transport is None:
+                    self._transport = self.create_transport()
+        return self._transport
+
+    def create_transport(self):
+        """Creates the transport of this instance from :attr:`transport`."""
+
+        if self.transport is None or self.transport == 'requests':
+            return RequestsTransport(self.get_session())
+        if isinstance(self.transport, str):
+            return create_transport(self.transport, self.pool_connections, self.pool_maxsize, self.pool_block,
+                                    self.keep_alive)
+        return self.transport
+
+    def auth_identity(self):
+        """Returns a token identifying the credentials of this instance without exposing them.
+
+        Used to keep apart cached responses (and other per-credential state) of instances with different
+        credentials.
+        """
+
+        # Derived from the same defaults as the template, so it is recomputed along with it
+        template = self.get_template()
+        cached = self._identity
+        if cached is not None and cached[0] is template:
+            return cached[1]
+
+        auth = self.get_auth()
+        credentials = repr((self.base_url, sorted((self.default_header_content or {}).items()),
+                            sorted((self.default_body_content or {}).items()),
+                            auth.identity() if auth is not None else None))
+        identity = hashlib.sha1(credentials.encode('utf-8')).hexdigest()
+        self._identity = (template, identity)
+        return identity
+
+    def get_auth(self):
+        """Returns the auth provider of this instance, creating it on first use.
+
+        :rtype: :class:`pyrate.auth.AuthProvider`
+        """
+
+        if self.auth is None:
+            with self._auth_lock:
+                if self.auth is None:
+                    self.auth = self.create_auth()
+        return self.auth
+
+    def create_auth(self):
+        """Creates the auth provider of this instance from its credentials, None for unauthenticated services."""
+        return None
+
+    def get_rate_limiter(self):
+        """Returns the rate limiter of this instance, None if rate limiting is disabled.
+
+        :rtype: :class:`pyrate.ratelimit.RateLimiter`
+        """
+
+        if not self.rate_limit:
+            return None
+        if self.rate_limiter is None:
+            self.rate_limiter = get_rate_limiter(self.auth_identity())
+        return self.rate_limiter
+
+    def get_content_limiter(self):
+        """Returns the limiter of requests creating content, None if :attr:`content_creation_limits` is not set.
+
+        :rtype: :class:`pyrate.ratelimit.WindowLimiter`
+        """
+
+        if not self.content_creation_limits:
+            return None
+        if self.content_limiter is None:
+            self.content_limiter = get_window_limiter(self.auth_identity(), tuple(self.content_creation_limits))
+        return self.content_limiter
+
+    def rate_limit_family(self, url):
+        """Returns the name of the quota that requests to ``url`` count against."""
+        return 'core'
+
+    def is_user_scoped(self, method):
+        """Returns whether the result of ``method`` depends on whose credentials are used."""
+
+        for pattern in self.user_scoped_endpoints:
+            if re.match(pattern, method):
+                return True
+        return False
+
+    def creates_content(self, http_method, url):
+        """Returns whether a request is subject to ``content_creation_limits``."""
+
+        return http_method.upper() in self.content_creation_methods
+
+    def register_hook(self, event, hook):
+        """Registers a function called with the :class:`pyrate.instrumentation.RequestRecord` of every request.
+
+        :param string event: ``'request'`` (before sending), ``'response'`` or ``'error'`` (no response received)
+        """
+
+        self.hooks[event].append(hook)
+
+    def dispatch_hook(self, event, record):
+        for hook in self.hooks[event]:
+            hook(record)
+
+    def get_service_name(self):
+        return self.service_name or type(self).__name__
+
+    def endpoint_label(self, url):
+        """Returns the endpoint of ``url`` as used in metrics: the path below ``base_url`` (or ``stream_url``) without
+        query string and format extension, the prefix matching one of :attr:`endpoint_labels` replaced by its template
+        and numeric ids by ``:id``."""
+
+        path = url.split('?', 1)[0]
+        for root in (self.base_url, self.stream_url):
+            if root and path.startswith(root):
+                path = path[len(root):]
+                break
+        if self.default_return_format and path.endswith('.' + self.default_return_format):
+            path = path[:-len(self.default_return_format) - 1]
+
+        prefix = ''
+        for pattern, template in self.endpoint_labels:
+            match = re.match(pattern + r'(?=/|$)', path)
+            if match:
+                prefix, path = template, path[match.end():]
+                break
+        return prefix + '/'.join(':id' if segment.isdigit() else segment for segment in path.split('/'))
+
     def create_basic_auth(self, user, password):
         """Creates the header content for HTTP Basic Authentification.
 
@@ -46,18 +469,7 @@ class Pyrate(object):
         :rtype: Base64-encoded auth string
         """
 
-        # Messing around with Python3's strictness about strings
-        if sys.version_info >= (3, 0):
-            if not isinstance(user, str):
-                user = user.decode('utf-8')
-
-            if not isinstance(password, str):
-                password = password.decode('utf-8')
-
-            return 'Basic ' + b64encode((user + ":" + password).encode('utf-8')).decode('utf-8')
-
-        else:
-            return 'Basic ' + b64encode(user + ":" + password).rstrip()
+        return basic_auth_header(user, password)
 
     def get_oauth(self):
         raise NotImplementedError("OAuth methods need to be implemented by subclasses!")
@@ -92,67 +504,371 @@ class Pyrate(object):
         raise NotImplementedError('Please implement in subclass')
 
     def do(self, method, content=None, headers=None, http_method=None, return_format=None):
+        return self.do_request(*self.build_request(method, content, headers, http_method, return_format))
+
+    def get_template(self):
+        """Returns the request template compiled from the defaults of this instance.
+
+        The template is recompiled when one of the defaults is replaced. Changes made to the default dicts in
+        place are not picked up, assign new dicts instead.
+
+        :rtype: :class:`pyrate.template.RequestTemplate`
+        """
+
+        self.get_auth()
+        template = self._template
+        if template is None or not template.compiled_from(self):
+            template = self._template = RequestTemplate.for_pyrate(self)
+        return template
+
+    def endpoint(self, endpoint, **params):
+        """Expands an endpoint template like ``repos/{owner}/{name}``, see :func:`pyrate.template.expand_endpoint`.
+        """
+
+        return expand_endpoint(endpoint, params)
+
+    def build_request(self, method, content=None, headers=None, http_method=None, return_format=None):
+        """Merges the arguments of a call with the defaults of this instance.
 
-        request_body = self.default_body_content
-        if content is not None:
-            request_body.update(content)
+        :rtype: tuple ``(http_method, url, headers, body, return_format)`` as taken by :func:`do_request`
+        """
 
-        request_headers = self.default_header_content
-        if headers is not None:
-            request_headers.update(headers)
+        template = self.get_template()
 
         if http_method is None:
-            http_method = self.default_http_method
+            http_method = template.http_method
 
         if return_format is None:
-            if self.default_return_format:
-                return_format = "." + self.default_return_format
-            else:
-                return_format = ''
+            return_format = template.suffix
 
-        request_url = self.base_url + method + return_format
+        return (http_method, template.url(method, return_format), template.headers(headers), template.body(content),
+                return_format)
 
-        return self.do_request(http_method, request_url, request_headers, request_body, return_format)
+    def iter_pages(self, method, content=None, headers=None, http_method=None, return_format=None, prefetch=False,
+                   paginator=None):
+        """Generator over all pages of a listing, following the pagination scheme of the service.
 
-    def do_request(self, http_method, url, headers, body, return_format):
+        Pages are requested lazily as the generator is consumed.
+
+        :param bool prefetch: Fetch the next page in the background while the current one is consumed
+        :param paginator: A :class:`pyrate.pagination.Paginator` overriding the one of the service
+        """
+
+        paginator = paginator or self.paginator
+        if paginator is None:
+            raise NotImplementedError("%s does not define a paginator" % type(self).__name__)
+
+        http_method, url, headers, body, return_format = self.build_request(method, content, headers, http_method,
+                                                                            return_format)
+
+        def fetch(request):
+            page_url, page_content = request
+            response = self.send_request(http_method, page_url, headers, page_content)
+            page = self.handle_response(response, return_format)
+            return page, paginator.next_request(page_url, page_content, response, page)
+
+        # A page equal to the previous one means the service ignored the pagination parameters
+        request, previous = paginator.first_request(url, body), object()
+        if not prefetch:
+            while request is not None:
+                page, request = fetch(request)
+                if page == previous:
+                    return
+                previous = page
+                yield page
+            return
+
+        from concurrent import futures
+
+        executor = futures.ThreadPoolExecutor(max_workers=1)
+        future = executor.submit(fetch, request)
+        try:
+            while future is not None:
+                page, request = future.result()
+                if page == previous:
+                    return
+                previous = page
+                future = executor.submit(fetch, request) if request is not None else None
+                yield page
+        finally:
+            if future is not None:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+    def iter_items(self, method, content=None, headers=None, http_method=None, return_format=None, prefetch=False,
+                   paginator=None, items_key=None):
+        """Generator over the items of all pages of a listing, see :func:`iter_pages`.
+
+        :param string items_key: Key of the item list in the pages, overriding the one of the paginator
+        """
 
-        if self.auth_type == 'OAUTH1':
-            auth_data = self.get_oauth()
+        paginator = paginator or self.paginator
+        for page in self.iter_pages(method, content, headers, http_method, return_format, prefetch, paginator):
+            for item in paginator.items(page, items_key):
+                yield item
+
+    def do_stream(self, method, content=None, headers=None, http_method=None, return_format=None, path=None):
+        """Generator over the items of a large JSON array response, decoded while the body is being downloaded.
+
+        The response is never held in memory as a whole, unlike with :func:`do`. Raises
+        :class:`requests.HTTPError` for error responses.
+
+        :param tuple path: Keys leading to the item array in the response, defaults to :attr:`stream_path`
+        """
+
+        http_method, url, headers, body, return_format = self.build_request(method, content, headers, http_method,
+                                                                            return_format)
+        if http_method.upper() == 'GET':
+            url, body = add_query_params(url, body), None
+
+        response = self.send_uncached_request(http_method, url, headers, body, stream=True)
+        try:
+            response.raise_for_status()
+            for item in iter_response_items(response, self.stream_path if path is None else path):
+                yield item
+        finally:
+            response.close()
+
+    def do_many(self, calls, max_workers=None, as_completed=False):
+        """Runs many calls concurrently on a thread pool sharing this instance's connection pool.
+
+        Each call is a tuple ``(method, content, http_method)`` whose trailing items may be omitted. A call that
+        raises does not abort the batch, its result is a :class:`CallError` instead. ``calls`` is consumed lazily,
+        so it may be a generator of any length.
+
+        :param calls: Iterable of call tuples
+        :param int max_workers: Number of concurrent calls, defaults to ``pool_maxsize``
+        :param bool as_completed: Return a generator of ``(index, result)`` pairs in completion order
+            instead of the list of results in call order
+        """
+
+        return run_many(self.do, calls, max_workers or self.pool_maxsize, as_completed)
+
+    def do_request(self, http_method, url, headers, body, return_format):
+        key = self.coalesce_key(http_method, url, headers, body)
+        if key is None:
+            response = self.send_request(http_method, url, headers, body)
         else:
-            auth_data = None
+            response = self.single_flight.do(key, self.send_request, http_method, url, headers, body)
+        return self.handle_response(response, return_format)
 
-        if self.send_json:
-            # We need to make sure that body is jsonified
-            try:
-                body = json.dumps(body)
-            except TypeError or ValueError:
-                pass
+    def coalesce_key(self, http_method, url, headers, body):
+        """Returns the key shared by identical requests that may be coalesced, None if the request must be sent on
+        its own. Identical means same method, url (with query), credentials and headers."""
+
+        http_method = http_method.upper()
+        if self.single_flight is None or http_method not in self.coalesce_methods:
+            return None
+
+        if http_method == 'GET':
+            url, body = add_query_params(url, body), None
+        if body:
+            return None
+        return http_method + ' ' + self.cache_key(url, headers)
+
+    def send_request(self, http_method, url, headers, body):
+        """Sends a request, going through the response cache for GET requests.
+
+        :rtype: :class:`requests.Response`
+        """
 
         if http_method.upper() == 'GET':
-            r = requests.get(url, headers=headers, auth=auth_data)
+            # GET requests have no body, their content goes into the query string
+            url, body = add_query_params(url, body), None
 
-        elif http_method.upper() == 'POST':
-            r = requests.post(url, data=body, headers=headers, auth=auth_data)
+        if self.cache is not None and http_method.upper() == 'GET':
+            return self.send_cached_request(url, headers)
 
-        elif http_method.upper() == 'PUT':
-            r = requests.put(url, data=body, headers=headers, auth=auth_data)
+        return self.send_uncached_request(http_method, url, headers, body)
 
-        elif http_method.upper() == 'DELETE':
-            r = requests.delete(url, data=body, headers=headers, auth=auth_data)
+    def send_cached_request(self, url, headers):
+        key = self.cache_key(url, headers)
+        entry = self.cache.get(key)
+        if entry is not None and entry.is_fresh():
+            self._count('hits')
+            return entry.to_response()
 
-        elif http_method.upper() == 'OPTIONS':
-            r = requests.options(url, data=body, headers=headers, auth=auth_data)
+        response = self.send_uncached_request('GET', url, self.revalidation_headers(entry, headers), None)
+        return self.store_response(key, entry, url, response)
 
-        else:
+    def revalidation_headers(self, entry, headers):
+        """Returns the headers asking the server whether the stale cache ``entry`` changed."""
+
+        if entry is None:
+            return headers
+
+        headers = dict(headers or {})
+        if entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
+        return headers
+
+    def store_response(self, key, entry, url, response):
+        """Caches the response to a GET request, or refreshes the stale ``entry`` it revalidated.
+
+        :rtype: :class:`requests.Response`, the response to return for the request
+        """
+
+        ttl = self.cache.ttl_for(url)
+
+        if entry is not None and response.status_code == 304:
+            self._count('revalidations')
+            entry.expires_at = CacheEntry.from_response(response, ttl).expires_at
+            self.cache.set(key, entry)
+            return entry.to_response()
+
+        self._count('misses')
+        if response.status_code == 200 and 'no-store' not in response.headers.get('Cache-Control', ''):
+            self.cache.set(key, CacheEntry.from_response(response, ttl))
+
+        return response
+
+    def cache_key(self, url, headers):
+        headers = sorted((k.lower(), v) for k, v in (headers or {}).items() if k.lower() != 'authorization')
+        return '%s %s %r' % (self.auth_identity(), url, headers)
+
+    def _count(self, stat):
+        with self._stats_lock:
+            self.cache_stats[stat] += 1
+
+    def send_uncached_request(self, http_method, url, headers, body, stream=False):
+        """Sends a request over the network, retrying it as allowed by :attr:`retry_policy`.
+
+        :rtype: :class:`requests.Response`
+        """
+
+        auth_data = self.get_auth()
+        body = self.encode_body(body)
+        body, headers = self.compress_body(body, headers)
+
+        policy = self.retry_policy
+        if policy is not None and policy.budget is not None:
+            policy.budget.record_request()
+
+        attempt = 0
+        while True:
+            try:
+                r = self.send_once(http_method, url, headers, body, auth_data, stream)
+            except requests.exceptions.ConnectionError:
+                if policy is None or not policy.should_retry(http_method, attempt):
+                    raise
+                delay = policy.backoff(attempt)
+            else:
+                if policy is None or not policy.should_retry(http_method, attempt, r):
+                    return r
+                delay = policy.backoff(attempt, r)
+                r.close()
+
+            policy.sleep(delay)
+            attempt += 1
+
+    def send_once(self, http_method, url, headers, body, auth_data, stream=False, timeout=None):
+        """Sends a request once, timing it and dispatching the hooks.
+
+        :param timeout: Seconds to wait for the connection and for each read, or a ``(connect, read)`` pair
+        :rtype: :class:`requests.Response`
+        """
+
+        record = RequestRecord(self.get_service_name(), self.endpoint_label(url), http_method.upper(), url)
+        self.dispatch_hook('request', record)
+        record.start()
+
+        try:
+            rate_limiter = self.get_rate_limiter()
+            if rate_limiter is not None:
+                family = self.rate_limit_family(url)
+                start = clock()
+                rate_limiter.acquire(family)
+                record.timing['throttle'] = clock() - start
+
+            if self.creates_content(http_method, url):
+                content_limiter = self.get_content_limiter()
+                if content_limiter is not None:
+                    start = clock()
+                    content_limiter.acquire()
+                    record.timing['throttle'] += clock() - start
+
+            r = self.send_with_transport(http_method, url, headers, body, auth_data, stream,
+                                         {'response': record.mark_headers}, timeout)
+        except Exception as e:
+            record.finish(error=e)
+            self.record_request(record)
+            self.dispatch_hook('error', record)
+            raise
+
+        if rate_limiter is not None:
+            rate_limiter.update(family, r.headers, r.status_code)
+
+        record.finish(r)
+        self.record_request(record)
+        self.dispatch_hook('response', record)
+        return r
+
+    def send_with_transport(self, http_method, url, headers, body, auth_data, stream, hooks, timeout=None):
+        http_method = http_method.upper()
+        if http_method not in HTTP_METHODS:
             raise Exception("Invalid request method")
 
-        return self.handle_response(r, return_format)
+        return self.get_transport().send(http_method, url, headers, body, auth_data, stream, hooks, timeout)
+
+    def record_request(self, record):
+        if self.collect_metrics:
+            self.metrics.record(record)
+
+    def get_json_codec(self):
+        """Returns the codec of this instance.
+
+        :rtype: :class:`pyrate.jsoncodec.JSONCodec`
+        """
+
+        if self.json_codec is None or isinstance(self.json_codec, str):
+            return jsoncodec.get_codec(self.json_codec)
+        return self.json_codec
+
+    def encode_body(self, body):
+        if self.send_json:
+            # We need to make sure that body is jsonified; fast codecs reject some documents the standard library
+            # encodes (e.g. integers beyond 64 bits), so it gets the last word
+            for codec in (self.get_json_codec(), jsoncodec.get_codec('stdlib')):
+                try:
+                    return codec.dumps(body)
+                except (TypeError, ValueError):
+                    pass
+
+        return body
+
+    def compress_body(self, body, headers):
+        """Gzips an encoded body of at least ``compress_min_size`` bytes if ``compress_requests`` is set.
+
+        :rtype: tuple ``(body, headers)``
+        """
+
+        if not self.compress_requests or not isinstance(body, (bytes, str)) or len(body) < self.compress_min_size:
+            return body, headers
+        if headers and any(k.lower() == 'content-encoding' for k in headers):
+            return body, headers
+
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        headers = dict(headers or {})
+        headers['Content-Encoding'] = 'gzip'
+        return gzip_compress(body, self.compress_level), headers
 
     def handle_response(self, response, return_format):
+        content = response.content
         try:
-            return response.json()
+            return self.get_json_codec().loads(content)
         except (ValueError, TypeError):
-            return response.content
+            pass
+
+        if isinstance(content, bytes):
+            # The standard library gets the last word, like in encode_body, and skips a UTF-8 byte order mark
+            try:
+                return json.loads(content.decode('utf-8-sig'))
+            except ValueError:
+                pass
+        return content
 
     #Proxy functions for usability
     def get(self, method, content=None, headers=None, return_format=None):
@@ -164,6 +880,9 @@ class Pyrate(object):
     def put(self, method, content=None, headers=None, return_format=None):
         return self.do(method, content, headers, 'PUT', return_format)
 
+    def patch(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'PATCH', return_format)
+
     def delete(self, method, content=None, headers=None, return_format=None):
         return self.do(method, content, headers, 'DELETE', return_format)
 
@@ -0,0 +1,167 @@
+"""Pagination schemes used by :func:`pyrate.main.Pyrate.iter_pages` and :func:`pyrate.main.Pyrate.iter_items`.
+
+A paginator turns the request for a page into the request for the following one. Requests are ``(url, content)``
+pairs; content is sent as query string for GET calls and as body otherwise.
+"""
+
+__docformat__ = 'sphinx en'
+
+
+class PaginationError(Exception):
+    pass
+
+
+class Paginator(object):
+    """Base class of the pagination schemes.
+
+    :param string items_key: Key of the item list in dict pages, None if pages are lists
+    """
+
+    items_key = None
+
+    def __init__(self, items_key=None):
+        if items_key is not None:
+            self.items_key = items_key
+
+    def first_request(self, url, content):
+        return url, content
+
+    def next_request(self, url, content, response, page):
+        """Returns the ``(url, content)`` of the page following ``page``, or None if it was the last one."""
+        raise NotImplementedError('Please implement in subclass')
+
+    def items(self, page, items_key=None):
+        items_key = items_key or self.items_key
+        if items_key is None and isinstance(page, list):
+            return page
+
+        try:
+            return page[items_key]
+        except (KeyError, TypeError, IndexError):
+            raise PaginationError("No items found in page: %r" % (page,))
+
+
+def _with(content, **params):
+    # Never modify the caller's content
+    content = dict(content or {})
+    content.update(params)
+    return content
+
+
+class LinkHeaderPaginator(Paginator):
+    """Follows ``Link: <...>; rel="next"`` response headers (RFC 5988), as used by Github.
+
+    :param int per_page: Page size to ask for, None for the service default
+    """
+
+    def __init__(self, per_page=None, items_key=None):
+        super(LinkHeaderPaginator, self).__init__(items_key)
+        self.per_page = per_page
+
+    def first_request(self, url, content):
+        if self.per_page:
+            content = _with(content, per_page=self.per_page)
+        return url, content
+
+    def next_request(self, url, content, response, page):
+        try:
+            # The next link carries all query parameters already
+            return response.links['next']['url'], None
+        except KeyError:
+            return None
+
+
+class PageNumberPaginator(Paginator):
+    """Counts up a page number parameter until an empty (or short) page is returned, as used by Basecamp, Harvest
+    and Mailchimp.
+
+    :param string page_param: Name of the page number parameter
+    :param int first_page: Number of the first page
+    :param string limit_param: Name of the page size parameter, if the service has one
+    :param int page_size: Page size to ask for (if ``limit_param`` is set) or the fixed page size of the service.
+        A shorter page is the last one.
+    :param string total_key: Key of the total number of items in dict pages
+    :param string options_key: Key of a nested dict holding the paging parameters (like Mailchimp's ``opts``),
+        None if they are top-level parameters
+    :param int max_pages: Number of pages after which to stop, guarding against endpoints that ignore the page
+        parameter; None for no limit
+    """
+
+    def __init__(self, page_param='page', first_page=1, limit_param=None, page_size=None, total_key=None,
+                 items_key=None, options_key=None, max_pages=10000):
+        super(PageNumberPaginator, self).__init__(items_key)
+        self.page_param = page_param
+        self.first_page = first_page
+        self.limit_param = limit_param
+        self.page_size = page_size
+        self.total_key = total_key
+        self.options_key = options_key
+        self.max_pages = max_pages
+
+    def _with_params(self, content, **params):
+        if self.options_key:
+            content = dict(content or {})
+            return _with(content, **{self.options_key: _with(content.get(self.options_key), **params)})
+        return _with(content, **params)
+
+    def _page_number(self, content):
+        if self.options_key:
+            content = content[self.options_key]
+        return content[self.page_param]
+
+    def first_request(self, url, content):
+        params = {self.page_param: self.first_page}
+        if self.limit_param and self.page_size:
+            params[self.limit_param] = self.page_size
+        return url, self._with_params(content, **params)
+
+    def next_request(self, url, content, response, page):
+        items = self.items(page)
+        if not items or (self.page_size and len(items) < self.page_size):
+            return None
+
+        page_number = self._page_number(content)
+        pages_seen = page_number - self.first_page + 1
+        if self.max_pages and pages_seen >= self.max_pages:
+            return None
+        if self.total_key and self.page_size and pages_seen * self.page_size >= page[self.total_key]:
+            return None
+
+        return url, self._with_params(content, **{self.page_param: page_number + 1})
+
+
+class TwitterPaginator(Paginator):
+    """Twitter's two schemes: ``cursor``/``next_cursor`` for dict pages (followers, friends, lists) and
+    ``max_id`` for timelines and searches.
+
+    :param int count: Page size to ask for, None for the endpoint default
+    """
+
+    cursor_items_keys = ('ids', 'users', 'lists', 'statuses')
+
+    def __init__(self, count=None, items_key=None):
+        super(TwitterPaginator, self).__init__(items_key)
+        self.count = count
+
+    def first_request(self, url, content):
+        if self.count:
+            content = _with(content, count=self.count)
+        return url, content
+
+    def next_request(self, url, content, response, page):
+        if isinstance(page, dict) and 'next_cursor' in page:
+            if not page['next_cursor']:
+                return None
+            return url, _with(content, cursor=page['next_cursor'])
+
+        items = self.items(page)
+        if not items:
+            return None
+        return url, _with(content, max_id=min(item['id'] for item in items) - 1)
+
+    def items(self, page, items_key=None):
+        if isinstance(page, dict) and not (items_key or self.items_key):
+            for key in self.cursor_items_keys:
+                if key in page:
+                    return page[key]
+        return super(TwitterPaginator, self).items(page, items_key)
@@ -0,0 +1,139 @@
+"""Spreading the calls to one service over several credentials.
+
+Rate limits belong to credentials (see :mod:`pyrate.ratelimit`), so a pool of N credentials gets N times the quota.
+"""
+import threading
+import time
+
+from pyrate.main import run_many
+
+__docformat__ = 'sphinx en'
+
+
+class CredentialPool(object):
+    """Routes each call to the member with the most remaining quota for the endpoint family of the call.
+
+    Members that exhausted their quota are parked until it resets; when all are, the call goes to the one resetting
+    first and waits for it. Members without known quota (fresh ones, or ones without rate limiting) take turns.
+
+    Calls to user-scoped endpoints (see :func:`pyrate.main.Pyrate.is_user_scoped`) always go to the pinned member,
+    as do attributes and convenience methods of the service, which are looked up on it.
+
+    >>> pool = CredentialPool([GithubPyrate('user1', 'token1'), GithubPyrate('user2', 'token2')])
+    >>> pool.get('repos/someorg/somerepo')  # any credential
+    >>> pool.get('user/repos')              # always user1
+
+    :param list members: Pyrate instances of one service, one per credential
+    :param int pinned: Index of the member used for user-scoped calls
+    """
+
+    def __init__(self, members, pinned=0, clock=time.time):
+        if not members:
+            raise ValueError("A credential pool needs at least one member")
+
+        self.members = list(members)
+        self.pinned_index = pinned
+        self.pinned = self.members[pinned]
+        self.clock = clock
+        self.in_flight = [0] * len(self.members)
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __getattr__(self, name):
+        return getattr(self.pinned, name)
+
+    def close(self):
+        for member in self.members:
+            member.close()
+
+    def choose(self, method, return_format=None):
+        """Returns the index of the member a call to ``method`` should use."""
+
+        if self.pinned.is_user_scoped(method):
+            return self.pinned_index
+
+        url = self.pinned.get_template().url(method, return_format)
+        family = self.pinned.rate_limit_family(url)
+        now = self.clock()
+
+        with self._lock:
+            best, best_key = None, None
+            count = len(self.members)
+            # Start after the last choice, so members that compare equal take turns
+            for offset in range(count):
+                index = (self._next + offset) % count
+                key = self.availability(self.members[index], family, now, self.in_flight[index])
+                if best_key is None or key > best_key:
+                    best, best_key = index, key
+
+            self._next = (best + 1) % count
+            return best
+
+    def availability(self, member, family, now, in_flight):
+        # Sort key, greater is better: available members by remaining quota, then parked ones by reset time
+        limiter = member.get_rate_limiter()
+        remaining = limiter.remaining(family) if limiter is not None else None
+        if remaining is None:
+            return 1, float('inf'), -in_flight
+        if remaining - in_flight > 0:
+            return 1, remaining - in_flight, 0
+
+        reset_at = limiter.reset_at(family)
+        return 0, -(reset_at or now), -in_flight
+
+    def checkout(self, method, return_format=None):
+        index = self.choose(method, return_format)
+        with self._lock:
+            self.in_flight[index] += 1
+        return index
+
+    def checkin(self, index):
+        with self._lock:
+            self.in_flight[index] -= 1
+
+    def do(self, method, content=None, headers=None, http_method=None, return_format=None):
+        index = self.checkout(method, return_format)
+        try:
+            return self.members[index].do(method, content, headers, http_method, return_format)
+        finally:
+            self.checkin(index)
+
+    def iter_pages(self, method, *args, **kwargs):
+        """See :func:`pyrate.main.Pyrate.iter_pages`, all pages are fetched with the same credential."""
+        return self.members[self.choose(method, kwargs.get('return_format'))].iter_pages(method, *args, **kwargs)
+
+    def iter_items(self, method, *args, **kwargs):
+        """See :func:`pyrate.main.Pyrate.iter_items`, all pages are fetched with the same credential."""
+        return self.members[self.choose(method, kwargs.get('return_format'))].iter_items(method, *args, **kwargs)
+
+    def do_many(self, calls, max_workers=None, as_completed=False):
+        """See :func:`pyrate.main.Pyrate.do_many`, each call is routed on its own."""
+
+        if max_workers is None:
+            max_workers = sum(member.pool_maxsize for member in self.members)
+        return run_many(self.do, calls, max_workers, as_completed)
+
+    #Proxy functions for usability
+    def get(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'GET', return_format)
+
+    def post(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'POST', return_format)
+
+    def put(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'PUT', return_format)
+
+    def patch(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'PATCH', return_format)
+
+    def delete(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'DELETE', return_format)
+
+    def options(self, method, content=None, headers=None, return_format=None):
+        return self.do(method, content, headers, 'OPTIONS', return_format)
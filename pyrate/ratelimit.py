@@ -0,0 +1,270 @@
+"""Client-side pacing driven by the rate limit headers of the services.
+
+Quotas belong to credentials, so limiters are shared through a registry keyed by
+:func:`pyrate.main.Pyrate.auth_identity`: all instances and threads using the same credentials draw from the
+same buckets.
+"""
+from collections import deque
+import threading
+import time
+
+from requests.structures import CaseInsensitiveDict
+
+from pyrate.retry import RetryPolicy
+
+__docformat__ = 'sphinx en'
+
+_limiters = {}
+_window_limiters = {}
+_limiters_lock = threading.Lock()
+
+# (remaining, limit, reset) header names, the first one present wins
+RATE_LIMIT_HEADERS = [
+    ('X-RateLimit-Remaining', 'X-RateLimit-Limit', 'X-RateLimit-Reset'),  # Github
+    ('X-Rate-Limit-Remaining', 'X-Rate-Limit-Limit', 'X-Rate-Limit-Reset'),  # Twitter
+]
+
+
+def get_rate_limiter(key):
+    """Returns the limiter shared by everyone using the credentials identified by ``key``.
+
+    :rtype: :class:`RateLimiter`
+    """
+
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = RateLimiter()
+        return limiter
+
+
+def get_window_limiter(key, limits):
+    """Returns the :class:`WindowLimiter` with ``limits`` shared by everyone using the credentials identified by
+    ``key``."""
+
+    with _limiters_lock:
+        limiter = _window_limiters.get((key, limits))
+        if limiter is None:
+            limiter = _window_limiters[(key, limits)] = WindowLimiter(limits)
+        return limiter
+
+
+class RateLimitBucket(object):
+    """Token bucket for the quota of one endpoint family.
+
+    Tokens refill at the rate that spreads the remaining quota over the time left until the reset, so a burst of
+    calls is smoothed out instead of exhausting the quota early. Calls are only paced once less than
+    ``pace_below`` of the limit remains (always when the limit is unknown).
+    """
+
+    def __init__(self, burst, pace_below=0.1):
+        self.burst = burst
+        self.pace_below = pace_below
+        self.limit = None
+        self.remaining = None
+        self.reset_at = None
+        self.rate = None
+        self.tokens = burst
+        self.updated_at = None
+
+    def update(self, remaining, limit, reset_at, now):
+        if reset_at == self.reset_at and self.remaining is not None:
+            # Same window: responses may arrive out of order, trust the lowest count
+            remaining = min(remaining, self.remaining)
+
+        if self.updated_at is not None and self.rate:
+            # Credit the tokens refilled since the last reservation (the time its caller waited) before re-rating
+            self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+
+        self.remaining = remaining
+        self.limit = limit
+        self.reset_at = reset_at
+        self.rate = max(remaining, 0) / max(reset_at - now, 1.0)
+        self.tokens = min(self.tokens, self.burst, remaining)
+        self.updated_at = now
+
+    def reserve(self, now):
+        """Takes a token and returns the number of seconds to wait before using it."""
+
+        if self.remaining is None:
+            return 0.0
+
+        if self.reset_at <= now:
+            # New window, the quota is unknown until the next response tells us
+            self.remaining = None
+            self.tokens = self.burst
+            return 0.0
+
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.remaining -= 1
+        self.tokens -= 1
+
+        if self.remaining < 0:
+            return self.reset_at - now
+        if self.tokens >= 0 or not self.rate:
+            return 0.0
+        if self.limit and self.remaining >= self.pace_below * self.limit:
+            # Plenty of quota left, no need to spread it out yet
+            self.tokens = 0.0
+            return 0.0
+        return -self.tokens / self.rate
+
+
+class RateLimiter(object):
+    """Tracks the quota of one credential per endpoint family and paces calls accordingly.
+
+    :param int burst: Number of calls that may be made back to back before pacing kicks in
+    :param float pace_below: Fraction of the limit below which calls are paced, above it they are only held back
+        once the quota is exhausted
+    :param clock: Function returning the current epoch time
+    :param sleep: Function used to wait
+    """
+
+    def __init__(self, burst=10, pace_below=0.1, clock=time.time, sleep=time.sleep):
+        self.burst = burst
+        self.pace_below = pace_below
+        self.clock = clock
+        self.sleep = sleep
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, family):
+        """Blocks until a call to ``family`` may be made.
+
+        :rtype: Number of seconds waited
+        """
+
+        delay = self.reserve(family)
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    def reserve(self, family):
+        """Takes a token for a call to ``family`` without blocking, for callers waiting on their own (like the
+        asyncio engine).
+
+        :rtype: Number of seconds to wait before making the call
+        """
+
+        with self._lock:
+            bucket = self._buckets.get(family)
+            return bucket.reserve(self.clock()) if bucket is not None else 0.0
+
+    def update(self, family, headers, status_code=None):
+        """Updates the quota of ``family`` from the headers of a response."""
+
+        if not isinstance(headers, CaseInsensitiveDict):
+            headers = CaseInsensitiveDict(headers)
+
+        now = self.clock()
+        for remaining_header, limit_header, reset_header in RATE_LIMIT_HEADERS:
+            if remaining_header in headers and reset_header in headers:
+                remaining = int(headers[remaining_header])
+                limit = int(headers[limit_header]) if limit_header in headers else None
+                reset_at = float(headers[reset_header])
+                break
+        else:
+            if status_code not in (403, 429):
+                return
+            # Throttled without quota headers, back off for as long as we are told (seconds or an HTTP-date)
+            retry_after = RetryPolicy.parse_retry_after(headers.get('Retry-After'))
+            if retry_after is None:
+                return
+            remaining, limit, reset_at = 0, None, now + retry_after
+
+        with self._lock:
+            bucket = self._buckets.get(family)
+            if bucket is None:
+                bucket = self._buckets[family] = RateLimitBucket(self.burst, self.pace_below)
+            bucket.update(remaining, limit, reset_at, now)
+
+    def remaining(self, family):
+        """Returns the estimated remaining quota of ``family``, None if unknown."""
+
+        with self._lock:
+            bucket = self._buckets.get(family)
+            if bucket is None or bucket.reset_at is None or bucket.reset_at <= self.clock():
+                return None
+            return bucket.remaining
+
+    def reset_at(self, family):
+        """Returns the epoch time at which the quota of ``family`` resets, None if unknown."""
+
+        with self._lock:
+            bucket = self._buckets.get(family)
+            return bucket.reset_at if bucket is not None else None
+
+
+class WindowLimiter(object):
+    """Client-side limits on the number of calls per sliding time window, for limits the service does not announce
+    in headers (like Github's secondary rate limits).
+
+    Calls are given the earliest time slot that keeps every window within its limit, so concurrent callers are
+    spread out instead of all waiting for the same instant.
+
+    :param tuple limits: ``(calls, seconds)`` pairs, e.g. ``((80, 60), (500, 3600))``
+    :param clock: Function returning the current epoch time
+    :param sleep: Function used to wait
+    """
+
+    def __init__(self, limits, clock=time.time, sleep=time.sleep):
+        self.limits = tuple(sorted(limits, key=lambda limit: limit[1]))
+        self.clock = clock
+        self.sleep = sleep
+        self.paused_until = 0.0
+        self._slots = deque()
+        self._lock = threading.Lock()
+
+    def _reserve(self, now):
+        # Takes the next free slot and returns the number of seconds to wait for it, with the lock held
+        slots = self._slots
+        longest = self.limits[-1][1] if self.limits else 0
+        while slots and slots[0] <= now - longest:
+            slots.popleft()
+
+        at = max(now, self.paused_until)
+        for calls, seconds in self.limits:
+            if len(slots) >= calls:
+                at = max(at, slots[-calls] + seconds)
+        slots.append(at)
+        return at - now
+
+    def acquire(self):
+        """Blocks until a call may be made.
+
+        :rtype: Number of seconds waited
+        """
+
+        delay = self.reserve()
+        if delay > 0:
+            self.sleep(delay)
+        return delay
+
+    def reserve(self):
+        """Takes the next free slot without blocking, see :func:`RateLimiter.reserve`.
+
+        :rtype: Number of seconds to wait for the slot
+        """
+
+        with self._lock:
+            return self._reserve(self.clock())
+
+    def wait(self):
+        """Blocks while calls are paused, without taking a slot."""
+
+        delay = self.paused_for()
+        if delay > 0:
+            self.sleep(delay)
+
+    def paused_for(self):
+        """Returns the number of seconds calls are still held back by :func:`pause`."""
+
+        with self._lock:
+            return max(0.0, self.paused_until - self.clock())
+
+    def pause(self, seconds):
+        """Holds back all calls for ``seconds``, e.g. after the service asked to slow down."""
+
+        with self._lock:
+            self.paused_until = max(self.paused_until, self.clock() + seconds)
@@ -0,0 +1,124 @@
+"""Lookup of the service classes by name, importing only the service asked for.
+
+The bundled services are known by name; third-party packages add theirs through the ``pyrate.services`` entry
+point group (``pyrate.async_services`` for asyncio classes), e.g. in their ``setup.py``::
+
+    entry_points={'pyrate.services': ['myservice = mypackage.service:MyServicePyrate']}
+
+Entry points are only scanned when a name is not found among the registered services.
+"""
+from importlib import import_module
+import threading
+
+__docformat__ = 'sphinx en'
+
+ENTRY_POINT_GROUPS = {False: 'pyrate.services', True: 'pyrate.async_services'}
+
+_services = {
+    False: {
+        'basecamp': 'pyrate.services.basecamp:BasecampPyrate',
+        'github': 'pyrate.services.github:GithubPyrate',
+        'harvest': 'pyrate.services.harvest:HarvestPyrate',
+        'mailchimp': 'pyrate.services.mailchimp:MailchimpPyrate',
+        'twitter': 'pyrate.services.twitter:TwitterPyrate',
+    },
+    True: {
+        'basecamp': 'pyrate.services.aio:AsyncBasecampPyrate',
+        'github': 'pyrate.services.aio:AsyncGithubPyrate',
+        'harvest': 'pyrate.services.aio:AsyncHarvestPyrate',
+        'mailchimp': 'pyrate.services.aio:AsyncMailchimpPyrate',
+        'twitter': 'pyrate.services.aio:AsyncTwitterPyrate',
+    },
+}
+_scanned = set()
+_lock = threading.Lock()
+
+
+class ServiceNotFoundError(Exception):
+    pass
+
+
+def register_service(name, target, asynchronous=False):
+    """Registers a service class under ``name``, replacing any service of that name.
+
+    :param target: The class, or its ``'module:Class'`` path to import it on first use
+    """
+
+    with _lock:
+        _services[asynchronous][name] = target
+
+
+def iter_entry_points(group):
+    """Yields ``(name, 'module:Class')`` pairs of the installed entry points of ``group``."""
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        import pkg_resources
+        for entry_point in pkg_resources.iter_entry_points(group):
+            yield entry_point.name, '%s:%s' % (entry_point.module_name, '.'.join(entry_point.attrs))
+        return
+
+    try:
+        selected = entry_points(group=group)
+    except TypeError:
+        # Python < 3.10
+        selected = entry_points().get(group, ())
+    for entry_point in selected:
+        yield entry_point.name, entry_point.value
+
+
+def scan_entry_points(asynchronous=False):
+    """Registers the services of the installed entry points that are not registered yet."""
+
+    group = ENTRY_POINT_GROUPS[asynchronous]
+    discovered = list(iter_entry_points(group))
+    with _lock:
+        for name, target in discovered:
+            _services[asynchronous].setdefault(name, target)
+        _scanned.add(asynchronous)
+
+
+def available_services(asynchronous=False):
+    """Returns the sorted names of the known services, including those of entry points."""
+
+    if asynchronous not in _scanned:
+        scan_entry_points(asynchronous)
+    return sorted(_services[asynchronous])
+
+
+def get_service_class(name, asynchronous=False):
+    """Returns the service class called ``name``, importing its module if needed.
+
+    :param bool asynchronous: Whether to return the :class:`pyrate.aio.AsyncPyrate` variant
+    :raises ServiceNotFoundError: if no service of that name is registered or installed
+    """
+
+    target = _services[asynchronous].get(name)
+    if target is None and asynchronous not in _scanned:
+        scan_entry_points(asynchronous)
+        target = _services[asynchronous].get(name)
+    if target is None:
+        raise ServiceNotFoundError("Unknown %sservice: %r" % ('async ' if asynchronous else '', name))
+
+    if isinstance(target, str):
+        module_name, _, attrs = target.partition(':')
+        cls = import_module(module_name)
+        for attr in attrs.split('.'):
+            cls = getattr(cls, attr)
+        with _lock:
+            _services[asynchronous][name] = target = cls
+
+    return target
+
+
+def get_service(name, *args, **kwargs):
+    """Returns an instance of the service called ``name``, created with the remaining arguments.
+
+    >>> h = get_service('github', 'user', 'password')
+
+    :param bool asynchronous: Keyword only, whether to create the :class:`pyrate.aio.AsyncPyrate` variant
+    """
+
+    asynchronous = kwargs.pop('asynchronous', False)
+    return get_service_class(name, asynchronous)(*args, **kwargs)
@@ -0,0 +1,108 @@
+"""Retries with exponential backoff, see :attr:`pyrate.main.Pyrate.retry_policy`."""
+from email.utils import mktime_tz, parsedate_tz
+import random
+import threading
+import time
+
+__docformat__ = 'sphinx en'
+
+
+class RetryBudget(object):
+    """Caps retries to a fraction of the requests made, so retries cannot multiply the load on a failing service.
+
+    Every request deposits ``ratio`` tokens, every retry withdraws one. ``min_tokens`` allows a few retries even
+    when there is little traffic.
+
+    :param float ratio: Retries allowed per request
+    :param int min_tokens: Tokens available from the start (and at least kept available to refill)
+    :param int max_tokens: Maximum number of tokens that can be saved up
+    """
+
+    def __init__(self, ratio=0.1, min_tokens=10, max_tokens=100):
+        self.ratio = ratio
+        self.min_tokens = min_tokens
+        self.max_tokens = max_tokens
+        self.tokens = float(min_tokens)
+        self._lock = threading.Lock()
+
+    def record_request(self):
+        with self._lock:
+            self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def withdraw(self):
+        """Takes a token for a retry, returns False if the budget is used up."""
+
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+#: Budget shared by all retry policies of the process
+DEFAULT_BUDGET = RetryBudget()
+
+
+class RetryPolicy(object):
+    """Decides which failed requests are retried and how long to wait in between.
+
+    Waits use exponential backoff with full jitter: a random time between 0 and
+    ``min(backoff_max, backoff_base * 2 ** attempt)``, unless the response carries a ``Retry-After`` header.
+
+    :param int total: Maximum number of retries of a request
+    :param methods: HTTP methods that are safe to retry
+    :param statuses: Response status codes that are retried
+    :param float backoff_base: Base of the exponential backoff in seconds
+    :param float backoff_max: Maximum backoff in seconds
+    :param bool respect_retry_after: Whether to wait as long as the ``Retry-After`` header asks
+    :param budget: The :class:`RetryBudget` retries are drawn from
+    :param sleep: Function used to wait
+    """
+
+    def __init__(self, total=3, methods=('GET', 'PUT', 'DELETE', 'OPTIONS'), statuses=(429, 502, 503, 504),
+                 backoff_base=0.5, backoff_max=30.0, respect_retry_after=True, budget=DEFAULT_BUDGET,
+                 sleep=time.sleep):
+        self.total = total
+        self.methods = frozenset(method.upper() for method in methods)
+        self.statuses = frozenset(statuses)
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.respect_retry_after = respect_retry_after
+        self.budget = budget
+        self.sleep = sleep
+
+    def should_retry(self, http_method, attempt, response=None):
+        """Whether to retry after ``attempt`` (counting from 0) failed with ``response``, or with a connection
+        error if ``response`` is None."""
+
+        if attempt >= self.total or http_method.upper() not in self.methods:
+            return False
+        if response is not None and response.status_code not in self.statuses:
+            return False
+        return self.budget is None or self.budget.withdraw()
+
+    def backoff(self, attempt, response=None):
+        """Returns the number of seconds to wait before retrying after ``attempt``."""
+
+        if response is not None and self.respect_retry_after:
+            retry_after = self.parse_retry_after(response.headers.get('Retry-After'))
+            if retry_after is not None:
+                return retry_after
+
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """Returns the seconds a ``Retry-After`` header (delay in seconds or HTTP-date) asks to wait, None if it is
+        missing or invalid."""
+
+        if not value:
+            return None
+
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            return max(0.0, mktime_tz(date) - time.time())
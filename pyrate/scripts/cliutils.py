@@ -1,9 +1,18 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
+from __future__ import print_function
+
 import os
-import requests
-from requests_oauthlib import OAuth1
-from urlparse import parse_qs
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:
+    from urlparse import parse_qs
+
+try:
+    input = raw_input
+except NameError:
+    pass
 
 
 def twitter_oauth():
@@ -14,8 +23,8 @@ def twitter_oauth():
     print("Twitter OAuth")
     print("-------------")
     print()
-    oauth_consumer_key = raw_input("Please enter your OAuth Consumer Key: ")
-    oauth_consumer_secret = raw_input("Please enter your OAuth Consumer Secret: ")
+    oauth_consumer_key = input("Please enter your OAuth Consumer Key: ")
+    oauth_consumer_secret = input("Please enter your OAuth Consumer Secret: ")
 
     oauth_token, oauth_token_secret = setup_twitter_oauth(oauth_consumer_key, oauth_consumer_secret)
 
@@ -30,10 +39,14 @@ def setup_twitter_oauth(oauth_consumer_key, oauth_consumer_secret):
     oauth_access_token_url = 'https://api.twitter.com/oauth/access_token'
 
     """Authorize your app via identifier."""
+    # Imported here, the menu should not wait for them
+    import requests
+    from requests_oauthlib import OAuth1
+
     # Request token
     oauth = OAuth1(oauth_consumer_key, client_secret=oauth_consumer_secret)
     r = requests.post(url=oauth_request_token_url, auth=oauth)
-    credentials = parse_qs(r.content)
+    credentials = parse_qs(r.text)
 
     resource_owner_key = credentials.get('oauth_token')[0]
     resource_owner_secret = credentials.get('oauth_token_secret')[0]
@@ -43,7 +56,7 @@ def setup_twitter_oauth(oauth_consumer_key, oauth_consumer_secret):
     print('Please go here to authorize:')
     print(authorize_url)
 
-    verifier = raw_input('Please input the verifier: ')
+    verifier = input('Please input the verifier: ')
     oauth = OAuth1(oauth_consumer_key,
                    client_secret=oauth_consumer_secret,
                    resource_owner_key=resource_owner_key,
@@ -52,7 +65,7 @@ def setup_twitter_oauth(oauth_consumer_key, oauth_consumer_secret):
 
     # Finally, Obtain the Access Token
     r = requests.post(url=oauth_access_token_url, auth=oauth)
-    credentials = parse_qs(r.content)
+    credentials = parse_qs(r.text)
     token = credentials.get('oauth_token')[0]
     secret = credentials.get('oauth_token_secret')[0]
 
@@ -80,7 +93,7 @@ def main():
     print("1 Generate Twitter OAuth Tokens")
     print("0 Exit")
     print()
-    c = raw_input("Your Choice: ")
+    c = input("Your Choice: ")
 
     if c == '1':
         twitter_oauth()
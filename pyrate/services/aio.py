@@ -0,0 +1,190 @@
+"""Asyncio variants of the pyrate services, see :class:`pyrate.aio.AsyncPyrate`.
+
+Convenience methods that only return the result of :func:`do` (like ``GithubPyrate.create_repo``) are inherited
+as-is and return an awaitable; the ones post-processing the response are reimplemented as coroutines.
+"""
+import asyncio
+
+from pyrate.aio import AsyncGraphQLBatch, AsyncPyrate, AsyncStream, run_many
+from pyrate.pagination import PaginationError
+from pyrate.services.basecamp import BasecampPyrate
+from pyrate.services.github import BulkRun, GithubPyrate
+from pyrate.services.harvest import HarvestPyrate
+from pyrate.services.mailchimp import Batch, ListNotFoundError, MailchimpPyrate, member_row
+from pyrate.services.twitter import TwitterPyrate
+
+
+class AsyncBasecampPyrate(AsyncPyrate, BasecampPyrate):
+
+    async def check_connection(self):
+        self.connection_check_method[3] = self.auth_user
+        return await AsyncPyrate.check_connection(self)
+
+
+class AsyncGithubPyrate(AsyncPyrate, GithubPyrate):
+    graphql_batch_class = AsyncGraphQLBatch
+
+    async def get_repos_metadata(self, names, fields=None):
+        batch = self.graphql_batch()
+        lookups = self.add_repo_lookups(batch, names, fields)
+        await batch.execute()
+        return dict((full_name, lookup.data) for full_name, lookup in lookups.items())
+
+    async def bulk(self, action, requests, total=None, max_in_flight=4, checkpoint=None, on_progress=None):
+        """Async generator counterpart of :func:`pyrate.services.github.GithubPyrate.bulk`, so the inherited
+        ``create_repos``, ``archive_repos`` and ``delete_repos`` are iterated with ``async for``."""
+
+        run = BulkRun(action, requests, total, checkpoint, on_progress)
+        try:
+            async for index, res in run_many(self.send_bulk_request, run.calls(), max_in_flight, as_completed=True):
+                for result in run.collect(index, res):
+                    yield result
+            for result in run.flush():
+                yield result
+        finally:
+            run.close()
+
+    async def send_bulk_request(self, method, content=None, http_method=None):
+        http_method, url, headers, body, return_format = self.build_request(method, content, None, http_method)
+        limiter = self.get_content_limiter()
+
+        attempt = 0
+        while True:
+            if limiter is not None and not self.creates_content(http_method, url):
+                await self.throttle(limiter.paused_for())
+
+            response = await self.send_request(http_method, url, headers, body)
+            data = self.handle_response(response, return_format)
+            delay = self.secondary_limit_delay(response, data)
+            if delay is None or attempt >= self.secondary_limit_retries:
+                return response.status_code, data
+
+            if limiter is not None:
+                limiter.pause(delay)
+            else:
+                await asyncio.sleep(delay)
+            attempt += 1
+
+
+class AsyncHarvestPyrate(AsyncPyrate, HarvestPyrate):
+    pass
+
+
+class AsyncMailchimpPyrate(AsyncPyrate, MailchimpPyrate):
+    _async_list_index_lock = None
+
+    async def getLists(self, filters=None, start=None, limit=None, sort_field=None, sort_dir=None):
+        fargs = locals()
+        res = await self.do('lists/list', http_method='POST', content=self.build_content(fargs))
+        if self.check_response_success(res):
+            return res['data']
+        else:
+            return res
+
+    async def getListByName(self, list_name, refresh_missing=True):
+        loaded_at = self._list_index_loaded_at
+        if self.listIndexExpired(loaded_at):
+            await self.refreshListIndex(loaded_at)
+
+        l = self._lists_by_name.get(list_name)
+        if l is None and refresh_missing and self.listIndexExpired(self._list_index_loaded_at,
+                                                                   self.list_index_min_refresh):
+            await self.refreshListIndex(self._list_index_loaded_at)
+            l = self._lists_by_name.get(list_name)
+
+        if l is None:
+            raise ListNotFoundError(list_name)
+        return l
+
+    async def getListId(self, list_name):
+        looks_like_id = bool(self.list_id_pattern.match(list_name))
+        try:
+            return (await self.getListByName(list_name, refresh_missing=not looks_like_id))['id']
+        except ListNotFoundError:
+            if looks_like_id:
+                return list_name
+            raise
+
+    async def refreshListIndex(self, loaded_at=None):
+        if self._async_list_index_lock is None:
+            self._async_list_index_lock = asyncio.Lock()
+
+        async with self._async_list_index_lock:
+            if self._list_index_loaded_at != loaded_at:
+                return
+
+            lists, page_size = [], self.paginator.page_size
+            while True:
+                page = await self.getLists(start=len(lists) // page_size, limit=page_size)
+                if not isinstance(page, list):
+                    raise PaginationError("No items found in page: %r" % (page,))
+                lists.extend(page)
+                if len(page) < page_size:
+                    break
+
+            self.storeListIndex(lists)
+
+    async def iterListMembers(self, list_name, status=None, prefetch=False):
+        list_id = await self.getListId(list_name)
+        fargs = {'id': list_id, 'status': status}
+        async for member in self.iter_items('lists/members', http_method='POST', content=self.build_content(fargs),
+                                            prefetch=prefetch, paginator=self.members_paginator):
+            yield member
+
+    async def subscribeToList(self, list_name, user_email, merge_vars=None, email_type=None, double_optin=None,
+                              update_existing=None, replace_interests=None, send_welcome=None):
+
+        list_id = await self.getListId(list_name)
+        fargs = {'id': list_id, 'email': {'email': user_email}, 'merge_vars': merge_vars, 'email_type': email_type,
+                 'double_optin': double_optin, 'update_existing': update_existing,
+                 'replace_interests': replace_interests, 'send_welcome': send_welcome}
+
+        return await self.do('lists/subscribe', http_method='POST', content=self.build_content(fargs))
+
+    async def unsubscribeFromList(self, list_name, user_email, delete_member=None, send_goodbye=None,
+                                  send_notify=None):
+        list_id = await self.getListId(list_name)
+        fargs = {'id': list_id, 'email': {'email': user_email}, 'delete_member': delete_member,
+                 'send_goodbye': send_goodbye, 'send_notify': send_notify}
+
+        return await self.do('lists/unsubscribe', http_method='POST', content=self.build_content(fargs))
+
+    async def batchSubscribe(self, list_name, members, double_optin=None, update_existing=None,
+                             replace_interests=None, max_in_flight=4, on_error=None):
+        fargs = {'id': await self.getListId(list_name), 'double_optin': double_optin,
+                 'update_existing': update_existing, 'replace_interests': replace_interests}
+        return await self._batch('lists/batch-subscribe', fargs, (member_row(m) for m in members), max_in_flight,
+                                 on_error)
+
+    async def batchUnsubscribe(self, list_name, emails, delete_member=None, send_goodbye=None, send_notify=None,
+                               max_in_flight=4, on_error=None):
+        fargs = {'id': await self.getListId(list_name), 'delete_member': delete_member,
+                 'send_goodbye': send_goodbye, 'send_notify': send_notify}
+        return await self._batch('lists/batch-unsubscribe', fargs, (member_row(e)['email'] for e in emails),
+                                 max_in_flight, on_error)
+
+    async def _batch(self, method, fargs, rows, max_in_flight, on_error):
+        batch = Batch(method, fargs, rows, self.batch_chunk_size, on_error)
+        async for index, res in self.do_many(batch.calls(), max_workers=max_in_flight, as_completed=True):
+            batch.collect(index, res)
+        return batch.result
+
+
+class AsyncTwitterPyrate(AsyncPyrate, TwitterPyrate):
+
+    async def tweet(self, status, in_reply_to_status_id=None, loc_lat=None, loc_long=None, place_id=None,
+                    display_coordinates=None, trim_user=None, include_entities=None):
+        fargs = {'status': status, 'in_reply_to_status_id': in_reply_to_status_id, 'lat': loc_lat, 'long': loc_long,
+                 'place_id': place_id, 'display_coordinates': display_coordinates, 'trim_user': trim_user,
+                 'include_entities': include_entities}
+        res = await self.do('statuses/update', http_method='POST', content=self.build_content(fargs))
+        return self.check_response_success(res)
+
+    def stream(self, method, content=None, http_method='GET', **options):
+        """Opens a streaming endpoint, iterate the result with ``async for``.
+
+        :rtype: :class:`pyrate.aio.AsyncStream`
+        """
+
+        url, content, headers = self.build_stream_request(method, content, options.get('delimited'))
+        return AsyncStream(self, url, content, headers, http_method, **options)
@@ -1,4 +1,6 @@
+from pyrate.auth import BasicAuth
 from pyrate.main import Pyrate
+from pyrate.pagination import PageNumberPaginator
 
 
 class BasecampPyrate(Pyrate):
@@ -12,7 +14,9 @@ class BasecampPyrate(Pyrate):
     default_body_content = {}
     auth_type = 'BASIC_AUTH'
     connection_check_method = ['GET', 'people/me', 'email_address', '']
+    service_name = 'basecamp'
     send_json = True
+    paginator = PageNumberPaginator(page_size=50)
 
     def __init__(self, auth_user, auth_pass, org_id, default_http_method=None, default_return_format=None):
         super(BasecampPyrate, self).__init__()
@@ -22,7 +26,6 @@ class BasecampPyrate(Pyrate):
         self.base_url = 'https://basecamp.com/' + self.org_id + '/api/v1/'
 
         self.default_header_content = {
-            'Authorization': self.create_basic_auth(self.auth_user, self.auth_pass),
             'User Agent': 'Pyrate (' + auth_user + ')'
         }
 
@@ -34,6 +37,9 @@ class BasecampPyrate(Pyrate):
         else:
             self.default_return_format = self.return_formats[0]
 
+    def create_auth(self):
+        return BasicAuth(self.auth_user, self.auth_pass)
+
     def check_connection(self):
         self.connection_check_method[3] = self.auth_user
         return Pyrate.check_connection(self)
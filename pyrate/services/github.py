@@ -1,10 +1,177 @@
-from pyrate.main import Pyrate
+import os
+import time
+
+from pyrate.auth import BasicAuth
+from pyrate.graphql import GraphQLBatch
+from pyrate.main import CallError, Pyrate, run_many
+from pyrate.pagination import LinkHeaderPaginator
+from pyrate.retry import RetryPolicy
 
 
 class OrganisationNotFoundError(Exception):
     pass
 
 
+class RepoResult(object):
+    """Outcome for one repository of a bulk operation, see :func:`GithubPyrate.create_repos`.
+
+    ``status`` is the HTTP status of the last attempt (None if no response was received), ``data`` the decoded
+    response and ``error`` the exception or the error returned by Github. Repositories done in a previous run
+    according to the checkpoint are reported with ``skipped`` set.
+    """
+
+    def __init__(self, action, owner, name, status=None, data=None, error=None, skipped=False):
+        self.action = action
+        self.owner = owner
+        self.name = name
+        self.status = status
+        self.data = data
+        self.error = error
+        self.skipped = skipped
+
+    def __repr__(self):
+        state = 'skipped' if self.skipped else self.status
+        return '<RepoResult %s %s %s>' % (self.action, self.full_name, state)
+
+    @property
+    def full_name(self):
+        return '%s/%s' % (self.owner, self.name)
+
+    @property
+    def ok(self):
+        return self.skipped or self.error is None
+
+
+class BulkProgress(object):
+    """Running totals of a bulk operation, passed to its ``on_progress`` callback after each repository.
+
+    ``total`` is None when the repositories were given as an iterator of unknown length.
+    """
+
+    def __init__(self, total=None):
+        self.total = total
+        self.done = 0
+        self.succeeded = 0
+        self.failed = 0
+        self.skipped = 0
+        self.started_at = time.time()
+
+    def __repr__(self):
+        return '<BulkProgress %d/%s succeeded=%d failed=%d skipped=%d %.1f/s>' % (
+            self.done, '?' if self.total is None else self.total, self.succeeded, self.failed, self.skipped,
+            self.rate)
+
+    @property
+    def rate(self):
+        """Repositories processed per second, skipped ones excluded."""
+        elapsed = time.time() - self.started_at
+        return (self.done - self.skipped) / elapsed if elapsed > 0 else 0.0
+
+    def add(self, result):
+        self.done += 1
+        if result.skipped:
+            self.skipped += 1
+        elif result.ok:
+            self.succeeded += 1
+        else:
+            self.failed += 1
+
+
+class Checkpoint(object):
+    """Remembers the repositories a bulk operation completed, in a file with one line per repository.
+
+    Passing the file of an interrupted run to the same operation skips what is already done. Failed repositories
+    are not recorded, so they are tried again.
+
+    :param string path: Path of the checkpoint file, created if missing
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done.update(line.rstrip('\n') for line in f if line.strip())
+        self._file = None
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def record(self, key):
+        if self._file is None:
+            self._file = open(self.path, 'a')
+        self._file.write(key + '\n')
+        self._file.flush()
+        self.done.add(key)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BulkRun(object):
+    """State of one :func:`GithubPyrate.bulk` operation: turns its requests into calls, skipping those the
+    checkpoint has, and the outcomes of the calls into :class:`RepoResult` objects, for the synchronous and the
+    asyncio implementations."""
+
+    def __init__(self, action, requests, total=None, checkpoint=None, on_progress=None):
+        if checkpoint is not None and not isinstance(checkpoint, Checkpoint):
+            checkpoint = Checkpoint(checkpoint)
+
+        self.action = action
+        self.requests = requests
+        self.checkpoint = checkpoint
+        self.on_progress = on_progress
+        self.progress = BulkProgress(total)
+        self.in_flight = {}
+        self.skipped = []
+
+    def calls(self):
+        for owner, name, http_method, method, content in self.requests:
+            if self.checkpoint is not None and '%s %s/%s' % (self.action, owner, name) in self.checkpoint:
+                self.skipped.append(RepoResult(self.action, owner, name, skipped=True))
+                continue
+            self.in_flight[len(self.in_flight)] = (owner, name)
+            yield method, content, http_method
+
+    def collect(self, index, res):
+        """Returns the results to report for the outcome of call ``index``, after those skipped so far."""
+
+        results = self.flush()
+        (owner, name), self.in_flight[index] = self.in_flight[index], None
+        if isinstance(res, CallError):
+            results.append(self.report(RepoResult(self.action, owner, name, error=res.exception)))
+            return results
+
+        status, data = res
+        error = None
+        if status >= 300:
+            error = data.get('message', data) if isinstance(data, dict) else data
+        results.append(self.report(RepoResult(self.action, owner, name, status, data, error)))
+        return results
+
+    def flush(self):
+        """Returns the results of the repositories skipped so far."""
+
+        results = []
+        while self.skipped:
+            results.append(self.report(self.skipped.pop(0)))
+        return results
+
+    def report(self, result):
+        if self.checkpoint is not None and not result.skipped and result.ok:
+            self.checkpoint.record('%s %s/%s' % (self.action, result.owner, result.name))
+        self.progress.add(result)
+        if self.on_progress is not None:
+            self.on_progress(self.progress)
+        return result
+
+    def close(self):
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+
+
 class GithubPyrate(Pyrate):
     # These variables must be set on instantiation
     auth_user = ''
@@ -15,16 +182,36 @@ class GithubPyrate(Pyrate):
     default_body_content = {}
     auth_type = 'BASIC_AUTH'
     connection_check_method = ['GET', '#', 'current_user_url', '']
+    service_name = 'github'
     base_url = 'https://api.github.com/'
     send_json = True
+    paginator = LinkHeaderPaginator(per_page=100)
+    rate_limit = True
+    # Secondary rate limits on requests creating content
+    # https://docs.github.com/en/rest/using-the-rest-api/rate-limits-for-the-rest-api#about-secondary-rate-limits
+    content_creation_limits = ((80, 60), (500, 3600))
+    # Attempts of a bulk request after hitting a secondary rate limit
+    secondary_limit_retries = 5
+    # Seconds to hold back after hitting a secondary rate limit, when Github does not say how long
+    secondary_limit_wait = 60
+    # Resources of the authenticated user
+    user_scoped_endpoints = [r'user(/|$)', r'notifications(/|$)', r'(issues|gists)$', r'gists/starred$']
+    # Templates of the endpoints in metrics
+    endpoint_labels = [(r'repos/[^/]+/[^/]+', 'repos/{owner}/{name}'), (r'orgs/[^/]+', 'orgs/{org}'),
+                       (r'users/[^/]+', 'users/{user}'), (r'gists/[0-9a-f]+', 'gists/{id}')]
+    graphql_endpoint = 'graphql'
+    graphql_batch_class = GraphQLBatch
+    # Budget of a batched GraphQL query, Github charges one point per 100 nodes
+    # https://docs.github.com/en/graphql/overview/rate-limits-and-node-limits-for-the-graphql-api
+    graphql_max_aliases = 100
+    graphql_max_nodes = 10000
+    repo_metadata_fields = ('nameWithOwner description url isPrivate isArchived isFork stargazerCount forkCount '
+                            'pushedAt updatedAt primaryLanguage { name } defaultBranchRef { name }')
 
     def __init__(self, auth_user, auth_pass, default_http_method=None, default_return_format=None):
         super(GithubPyrate, self).__init__()
         self.auth_user = auth_user
         self.auth_pass = auth_pass
-        self.default_header_content = {
-            'Authorization': self.create_basic_auth(self.auth_user, self.auth_pass)
-        }
 
         if default_http_method:
             self.default_http_method = default_http_method
@@ -32,13 +219,80 @@ class GithubPyrate(Pyrate):
         if default_return_format or default_return_format == '':
             self.default_return_format = default_return_format
 
+    def create_auth(self):
+        return BasicAuth(self.auth_user, self.auth_pass)
+
+    def rate_limit_family(self, url):
+        # https://developer.github.com/v3/rate_limit/
+        if url.startswith(self.base_url + 'search/'):
+            return 'search'
+        if url.startswith(self.base_url + 'graphql'):
+            return 'graphql'
+        return 'core'
+
+    def creates_content(self, http_method, url):
+        if url.startswith(self.base_url + self.graphql_endpoint):
+            # Queries are POSTed as well, but only read
+            return False
+        return super(GithubPyrate, self).creates_content(http_method, url)
+
+    def graphql(self, query, variables=None):
+        """Sends a GraphQL query.
+
+        :rtype: dict, the decoded response with its ``data`` and ``errors``
+        """
+
+        content = {'query': query}
+        if variables:
+            content['variables'] = variables
+        return self.do(self.graphql_endpoint, content, http_method='POST')
+
+    def graphql_batch(self, max_aliases=None, max_nodes=None):
+        """Returns a :class:`pyrate.graphql.GraphQLBatch` merging lookups into as few GraphQL queries as
+        ``graphql_max_aliases`` and ``graphql_max_nodes`` allow.
+
+        >>> with h.graphql_batch() as batch:
+        ...     repos = [batch.add('repository(owner: $owner, name: $name) { stargazerCount }', owner=o, name=n)
+        ...              for o, n in names]
+        >>> [repo.result() for repo in repos]
+        """
+
+        return self.graphql_batch_class(self, max_aliases or self.graphql_max_aliases,
+                                        max_nodes or self.graphql_max_nodes)
+
+    def get_repos_metadata(self, names, fields=None):
+        """Returns the metadata of many repositories, looked up with batched GraphQL queries.
+
+        :param names: Names of the repositories, ``'owner/name'`` or just ``'name'`` for repositories of the user
+        :param string fields: GraphQL selection of the ``Repository`` fields, ``repo_metadata_fields`` by default
+        :rtype: dict, the metadata by name as given, None for repositories not found
+        """
+
+        batch = self.graphql_batch()
+        lookups = self.add_repo_lookups(batch, names, fields)
+        batch.execute()
+        return dict((full_name, lookup.data) for full_name, lookup in lookups.items())
+
+    def add_repo_lookups(self, batch, names, fields=None):
+        """Adds the lookups of :func:`get_repos_metadata` to a batch.
+
+        :rtype: dict, the :class:`pyrate.graphql.Lookup` by name as given
+        """
+
+        field = 'repository(owner: $owner, name: $name) { %s }' % (fields or self.repo_metadata_fields)
+        lookups = {}
+        for full_name in names:
+            owner, _, name = full_name.rpartition('/')
+            lookups[full_name] = batch.add(field, owner=owner or self.auth_user, name=name)
+        return lookups
+
     def get_my_orgs(self):
         return self.do('user/orgs', http_method='GET')
 
     def create_repo(self, name, description=False, org_name=False, private=False):
         fargs = {'name': name, 'description': description, 'private': private}
         if org_name:
-            query = 'orgs/' + str(org_name) + '/repos'
+            query = self.endpoint('orgs/{org}/repos', org=org_name)
         else:
             query = 'user/repos'
 
@@ -50,5 +304,128 @@ class GithubPyrate(Pyrate):
         else:
             user = self.auth_user
 
-        query = 'repos/' + user + '/' + name
+        query = self.endpoint('repos/{owner}/{name}', owner=user, name=name)
         return self.do(query, http_method='DELETE')
+
+    def archive_repo(self, name, org_name=False):
+        owner = str(org_name) if org_name else self.auth_user
+        query = self.endpoint('repos/{owner}/{name}', owner=owner, name=name)
+        return self.do(query, http_method='PATCH', content={'archived': True})
+
+    def create_repos(self, repos, org_name=False, max_in_flight=4, checkpoint=None, on_progress=None):
+        """Creates any number of repositories concurrently, see :func:`bulk`.
+
+        :param repos: Repository names, or dicts of the fields taken by Github (``name``, ``description``,
+            ``private``, ...)
+        """
+
+        owner = str(org_name) if org_name else self.auth_user
+        query = self.endpoint('orgs/{org}/repos', org=org_name) if org_name else 'user/repos'
+
+        def requests():
+            for repo in repos:
+                content = dict(repo) if isinstance(repo, dict) else {'name': repo}
+                yield owner, content['name'], 'POST', query, content
+
+        return self.bulk('create', requests(), self._length(repos), max_in_flight, checkpoint, on_progress)
+
+    def archive_repos(self, names, org_name=False, max_in_flight=4, checkpoint=None, on_progress=None):
+        """Archives any number of repositories concurrently, see :func:`bulk`.
+
+        :param names: Repository names, or full names (``owner/name``) overriding ``org_name``
+        """
+
+        return self.bulk('archive', self._repo_requests(names, org_name, 'PATCH', {'archived': True}),
+                         self._length(names), max_in_flight, checkpoint, on_progress)
+
+    def delete_repos(self, names, org_name=False, max_in_flight=4, checkpoint=None, on_progress=None):
+        """Deletes any number of repositories concurrently, see :func:`bulk` and :func:`archive_repos`."""
+
+        return self.bulk('delete', self._repo_requests(names, org_name, 'DELETE', None), self._length(names),
+                         max_in_flight, checkpoint, on_progress)
+
+    def _repo_requests(self, names, org_name, http_method, content):
+        default_owner = str(org_name) if org_name else self.auth_user
+        for full_name in names:
+            owner, _, name = full_name.rpartition('/')
+            owner = owner or default_owner
+            yield owner, name, http_method, self.endpoint('repos/{owner}/{name}', owner=owner, name=name), content
+
+    def _length(self, items):
+        try:
+            return len(items)
+        except TypeError:
+            return None
+
+    def bulk(self, action, requests, total=None, max_in_flight=4, checkpoint=None, on_progress=None):
+        """Runs one request per repository, ``max_in_flight`` at a time, yielding a :class:`RepoResult` for each
+        as it completes.
+
+        ``requests`` is consumed lazily, so it may be a generator of any length. Requests creating content are
+        spaced out by :attr:`content_creation_limits`; requests hitting a secondary rate limit hold back all
+        others and are tried again (up to :attr:`secondary_limit_retries` times).
+
+        :param string action: Name of the operation, used in results and checkpoints
+        :param requests: Iterable of ``(owner, name, http_method, method, content)`` tuples
+        :param int total: Number of requests, if known, for the progress reports
+        :param int max_in_flight: Maximum number of requests running at once
+        :param checkpoint: A :class:`Checkpoint` or the path of its file, to skip the repositories completed by
+            previous runs and record those completed by this one
+        :param on_progress: Called with the :class:`BulkProgress` after each repository
+        """
+
+        run = BulkRun(action, requests, total, checkpoint, on_progress)
+        try:
+            for index, res in run_many(self.send_bulk_request, run.calls(), max_in_flight, as_completed=True):
+                for result in run.collect(index, res):
+                    yield result
+            for result in run.flush():
+                yield result
+        finally:
+            run.close()
+
+    def send_bulk_request(self, method, content=None, http_method=None):
+        """Sends one request of :func:`bulk`, waiting out secondary rate limits.
+
+        :rtype: tuple ``(status, decoded response)``
+        """
+
+        http_method, url, headers, body, return_format = self.build_request(method, content, None, http_method)
+        limiter = self.get_content_limiter()
+
+        attempt = 0
+        while True:
+            if limiter is not None and not self.creates_content(http_method, url):
+                # Requests creating content wait for the limiter anyway
+                limiter.wait()
+
+            response = self.send_request(http_method, url, headers, body)
+            data = self.handle_response(response, return_format)
+            delay = self.secondary_limit_delay(response, data)
+            if delay is None or attempt >= self.secondary_limit_retries:
+                return response.status_code, data
+
+            if limiter is not None:
+                limiter.pause(delay)
+            else:
+                time.sleep(delay)
+            attempt += 1
+
+    def secondary_limit_delay(self, response, data):
+        """Returns the seconds to wait before retrying a request refused by a rate limit, None if the response is
+        not a rate limit error."""
+
+        if response.status_code not in (403, 429):
+            return None
+
+        retry_after = RetryPolicy.parse_retry_after(response.headers.get('Retry-After'))
+        if retry_after is not None:
+            return retry_after
+        if response.headers.get('X-RateLimit-Remaining') == '0':
+            # Primary rate limit, the rate limiter waits for the reset
+            return 0.0
+
+        message = data.get('message', '') if isinstance(data, dict) else ''
+        if 'secondary rate limit' in message.lower():
+            return self.secondary_limit_wait
+        return None
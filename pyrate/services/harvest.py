@@ -1,4 +1,6 @@
+from pyrate.auth import BasicAuth
 from pyrate.main import Pyrate
+from pyrate.pagination import PageNumberPaginator
 
 
 class HarvestPyrate(Pyrate):
@@ -12,6 +14,9 @@ class HarvestPyrate(Pyrate):
     default_body_content = {}
     auth_type = 'BASIC_AUTH'
     connection_check_method = ['GET', 'account/who_am_i', 'company', '']
+    service_name = 'harvest'
+    # Paginated listings (invoices, expenses, ...) return 50 records per page
+    paginator = PageNumberPaginator(page_size=50)
 
     def __init__(self, auth_user, auth_pass, organisation_name, default_http_method=None, default_return_format=None):
         super(HarvestPyrate, self).__init__()
@@ -19,12 +24,12 @@ class HarvestPyrate(Pyrate):
         self.auth_pass = auth_pass
         self.organisation_name = organisation_name
         self.base_url = 'https://' + self.organisation_name + '.harvestapp.com/'
-        self.default_header_content = {
-            'Authorization': self.create_basic_auth(self.auth_user, self.auth_pass)
-        }
 
         if default_http_method:
             self.default_http_method = default_http_method
 
         if default_return_format or default_return_format == '':
-            self.default_return_format = default_return_format
\ No newline at end of file
+            self.default_return_format = default_return_format
+
+    def create_auth(self):
+        return BasicAuth(self.auth_user, self.auth_pass)
@@ -1,10 +1,92 @@
-from pyrate.main import Pyrate
+from itertools import islice
+import re
+import threading
+import time
+
+from pyrate.auth import ApiKeyAuth
+from pyrate.main import CallError, Pyrate
+from pyrate.pagination import PageNumberPaginator
 
 
 class ListNotFoundError(Exception):
     pass
 
 
+class BatchResult(object):
+    """Aggregated outcome of :func:`MailchimpPyrate.batchSubscribe` and :func:`MailchimpPyrate.batchUnsubscribe`.
+
+    ``errors`` holds the per-row errors as returned by Mailchimp, unless an ``on_error`` callback consumed them.
+    Rows of a batch call that failed as a whole are reported with a ``code`` of None.
+    """
+
+    def __init__(self):
+        self.add_count = 0
+        self.update_count = 0
+        self.success_count = 0
+        self.error_count = 0
+        self.errors = []
+
+    def __repr__(self):
+        return '<BatchResult adds=%d updates=%d successes=%d errors=%d>' % (
+            self.add_count, self.update_count, self.success_count, self.error_count)
+
+
+def member_row(member):
+    # Accepts 'a@example.com', {'email': 'a@example.com', ...} and {'email': {'email': 'a@example.com'}, ...}
+    if not isinstance(member, dict):
+        return {'email': {'email': member}}
+    if not isinstance(member.get('email'), dict):
+        member = dict(member, email={'email': member['email']})
+    return member
+
+
+class Batch(object):
+    """Splits the rows of a batch call into chunks and aggregates the results of the chunk calls into a
+    :class:`BatchResult`, for the synchronous and the asyncio implementations."""
+
+    def __init__(self, method, fargs, rows, chunk_size, on_error=None):
+        self.method = method
+        # Unlike build_content, keep explicit False flags (double_optin defaults to true)
+        self.content = dict((key, value) for key, value in fargs.items() if value is not None)
+        self.rows = iter(rows)
+        self.chunk_size = chunk_size
+        self.on_error = on_error
+        self.in_flight = {}
+        self.result = BatchResult()
+
+    def calls(self):
+        while True:
+            chunk = list(islice(self.rows, self.chunk_size))
+            if not chunk:
+                return
+            self.in_flight[len(self.in_flight)] = chunk
+            yield self.method, dict(self.content, batch=chunk), 'POST'
+
+    def report(self, error):
+        self.result.error_count += 1
+        if self.on_error is None:
+            self.result.errors.append(error)
+        else:
+            self.on_error(error)
+
+    def collect(self, index, res):
+        chunk, self.in_flight[index] = self.in_flight[index], None
+
+        if isinstance(res, CallError) or not isinstance(res, dict) or 'error' in res:
+            # The whole chunk failed, report each of its rows
+            reason = res.exception if isinstance(res, CallError) else res
+            for row in chunk:
+                email = row['email'] if isinstance(row.get('email'), dict) else row
+                self.report({'email': email, 'code': None, 'error': reason})
+            return
+
+        self.result.add_count += res.get('add_count', 0)
+        self.result.update_count += res.get('update_count', 0)
+        self.result.success_count += res.get('success_count', 0)
+        for error in res.get('errors', []):
+            self.report(error)
+
+
 class MailchimpPyrate(Pyrate):
     # This variable must be set on instantiation
     api_key = ''
@@ -15,15 +97,32 @@ class MailchimpPyrate(Pyrate):
     default_header_content = {}
     auth_type = 'API_KEY'
     connection_check_method = ['POST', 'helper/ping', 'msg', "Everything's Chimpy!"]
+    service_name = 'mailchimp'
     send_json = True
+    stream_path = ('data',)
+    # lists/list and friends take start (a page number) and limit as top-level parameters
+    paginator = PageNumberPaginator(page_param='start', first_page=0, limit_param='limit', page_size=100,
+                                    total_key='total', items_key='data')
+    # lists/members takes them in opts
+    members_paginator = PageNumberPaginator(page_param='start', first_page=0, limit_param='limit', page_size=100,
+                                            total_key='total', items_key='data', options_key='opts')
+
+    # List ids look like '8a4d2d7a2b' (but so may list names), see getListId
+    list_id_pattern = re.compile(r'^[0-9a-f]{10}$')
+    # Seconds the name -> id index of the lists is used before being reloaded
+    list_index_ttl = 300
+    # Minimum seconds between reloads of the index caused by unknown list names
+    list_index_min_refresh = 5
+    # Rows per batch call, Mailchimp advises against more than 5k-10k
+    batch_chunk_size = 5000
 
     def __init__(self, apikey, default_http_method=None, default_return_format=None):
         super(MailchimpPyrate, self).__init__()
+        self._lists_by_name = {}
+        self._list_index_loaded_at = None
+        self._list_index_lock = threading.Lock()
         self.api_key = apikey
         self.base_url = 'https://' + self.api_key[-3:] + '.api.mailchimp.com/2.0/'
-        self.default_body_content = {
-            'apikey': self.api_key
-        }
 
         if default_http_method:
             self.default_http_method = default_http_method
@@ -31,6 +130,10 @@ class MailchimpPyrate(Pyrate):
         if default_return_format or default_return_format == '':
             self.default_return_format = default_return_format
 
+    def create_auth(self):
+        # The key goes into the body of every call
+        return ApiKeyAuth(self.api_key, 'apikey')
+
     def check_response_success(self, response):
         if 'error' not in response:
             if 'errors' in response:
@@ -62,20 +165,81 @@ class MailchimpPyrate(Pyrate):
         else:
             return res
 
-    def getListByName(self, list_name):
-        lists = self.getLists()
-        for l in lists:
-            if l['name'] == list_name:
-                return l
+    def getListByName(self, list_name, refresh_missing=True):
+        """Returns the list called ``list_name`` from the index of the lists.
+
+        :param bool refresh_missing: Whether to reload the index (at most every ``list_index_min_refresh``
+            seconds) for a name it does not have
+        :raises ListNotFoundError: if there is no such list
+        """
+
+        loaded_at = self._list_index_loaded_at
+        if self.listIndexExpired(loaded_at):
+            self.refreshListIndex(loaded_at)
 
-        # else
-        raise ListNotFoundError()
+        l = self._lists_by_name.get(list_name)
+        if l is None and refresh_missing and self.listIndexExpired(self._list_index_loaded_at,
+                                                                   self.list_index_min_refresh):
+            # The list may have been created since the index was loaded
+            self.refreshListIndex(self._list_index_loaded_at)
+            l = self._lists_by_name.get(list_name)
+
+        if l is None:
+            raise ListNotFoundError(list_name)
+        return l
+
+    def getListId(self, list_name):
+        """Returns the id of a list given its name or id.
+
+        Names are looked up first, so a list named like an id is found by its name. Strings looking like an id
+        that no list is named are returned as-is, without reloading the index for them.
+        """
+
+        looks_like_id = bool(self.list_id_pattern.match(list_name))
+        try:
+            return self.getListByName(list_name, refresh_missing=not looks_like_id)['id']
+        except ListNotFoundError:
+            if looks_like_id:
+                return list_name
+            raise
+
+    def listIndexExpired(self, loaded_at, ttl=None):
+        return loaded_at is None or time.time() - loaded_at >= (self.list_index_ttl if ttl is None else ttl)
+
+    def refreshListIndex(self, loaded_at=None):
+        """Reloads the name -> list index, unless it has been reloaded since ``loaded_at``.
+
+        Threads missing the index at the same time pass the same ``loaded_at``, so only the first reloads it
+        while the others wait for the result.
+        """
+
+        with self._list_index_lock:
+            if self._list_index_loaded_at != loaded_at:
+                return
+
+            lists = self.iter_items('lists/list', http_method='POST')
+            self.storeListIndex(lists)
+
+    def storeListIndex(self, lists):
+        self._lists_by_name = dict((l['name'], l) for l in lists)
+        self._list_index_loaded_at = time.time()
+
+    def invalidateListIndex(self):
+        with self._list_index_lock:
+            self._list_index_loaded_at = None
+
+    # http://apidocs.mailchimp.com/api/2.0/lists/members.php
+    def iterListMembers(self, list_name, status=None, prefetch=False):
+        list_id = self.getListId(list_name)
+        fargs = {'id': list_id, 'status': status}
+        return self.iter_items('lists/members', http_method='POST', content=self.build_content(fargs),
+                               prefetch=prefetch, paginator=self.members_paginator)
 
     # http://apidocs.mailchimp.com/api/2.0/lists/subscribe.php
     def subscribeToList(self, list_name, user_email, merge_vars=None, email_type=None, double_optin=None, update_existing=None,
                         replace_interests=None, send_welcome=None):
 
-        list_id = self.getListByName(list_name)['id']
+        list_id = self.getListId(list_name)
         fargs = {'id': list_id, 'email': {'email': user_email}, 'merge_vars': merge_vars, 'email_type': email_type,
                  'double_optin': double_optin, 'update_existing': update_existing,
                  'replace_interests': replace_interests, 'send_welcome': send_welcome}
@@ -85,9 +249,46 @@ class MailchimpPyrate(Pyrate):
 
     # http://apidocs.mailchimp.com/api/2.0/lists/unsubscribe.php
     def unsubscribeFromList(self, list_name, user_email, delete_member=None, send_goodbye=None, send_notify=None):
-        list_id = self.getListByName(list_name)['id']
+        list_id = self.getListId(list_name)
         fargs = {'id': list_id, 'email': {'email': user_email}, 'delete_member': delete_member, 'send_goodbye': send_goodbye,
                  'send_notify': send_notify}
 
         return self.do('lists/unsubscribe', http_method='POST', content=self.build_content(fargs))
         # return self.check_response_success(res)
+
+    # http://apidocs.mailchimp.com/api/2.0/lists/batch-subscribe.php
+    def batchSubscribe(self, list_name, members, double_optin=None, update_existing=None, replace_interests=None,
+                       max_in_flight=4, on_error=None):
+        """Subscribes any number of members, sending chunks of ``batch_chunk_size`` rows concurrently.
+
+        ``members`` may be a generator, it is consumed as chunks are sent. Members are email addresses or dicts
+        with an ``email`` and optionally ``email_type`` and ``merge_vars``.
+
+        :param int max_in_flight: Maximum number of batch calls running at once
+        :param on_error: Called with each per-row error as it comes in, instead of collecting them in the result
+        :rtype: :class:`BatchResult`
+        """
+
+        fargs = {'id': self.getListId(list_name), 'double_optin': double_optin, 'update_existing': update_existing,
+                 'replace_interests': replace_interests}
+        return self._batch('lists/batch-subscribe', fargs, (member_row(m) for m in members), max_in_flight,
+                           on_error)
+
+    # http://apidocs.mailchimp.com/api/2.0/lists/batch-unsubscribe.php
+    def batchUnsubscribe(self, list_name, emails, delete_member=None, send_goodbye=None, send_notify=None,
+                         max_in_flight=4, on_error=None):
+        """Unsubscribes any number of email addresses, see :func:`batchSubscribe`.
+
+        :rtype: :class:`BatchResult`
+        """
+
+        fargs = {'id': self.getListId(list_name), 'delete_member': delete_member, 'send_goodbye': send_goodbye,
+                 'send_notify': send_notify}
+        return self._batch('lists/batch-unsubscribe', fargs, (member_row(e)['email'] for e in emails),
+                           max_in_flight, on_error)
+
+    def _batch(self, method, fargs, rows, max_in_flight, on_error):
+        batch = Batch(method, fargs, rows, self.batch_chunk_size, on_error)
+        for index, res in self.do_many(batch.calls(), max_workers=max_in_flight, as_completed=True):
+            batch.collect(index, res)
+        return batch.result
@@ -1,10 +1,13 @@
-from requests_oauthlib import OAuth1
+from pyrate.auth import OAuth1Auth
 from pyrate.main import Pyrate
+from pyrate.pagination import TwitterPaginator
+from pyrate.streaming import Stream
 
 
 class TwitterPyrate(Pyrate):
 
     base_url = 'https://api.twitter.com/1.1/'
+    stream_url = 'https://stream.twitter.com/1.1/'
     http_methods = ['GET', 'POST']
     default_http_method = http_methods[0]
     return_formats = ['json']
@@ -13,6 +16,14 @@ class TwitterPyrate(Pyrate):
     default_header_content = {}
     auth_type = 'OAUTH1'
     connection_check_method = ['GET', 'account/verify_credentials']
+    service_name = 'twitter'
+    paginator = TwitterPaginator()
+    rate_limit = True
+    # Timelines of the authenticating user and everything acting on its behalf
+    user_scoped_endpoints = [r'account/', r'direct_messages', r'(blocks|mutes|saved_searches)/',
+                             r'statuses/(home_timeline|mentions_timeline|retweets_of_me|update|destroy|retweet)',
+                             r'friendships/(create|destroy|update|incoming|outgoing|no_retweets)',
+                             r'favorites/(create|destroy)']
 
     # These variables must be set on instantiation
     oauth_consumer_key = ''
@@ -36,6 +47,9 @@ class TwitterPyrate(Pyrate):
 
     # Essential Stuff
     def get_oauth(self):
+        # requests_oauthlib is only needed here, requests are signed by OAuth1Auth
+        from requests_oauthlib import OAuth1
+
         if self.oauth_token != "" and self.oauth_token_secret != "":
             return OAuth1(self.oauth_consumer_key,
                           client_secret=self.oauth_consumer_secret,
@@ -45,6 +59,18 @@ class TwitterPyrate(Pyrate):
             raise Exception("Please set your oauth_token and oauth_token_secret first! (Use 'pyratetools'"
                             "from command line)")
 
+    def create_auth(self):
+        if self.oauth_token != "" and self.oauth_token_secret != "":
+            return OAuth1Auth(self.oauth_consumer_key, self.oauth_consumer_secret, self.oauth_token,
+                              self.oauth_token_secret)
+        else:
+            raise Exception("Please set your oauth_token and oauth_token_secret first! (Use 'pyratetools'"
+                            "from command line)")
+
+    def rate_limit_family(self, url):
+        # Limits are per resource, e.g. statuses/show/:id
+        return self.endpoint_label(url)
+
     def check_response_success(self, response):
         if not 'error' in response and not 'errors' in response:
             return True
@@ -71,3 +97,24 @@ class TwitterPyrate(Pyrate):
                  'include_entities': include_entities}
         res = self.do('statuses/update', http_method='POST', content=self.build_content(fargs))
         return self.check_response_success(res)
+
+    # Streaming
+    def stream(self, method, content=None, http_method='GET', **options):
+        """Opens a streaming endpoint like ``statuses/filter``, see :class:`pyrate.streaming.Stream` for the options.
+
+        >>> with h.stream('statuses/filter', {'track': 'python'}, http_method='POST') as stream:
+        ...     for message in stream:
+        ...         print(message.get('text'))
+
+        :rtype: :class:`pyrate.streaming.Stream`
+        """
+
+        url, content, headers = self.build_stream_request(method, content, options.get('delimited'))
+        return Stream(self, url, content, headers, http_method, **options)
+
+    def build_stream_request(self, method, content=None, delimited=False):
+        template = self.get_template()
+        content = template.body(content)
+        if delimited:
+            content = dict(content or {}, delimited='length')
+        return self.stream_url + method + '.json', content, template.headers()
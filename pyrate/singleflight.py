@@ -0,0 +1,62 @@
+"""Coalescing of identical requests in flight, see :attr:`pyrate.main.Pyrate.single_flight`.
+
+When several threads make the same idempotent request at once (typically right after a cache entry expired), only
+the first one goes to the network; the others wait for it and receive the same response.
+"""
+import threading
+
+__docformat__ = 'sphinx en'
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exception = None
+
+
+class SingleFlight(object):
+    """Runs one call per key at a time, sharing its outcome with the callers arriving while it runs.
+
+    :attr:`shared` counts the calls answered by another caller's call.
+    """
+
+    def __init__(self):
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._calls)
+
+    def do(self, key, function, *args):
+        """Returns ``function(*args)``, or the result of the call already running for ``key``.
+
+        Exceptions are shared as well: every caller waiting on a failed call gets the exception.
+        """
+
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.exception is not None:
+                raise call.exception
+            return call.result
+
+        try:
+            call.result = function(*args)
+        except BaseException as e:
+            call.exception = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+        return call.result
@@ -0,0 +1,368 @@
+"""Consumers for long-lived streaming connections, like Twitter's streaming API.
+
+The connection is read by a background thread that splits the body into messages, decodes them and hands them to
+the consumer through a bounded queue. When the consumer falls behind, the ``overflow`` policy decides what happens:
+
+- ``'block'``: stop reading until there is room, letting TCP push back on the server
+- ``'drop_oldest'``: discard the oldest queued message
+- ``'drop_newest'``: discard the incoming message
+- ``'error'``: end the stream with :class:`StreamOverflowError`
+
+Connections that stay silent longer than ``stall_timeout`` (the server sends keep-alive newlines) are considered
+stalled. Dropped and stalled connections are reopened after the delays of :class:`StreamBackoff`.
+"""
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import requests
+from urllib3.exceptions import HTTPError as TransportError
+
+from pyrate.main import add_query_params
+
+__docformat__ = 'sphinx en'
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest', 'error')
+CHUNK_SIZE = 64 * 1024
+
+
+def iter_chunks(response, chunk_size=CHUNK_SIZE):
+    """Yields the body of a streamed :class:`requests.Response` as soon as data arrives, whatever the transfer
+    encoding."""
+
+    raw = response.raw
+    if not hasattr(raw, 'read1'):
+        # urllib3 < 2 only yields early for chunked transfer encoding
+        for chunk in response.iter_content(chunk_size=None):
+            yield chunk
+        return
+
+    raw.decode_content = True
+    while True:
+        data = raw.read1(chunk_size)
+        if not data:
+            return
+        yield data
+
+
+class StreamError(Exception):
+    """The server refused the stream with a status that reconnecting will not fix."""
+
+    def __init__(self, status_code, content=None):
+        super(StreamError, self).__init__("Stream refused with status %s: %r" % (status_code, content))
+        self.status_code = status_code
+        self.content = content
+
+
+class StreamOverflowError(Exception):
+    pass
+
+
+class MessageParser(object):
+    """Splits the body of a streaming connection into messages, fed chunk by chunk.
+
+    Messages are separated by newlines; blank lines are keep-alives. With length delimiting (Twitter's
+    ``delimited=length``) each message is preceded by a line holding its size in bytes.
+
+    :param bool delimited: Whether messages are length delimited
+    """
+
+    def __init__(self, delimited=False):
+        self.delimited = delimited
+        self.buffer = b''
+        self.expected = None
+
+    def feed(self, data):
+        """Returns the complete messages (as bytes) made available by ``data``."""
+
+        buffer = self.buffer + data
+        messages = []
+        pos = 0
+
+        while True:
+            if self.expected is not None:
+                if len(buffer) - pos < self.expected:
+                    break
+                message = buffer[pos:pos + self.expected].strip()
+                pos += self.expected
+                self.expected = None
+                if message:
+                    messages.append(message)
+                continue
+
+            end = buffer.find(b'\n', pos)
+            if end == -1:
+                break
+            line = buffer[pos:end].strip()
+            pos = end + 1
+
+            if not line:
+                continue
+            if self.delimited and line.isdigit():
+                self.expected = int(line)
+            else:
+                messages.append(line)
+
+        self.buffer = buffer[pos:]
+        return messages
+
+
+class StreamBackoff(object):
+    """Reconnection delays as prescribed by Twitter: linear for network errors, exponential for HTTP errors and
+    slower again when rate limited (420/429). The delays start over once a connection succeeds.
+    """
+
+    network_step = .25
+    network_max = 16
+    http_start = 5
+    http_max = 320
+    rate_limit_start = 60
+    rate_limit_max = 960
+    rate_limit_statuses = (420, 429)
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.network_errors = 0
+        self.http_errors = 0
+        self.rate_limit_errors = 0
+
+    def network_error(self):
+        self.network_errors += 1
+        return min(self.network_step * self.network_errors, self.network_max)
+
+    def http_error(self, status_code):
+        if status_code in self.rate_limit_statuses:
+            self.rate_limit_errors += 1
+            return min(self.rate_limit_start * 2 ** (self.rate_limit_errors - 1), self.rate_limit_max)
+
+        self.http_errors += 1
+        return min(self.http_start * 2 ** (self.http_errors - 1), self.http_max)
+
+
+class _Failure(object):
+    def __init__(self, exception):
+        self.exception = exception
+
+
+_CLOSED = object()
+
+
+class StreamConsumer(object):
+    """Settings and message handling shared by :class:`Stream` and :class:`pyrate.aio.AsyncStream`.
+
+    :param pyrate: The :class:`pyrate.main.Pyrate` sending the request
+    :param string url: Url of the streaming endpoint
+    :param dict content: Parameters of the stream, sent as query string for GET and as body otherwise
+    :param int queue_size: Maximum number of decoded messages waiting for the consumer
+    :param string overflow: What to do when the queue is full, see :data:`OVERFLOW_POLICIES`
+    :param int stall_timeout: Seconds without data (or keep-alives) after which the connection is reopened
+    :param int connect_timeout: Seconds to wait for the connection
+    :param bool delimited: Whether messages are length delimited, see :class:`MessageParser`
+    :param tuple fatal_statuses: Statuses ending the stream with :class:`StreamError` instead of reconnecting
+    :param int max_reconnects: Number of reconnections after which the stream gives up, None to never give up
+    """
+
+    fatal_statuses = (400, 401, 403, 404, 406, 413, 416)
+
+    def __init__(self, pyrate, url, content=None, headers=None, http_method='GET', queue_size=1000, overflow='block',
+                 stall_timeout=90, connect_timeout=10, delimited=False, backoff=None, fatal_statuses=None,
+                 max_reconnects=None):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("Invalid overflow policy: %r" % (overflow,))
+
+        self.pyrate = pyrate
+        self.url = url
+        self.content = content
+        self.headers = headers
+        self.http_method = http_method.upper()
+        self.queue_size = queue_size
+        self.overflow = overflow
+        self.stall_timeout = stall_timeout
+        self.connect_timeout = connect_timeout
+        self.delimited = delimited
+        self.backoff = backoff or StreamBackoff()
+        if fatal_statuses is not None:
+            self.fatal_statuses = fatal_statuses
+        self.max_reconnects = max_reconnects
+
+        self.closed = False
+        self.connections = 0
+        self.received = 0
+        self.dropped = 0
+        self.decode_errors = 0
+
+    def __repr__(self):
+        return '<%s %s connections=%d received=%d dropped=%d>' % (
+            type(self).__name__, self.url, self.connections, self.received, self.dropped)
+
+    def decode(self, raw):
+        """Returns the decoded message, None if it could not be decoded."""
+
+        try:
+            return self.pyrate.get_json_codec().loads(raw)
+        except ValueError:
+            self.decode_errors += 1
+            return None
+
+    def check_status(self, status_code, content=None):
+        """Returns the delay before reconnecting after an error status, raises :class:`StreamError` if the stream
+        cannot recover."""
+
+        if status_code in self.fatal_statuses:
+            raise StreamError(status_code, content)
+        return self.backoff.http_error(status_code)
+
+    def check_reconnect(self):
+        if self.max_reconnects is not None and self.connections > self.max_reconnects:
+            raise StreamError(None, "Gave up after %d connections" % self.connections)
+
+    def offer(self, q, message, full_error):
+        """Queues a message without waiting, applying the overflow policy. Returns False if the queue is full
+        under the ``'block'`` policy."""
+
+        try:
+            q.put_nowait(message)
+            return True
+        except full_error:
+            pass
+
+        if self.overflow == 'block':
+            return False
+        if self.overflow == 'error':
+            raise StreamOverflowError("More than %d messages waiting for the consumer" % self.queue_size)
+
+        self.dropped += 1
+        if self.overflow == 'drop_oldest':
+            try:
+                q.get_nowait()
+            except Exception:
+                pass
+            q.put_nowait(message)
+        return True
+
+
+class Stream(StreamConsumer):
+    """Iterator over the decoded messages of a streaming endpoint, read by a background thread.
+
+    The connection is opened when iteration starts and closed by :func:`close` (or leaving the ``with`` block).
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(Stream, self).__init__(*args, **kwargs)
+        self.queue = queue.Queue(self.queue_size)
+        self.thread = None
+        self.response = None
+        self._closed_event = threading.Event()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __iter__(self):
+        self.start()
+        while True:
+            item = self.queue.get()
+            if item is _CLOSED:
+                return
+            if isinstance(item, _Failure):
+                raise item.exception
+            yield item
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='pyrate-stream')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def close(self):
+        self.closed = True
+        self._closed_event.set()
+
+        response = self.response
+        if response is not None:
+            response.close()
+
+        # Wake up the consumer
+        self.put(_CLOSED, force=True)
+
+    def wait(self, delay):
+        self._closed_event.wait(delay)
+
+    def run(self):
+        try:
+            self.consume()
+        except Exception as e:
+            if not self.closed:
+                self.put(_Failure(e), force=True)
+        else:
+            self.put(_CLOSED, force=True)
+
+    def connect(self):
+        url, body = self.url, self.content
+        if self.http_method == 'GET':
+            url, body = add_query_params(url, body), None
+
+        pyrate = self.pyrate
+        return pyrate.send_once(self.http_method, url, self.headers, pyrate.encode_body(body), pyrate.get_auth(),
+                                stream=True, timeout=(self.connect_timeout, self.stall_timeout))
+
+    def consume(self):
+        while not self.closed:
+            self.check_reconnect()
+            self.connections += 1
+
+            try:
+                response = self.connect()
+            except requests.exceptions.RequestException:
+                self.wait(self.backoff.network_error())
+                continue
+
+            self.response = response
+            try:
+                if response.status_code != 200:
+                    self.wait(self.check_status(response.status_code, response.content))
+                    continue
+
+                self.backoff.reset()
+                parser = MessageParser(self.delimited)
+                for chunk in iter_chunks(response):
+                    for raw in parser.feed(chunk):
+                        message = self.decode(raw)
+                        if message is not None:
+                            self.received += 1
+                            self.put(message)
+                    if self.closed:
+                        return
+            except (requests.exceptions.RequestException, TransportError, IOError):
+                # Stalled or dropped. close() may also end up here by closing the response under the reader
+                if self.closed:
+                    return
+            finally:
+                self.response = None
+                response.close()
+
+            self.wait(self.backoff.network_error())
+
+    def put(self, item, force=False):
+        if not force and self.offer(self.queue, item, queue.Full):
+            return
+
+        # Blocking, but give up once the stream is closed (unless the item has to get through)
+        while force or not self.closed:
+            try:
+                self.queue.put(item, timeout=.1)
+                return
+            except queue.Full:
+                if force and self.closed:
+                    # Nobody reads anymore, make room
+                    try:
+                        self.queue.get_nowait()
+                    except queue.Empty:
+                        pass
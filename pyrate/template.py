@@ -0,0 +1,133 @@
+"""Request templates used by :func:`pyrate.main.Pyrate.build_request`.
+
+A template holds the defaults of a pyrate (url prefix, format suffix, headers and body) prepared once, so that each
+call only pays for what it adds: the merged dicts are copied only when the call has content or headers of its own.
+Templates never change once compiled and can be shared by any number of threads.
+"""
+from string import Formatter
+import threading
+
+try:
+    from urllib.parse import quote
+except ImportError:
+    from urllib import quote
+
+__docformat__ = 'sphinx en'
+
+_endpoints = {}
+_endpoints_lock = threading.Lock()
+
+
+def compile_endpoint(endpoint):
+    """Returns the parsed form of an endpoint template like ``repos/{owner}/{name}``, cached for later calls.
+
+    :rtype: tuple of ``(literal, field)`` pairs, ``field`` is None for the trailing literal
+    """
+
+    parts = _endpoints.get(endpoint)
+    if parts is None:
+        parts = tuple((literal, field) for literal, field, _, _ in Formatter().parse(endpoint))
+        with _endpoints_lock:
+            _endpoints[endpoint] = parts
+    return parts
+
+
+def expand_endpoint(endpoint, params):
+    """Fills in the fields of an endpoint template, url-quoting the values.
+
+    >>> expand_endpoint('repos/{owner}/{name}', {'owner': 'me', 'name': 'my repo'})
+    'repos/me/my%20repo'
+    """
+
+    pieces = []
+    for literal, field in compile_endpoint(endpoint):
+        pieces.append(literal)
+        if field is not None:
+            try:
+                value = params[field]
+            except KeyError:
+                raise KeyError("Missing parameter %r for endpoint %r" % (field, endpoint))
+            pieces.append(quote(str(value), safe=''))
+    return ''.join(pieces)
+
+
+class RequestTemplate(object):
+    """The defaults of a pyrate, compiled once.
+
+    The dicts passed in are copied, later changes to them do not affect the template.
+
+    :param string base_url: Prefix of all request urls
+    :param dict headers: Default request headers
+    :param dict body: Default request content
+    :param string http_method: Default HTTP method
+    :param string return_format: Default return format, appended to urls as extension
+    """
+
+    __slots__ = ('base_url', 'http_method', 'suffix', '_headers', '_body', '_source')
+
+    def __init__(self, base_url, headers=None, body=None, http_method=None, return_format=None, source=None):
+        set_ = super(RequestTemplate, self).__setattr__
+        set_('base_url', base_url or '')
+        set_('http_method', http_method)
+        set_('suffix', '.' + return_format if return_format else '')
+        set_('_headers', dict(headers) if headers is not None else None)
+        set_('_body', dict(body) if body is not None else None)
+        set_('_source', source)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("RequestTemplate is immutable")
+
+    @classmethod
+    def for_pyrate(cls, pyrate):
+        """Compiles the template of a pyrate from its current defaults and the static credentials of its auth
+        provider.
+
+        :rtype: :class:`RequestTemplate`
+        """
+
+        headers, body, auth = pyrate.default_header_content, pyrate.default_body_content, pyrate.auth
+        if auth is not None and auth.headers:
+            headers = dict(headers or {})
+            headers.update(auth.headers)
+        if auth is not None and auth.content:
+            body = dict(body or {})
+            body.update(auth.content)
+
+        return cls(pyrate.base_url, headers, body, pyrate.default_http_method, pyrate.default_return_format,
+                   source=(pyrate.base_url, pyrate.default_header_content, pyrate.default_body_content,
+                           pyrate.default_http_method, pyrate.default_return_format, auth))
+
+    def compiled_from(self, pyrate):
+        """Returns whether the defaults of ``pyrate`` are still the objects this template was compiled from."""
+
+        source = self._source
+        return (source is not None and pyrate.default_header_content is source[1]
+                and pyrate.default_body_content is source[2] and pyrate.auth is source[5]
+                and pyrate.base_url == source[0]
+                and pyrate.default_http_method == source[3] and pyrate.default_return_format == source[4])
+
+    def url(self, method, return_format=None):
+        if return_format is None:
+            return self.base_url + method + self.suffix
+        return self.base_url + method + return_format
+
+    def headers(self, headers=None):
+        """Returns the default headers merged with ``headers``.
+
+        Without headers of the call, this is the template's own dict, which must not be modified.
+        """
+
+        if headers is None:
+            return self._headers
+        merged = dict(self._headers or {})
+        merged.update(headers)
+        return merged
+
+    def body(self, content=None):
+        """Returns the default content merged with ``content``, see :func:`headers`."""
+
+        if content is None:
+            return self._body
+        merged = dict(self._body or {})
+        merged.update(content)
+        return merged
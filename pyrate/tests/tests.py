@@ -1,10 +1,55 @@
+from email.utils import formatdate
+import json
+import multiprocessing
+import os
+import subprocess
+import tempfile
+import threading
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+import time
 import unittest
 import sys
+import zlib
+import requests
 from httmock import urlmatch, HTTMock, response
 
+try:
+    import h2
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import asyncio
+    from aiohttp import web
+    from aiohttp.test_utils import TestServer
+except ImportError:
+    web = None
+
 sys.path.append('../pyrate')  # we want the local version and not the installed one
+import pyrate
+from pyrate import auth, cache, cassette, compression, graphql, jsoncodec, jsonstream, main, pagination, pool, ratelimit, registry, retry, singleflight, streaming, template, transport
 from pyrate.services import basecamp, github, harvest, mailchimp, twitter
 
+if web is not None:
+    from pyrate.services import aio
+
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Optional or heavy dependencies only imported when used
+DEFERRED_MODULES = ('requests_oauthlib', 'oauthlib', 'ijson', 'sqlite3', 'aiohttp', 'concurrent.futures')
+
+
+def fill_sqlite_cache(c, worker):
+    for i in range(10):
+        key = '%d-%d' % (worker, i)
+        c.set(key, cache.CacheEntry(200, {}, key.encode('ascii'), key, None, 0))
+    assert c.get('parent').content == b'parent'
+
 
 # In order to use these tests you need to:
 # - copy credentials.py.template -> credentials.py and fill in your credentials
@@ -75,6 +120,107 @@ class TestSequenceFunctions(unittest.TestCase):
         with HTTMock(self.mock_mailchimp):
             self.assertTrue(h.check_connection())
 
+    def mock_mailchimp_lists(self, calls):
+        @urlmatch(netloc=r'.*\.api\.mailchimp\.com')
+        def handler(url, request):
+            calls.append(url.path)
+            if url.path.endswith('lists/list.JSON'):
+                time.sleep(0.05)
+                return response(200, {'total': 1, 'data': [{'id': '8a4d2d7a2b', 'name': 'ListName'}]}, {})
+            return response(200, {'id': json.loads(request.body)['id']}, {})
+        return handler
+
+    def test_mailchimp_list_index_cached(self):
+        calls = []
+        h = self.getHandler('mailchimp')
+        with HTTMock(self.mock_mailchimp_lists(calls)):
+            self.assertEqual(h.subscribeToList('ListName', 'a@example.com'), {'id': '8a4d2d7a2b'})
+            h.unsubscribeFromList('ListName', 'a@example.com')
+            h.invalidateListIndex()
+            h.subscribeToList('ListName', 'a@example.com')
+        self.assertEqual(calls, ['/2.0/lists/list.JSON', '/2.0/lists/subscribe.JSON', '/2.0/lists/unsubscribe.JSON',
+                                 '/2.0/lists/list.JSON', '/2.0/lists/subscribe.JSON'])
+
+    def test_mailchimp_list_id_accepted(self):
+        calls = []
+        h = self.getHandler('mailchimp')
+        h.list_index_min_refresh = 0
+        with HTTMock(self.mock_mailchimp_lists(calls)):
+            self.assertEqual(h.subscribeToList('0123456789', 'a@example.com'), {'id': '0123456789'})
+            self.assertEqual(h.subscribeToList('8a4d2d7a2b', 'a@example.com'), {'id': '8a4d2d7a2b'})
+        # Ids do not reload the index
+        self.assertEqual(calls, ['/2.0/lists/list.JSON', '/2.0/lists/subscribe.JSON', '/2.0/lists/subscribe.JSON'])
+
+    def test_mailchimp_list_named_like_an_id(self):
+        @urlmatch(netloc=r'.*\.api\.mailchimp\.com')
+        def handler(url, request):
+            if url.path.endswith('lists/list.JSON'):
+                return response(200, {'total': 1, 'data': [{'id': '8a4d2d7a2b', 'name': 'deadbeef00'}]}, {})
+            return response(200, {'id': json.loads(request.body)['id']}, {})
+
+        h = self.getHandler('mailchimp')
+        with HTTMock(handler):
+            self.assertEqual(h.subscribeToList('deadbeef00', 'a@example.com'), {'id': '8a4d2d7a2b'})
+
+    def test_mailchimp_list_index_single_refresh(self):
+        calls = []
+        h = self.getHandler('mailchimp')
+        with HTTMock(self.mock_mailchimp_lists(calls)):
+            threads = [threading.Thread(target=h.getListId, args=('ListName',)) for _ in range(10)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertRaises(mailchimp.ListNotFoundError, h.getListByName, 'Unknown')
+        self.assertEqual(calls, ['/2.0/lists/list.JSON'])
+
+    def test_mailchimp_batch_subscribe(self):
+        batches = []
+
+        @urlmatch(netloc=r'.*\.api\.mailchimp\.com', path=r'.*/lists/batch-subscribe\.JSON')
+        def handler(url, request):
+            body = json.loads(request.body)
+            batches.append(body)
+            if body['batch'][0]['email']['email'] == 'fail@example.com':
+                return response(200, {'status': 'error', 'code': 200, 'error': 'Invalid list'}, {})
+            errors = [{'email': row['email'], 'code': 502, 'error': 'Invalid email'}
+                      for row in body['batch'] if 'invalid' in row['email']['email']]
+            return response(200, {'add_count': len(body['batch']) - len(errors), 'update_count': 0,
+                                  'error_count': len(errors), 'errors': errors}, {})
+
+        def members():
+            for i in range(7):
+                yield 'member%d@example.com' % i
+            yield {'email': 'invalid@example.com', 'merge_vars': {'FNAME': 'X'}}
+            yield 'fail@example.com'
+
+        h = self.getHandler('mailchimp')
+        h.storeListIndex([{'id': '8a4d2d7a2b', 'name': 'ListName'}])
+        h.batch_chunk_size = 4
+        streamed = []
+        with HTTMock(handler):
+            res = h.batchSubscribe('8a4d2d7a2b', members(), double_optin=False, max_in_flight=2,
+                                   on_error=streamed.append)
+        self.assertEqual(sorted(len(b['batch']) for b in batches), [1, 4, 4])
+        self.assertEqual(batches[0]['id'], '8a4d2d7a2b')
+        self.assertTrue(batches[0]['double_optin'] is False)
+        self.assertEqual((res.add_count, res.update_count, res.error_count), (7, 0, 2))
+        self.assertEqual(res.errors, [])
+        self.assertEqual(sorted(e['email']['email'] for e in streamed), ['fail@example.com', 'invalid@example.com'])
+
+    def test_mailchimp_batch_unsubscribe(self):
+        @urlmatch(netloc=r'.*\.api\.mailchimp\.com', path=r'.*/lists/batch-unsubscribe\.JSON')
+        def handler(url, request):
+            body = json.loads(request.body)
+            self.assertEqual(body['batch'], [{'email': 'a@example.com'}, {'email': 'b@example.com'}])
+            return response(200, {'success_count': 2, 'error_count': 0, 'errors': []}, {})
+
+        h = self.getHandler('mailchimp')
+        h.storeListIndex([{'id': '8a4d2d7a2b', 'name': 'ListName'}])
+        with HTTMock(handler):
+            res = h.batchUnsubscribe('8a4d2d7a2b', ['a@example.com', 'b@example.com'], delete_member=True)
+        self.assertEqual((res.success_count, res.error_count), (2, 0))
+
     ##############################################
     ## HARVEST
     ##############################################
@@ -122,6 +268,158 @@ class TestSequenceFunctions(unittest.TestCase):
         with HTTMock(self.mock_github):
             self.assertTrue(h.check_connection())
 
+    def mock_github_bulk(self, seen, failures):
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            body = json.loads(request.body) if request.body else None
+            seen.append((request.method, url.path, body))
+            name = body['name'] if request.method == 'POST' else url.path.rsplit('/', 1)[1]
+            if failures.get(name):
+                failures[name] -= 1
+                return response(403, {'message': 'You have exceeded a secondary rate limit.'},
+                                {'content-type': 'application/json'})
+            if name == 'taken':
+                return response(422, {'message': 'Repository creation failed.'}, {'content-type': 'application/json'})
+            if request.method == 'DELETE':
+                return response(204, None, {})
+            return response(201 if request.method == 'POST' else 200, {'name': name},
+                            {'content-type': 'application/json'})
+        return handler
+
+    def make_content_limiter(self, limits):
+        clock = {'now': 1000.0, 'slept': []}
+        limiter = ratelimit.WindowLimiter(limits, clock=lambda: clock['now'], sleep=clock['slept'].append)
+        return limiter, clock
+
+    def test_github_bulk_create_resumes_from_checkpoint(self):
+        seen, progress = [], []
+        path = os.path.join(tempfile.mkdtemp(), 'create.checkpoint')
+        h = self.getHandler('github')
+        h.content_limiter, clock = self.make_content_limiter(((2, 60),))
+        repos = ['repo%d' % i for i in range(4)] + [{'name': 'taken', 'private': True}]
+
+        with HTTMock(self.mock_github_bulk(seen, {})):
+            results = list(h.create_repos(repos, 'myorg', checkpoint=path, on_progress=progress.append))
+        self.assertEqual(sorted((r.name, r.status, r.ok) for r in results),
+                         [('repo0', 201, True), ('repo1', 201, True), ('repo2', 201, True), ('repo3', 201, True),
+                          ('taken', 422, False)])
+        self.assertEqual([r.error for r in results if not r.ok], ['Repository creation failed.'])
+        self.assertEqual(set(m for m, path, body in seen), set(['POST']))
+        self.assertTrue(('POST', '/orgs/myorg/repos', {'name': 'taken', 'private': True}) in seen)
+        # Two creations per minute
+        self.assertEqual(sorted(clock['slept']), [60, 60, 120])
+        self.assertEqual((progress[-1].done, progress[-1].succeeded, progress[-1].failed), (5, 4, 1))
+
+        del seen[:]
+        with HTTMock(self.mock_github_bulk(seen, {})):
+            results = list(h.create_repos(iter(repos), 'myorg', checkpoint=path))
+        self.assertEqual(seen, [('POST', '/orgs/myorg/repos', {'name': 'taken', 'private': True})])
+        self.assertEqual(sorted(r.name for r in results if r.skipped), ['repo0', 'repo1', 'repo2', 'repo3'])
+
+    def test_github_bulk_waits_out_secondary_limits(self):
+        seen = []
+        h = self.getHandler('github')
+        h.content_limiter, clock = self.make_content_limiter(((80, 60),))
+        with HTTMock(self.mock_github_bulk(seen, {'a': 1})):
+            archived = list(h.archive_repos(['a', 'other/b'], max_in_flight=1))
+            deleted = list(h.delete_repos(['c'], 'myorg'))
+
+        self.assertEqual([(r.full_name, r.status) for r in archived],
+                         [('email@example.com/a', 200), ('other/b', 200)])
+        self.assertEqual(seen[:3], [('PATCH', '/repos/email%40example.com/a', {'archived': True})] * 2 +
+                         [('PATCH', '/repos/other/b', {'archived': True})])
+        self.assertEqual(h.content_limiter.paused_until, 1060)
+        self.assertEqual(clock['slept'], [60, 60, 60])
+        self.assertEqual((deleted[0].full_name, deleted[0].status, deleted[0].ok), ('myorg/c', 204, True))
+
+    def test_github_secondary_limit_retry_after(self):
+        h = self.getHandler('github')
+
+        def delay(status, headers, data=None):
+            r = requests.Response()
+            r.status_code = status
+            r.headers.update(headers)
+            return h.secondary_limit_delay(r, data)
+
+        retry_at = formatdate(time.time() + 30, usegmt=True)
+        self.assertEqual(delay(429, {'Retry-After': '7'}), 7.0)
+        self.assertTrue(25 <= delay(403, {'Retry-After': retry_at}) <= 30)
+        self.assertEqual(delay(403, {'Retry-After': 'soon'}, {'message': 'You have exceeded a secondary rate limit'}),
+                         h.secondary_limit_wait)
+        self.assertEqual(delay(404, {'Retry-After': '7'}), None)
+
+    def mock_github_graphql(self, seen, status=200):
+        @urlmatch(netloc=r'api\.github\.com', path=r'^/graphql$', method='POST')
+        def handler(url, request):
+            body = json.loads(request.body)
+            seen.append(body)
+            if status != 200:
+                return response(status, {'message': 'Bad credentials'}, {'content-type': 'application/json'})
+
+            data, errors = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2026-01-01T00:00:00Z'}}, []
+            for alias in sorted(set(name.split('_')[0] for name in body.get('variables', {}))):
+                owner, name = body['variables'][alias + '_owner'], body['variables'][alias + '_name']
+                if name == 'missing':
+                    data[alias] = None
+                    errors.append({'type': 'NOT_FOUND', 'path': [alias], 'message': 'Could not resolve to a Repository'})
+                else:
+                    data[alias] = {'nameWithOwner': '%s/%s' % (owner, name)}
+            content = {'data': data, 'errors': errors} if errors else {'data': data}
+            return response(200, content, {'content-type': 'application/json'})
+        return handler
+
+    def test_github_graphql_batches_lookups(self):
+        seen = []
+        h = self.getHandler('github')
+        h.graphql_max_aliases = 2
+        h.content_limiter, clock = self.make_content_limiter(((1, 60),))
+        names = ['a', 'other/b', 'other/missing', 'c', 'myorg/d']
+
+        with HTTMock(self.mock_github_graphql(seen)):
+            repos = h.get_repos_metadata(names, fields='nameWithOwner')
+        self.assertEqual(repos, {'a': {'nameWithOwner': 'email@example.com/a'},
+                                 'other/b': {'nameWithOwner': 'other/b'}, 'other/missing': None,
+                                 'c': {'nameWithOwner': 'email@example.com/c'},
+                                 'myorg/d': {'nameWithOwner': 'myorg/d'}})
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(seen[0]['query'],
+                         'query($q0_name: String!, $q0_owner: String!, $q1_name: String!, $q1_owner: String!) {\n'
+                         '  q0: repository(owner: $q0_owner, name: $q0_name) { nameWithOwner }\n'
+                         '  q1: repository(owner: $q1_owner, name: $q1_name) { nameWithOwner }\n'
+                         '  rateLimit { cost remaining resetAt }\n}')
+        # Queries only read, they are not held back by the secondary rate limits
+        self.assertEqual(clock['slept'], [])
+
+        with HTTMock(self.mock_github_graphql(seen)):
+            with h.graphql_batch() as batch:
+                missing = batch.add('repository(owner: $owner, name: $name) { id }', owner='o', name='missing')
+                found = batch.add('repository(owner: $owner, name: $name) { id }', owner='o', name='found')
+        self.assertEqual((batch.queries, batch.cost, batch.rate_limit['remaining']), (1, 1, 4999))
+        self.assertEqual(found.result(), {'nameWithOwner': 'o/found'})
+        with self.assertRaises(graphql.GraphQLError) as raised:
+            missing.result()
+        self.assertEqual(raised.exception.errors[0]['type'], 'NOT_FOUND')
+
+    def test_github_graphql_budget_and_failures(self):
+        seen = []
+        h = self.getHandler('github')
+        batch = h.graphql_batch(max_nodes=100)
+        lookups = [batch.add('repository(owner: $owner, name: $name) { issues(first: %d) { nodes { id } } }' % n,
+                             nodes=n, owner='o', name='r%d' % n) for n in (60, 30, 50, 100)]
+        self.assertEqual([[l.nodes for l in chunk] for chunk in batch.chunks(lookups)], [[60, 30], [50], [100]])
+        with self.assertRaises(TypeError):
+            batch.add('node(id: $id) { id }', id=object()).render('q0')
+
+        batch = h.graphql_batch()
+        lookup = batch.add('node(id: $id) { id }', types={'id': 'ID!'}, id='MDQ6')
+        self.assertTrue('query($q0_id: ID!)' in batch.build_query([lookup])[0])
+        with HTTMock(self.mock_github_graphql(seen, status=401)):
+            self.assertRaises(graphql.GraphQLError, batch.execute)
+        self.assertEqual(len(batch), 0)
+        with self.assertRaises(graphql.GraphQLError) as raised:
+            lookup.result()
+        self.assertEqual(str(raised.exception), 'Bad credentials')
+
 
     ##############################################
     ## BASECAMP
@@ -142,6 +440,1709 @@ class TestSequenceFunctions(unittest.TestCase):
             self.assertTrue(h.check_connection())
 
 
+    ##############################################
+    ## CONCURRENCY
+    ##############################################
+
+    @urlmatch(netloc=r'api\.github\.com')
+    def mock_github_repos(self, url, request):
+        if url.path.endswith('/broken'):
+            raise ValueError('broken')
+        return response(200, {'path': url.path}, {'content-type': 'application/json'})
+
+    def test_do_many_keeps_order(self):
+        h = self.getHandler('github')
+        calls = [('repos/me/repo%d' % i,) for i in range(20)]
+        with HTTMock(self.mock_github_repos):
+            res = h.do_many(calls, max_workers=4)
+        self.assertEqual([r['path'] for r in res], ['/repos/me/repo%d' % i for i in range(20)])
+
+    def test_do_many_returns_errors(self):
+        h = self.getHandler('github')
+        calls = (c for c in [('repos/me/one', None, 'GET'), ('repos/me/broken',), ('repos/me/two', None, 'DELETE')])
+        with HTTMock(self.mock_github_repos):
+            res = h.do_many(calls, max_workers=2)
+        self.assertEqual(res[0], {'path': '/repos/me/one'})
+        self.assertTrue(isinstance(res[1], main.CallError))
+        self.assertTrue(isinstance(res[1].exception, ValueError))
+        self.assertEqual(res[1].call, ('repos/me/broken',))
+        self.assertEqual(res[2], {'path': '/repos/me/two'})
+
+    def test_do_many_as_completed(self):
+        h = self.getHandler('github')
+        with HTTMock(self.mock_github_repos):
+            res = dict(h.do_many([('repos/me/repo%d' % i,) for i in range(5)], as_completed=True))
+        self.assertEqual(sorted(res), list(range(5)))
+        self.assertEqual(res[3], {'path': '/repos/me/repo3'})
+
+    def test_identical_requests_coalesced(self):
+        calls = []
+        started = threading.Event()
+
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            calls.append((url.path, request.headers.get('Accept')))
+            started.set()
+            time.sleep(.2)
+            return response(200, {'login': 'someuser'}, {'content-type': 'application/json'})
+
+        h, other = self.getHandler('github'), github.GithubPyrate("other@example.com", "mypass")
+        h.single_flight = singleflight.SingleFlight()
+        other.single_flight = h.single_flight
+        results = []
+
+        def call(pyrate, headers=None):
+            results.append(pyrate.get('user', headers=headers))
+
+        with HTTMock(handler):
+            threads = [threading.Thread(target=call, args=(h,))]
+            threads[0].start()
+            started.wait()
+            threads += [threading.Thread(target=call, args=(h,)) for _ in range(8)]
+            threads.append(threading.Thread(target=call, args=(h, {'Accept': 'text/plain'})))
+            threads.append(threading.Thread(target=call, args=(other,)))
+            for thread in threads[1:]:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        self.assertEqual(len(results), 11)
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(h.single_flight.shared, 8)
+        self.assertEqual(len(h.single_flight), 0)
+        # Each caller decodes its own copy
+        self.assertTrue(results[0] is not results[1])
+
+    def test_coalesced_failure_shared(self):
+        flight = singleflight.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        errors = []
+
+        def fail():
+            started.set()
+            release.wait()
+            raise ValueError('down')
+
+        def call():
+            try:
+                flight.do('key', fail)
+            except ValueError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        threads[0].start()
+        started.wait()
+        for thread in threads[1:]:
+            thread.start()
+        while flight.shared < 2:
+            time.sleep(.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flight.do('key', lambda: 1), 1)
+
+    def test_do_does_not_leak_content(self):
+        h = self.getHandler('mailchimp')
+        with HTTMock(self.mock_mailchimp):
+            h.do('helper/ping', content={'foo': 'bar'})
+        self.assertEqual(h.get_template().body(), {'apikey': 'myapikey-us2'})
+
+    def test_request_template(self):
+        h = self.getHandler('harvest')
+        t = h.get_template()
+        self.assertTrue(h.get_template() is t)
+        self.assertEqual(h.build_request('projects', {'a': 1})[1:4],
+                         ('https://myorganisation.harvestapp.com/projects.json', t.headers(), {'a': 1}))
+        self.assertRaises(AttributeError, setattr, t, 'base_url', 'http://example.com/')
+
+        h.default_header_content = {'X-Other': '1'}
+        self.assertEqual(h.get_template().headers({'X-Call': '2'}),
+                         {'X-Other': '1', 'X-Call': '2', 'Authorization': h.create_basic_auth('email@example.com', 'mypass')})
+        self.assertEqual(h.default_header_content, {'X-Other': '1'})
+
+        self.assertEqual(h.endpoint('repos/{owner}/{name}', owner='me', name='a b/c'), 'repos/me/a%20b%2Fc')
+        self.assertRaises(KeyError, template.expand_endpoint, 'repos/{owner}', {})
+
+    ##############################################
+    ## CACHE
+    ##############################################
+
+    def mock_github_etag(self, calls):
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            calls.append(dict(request.headers))
+            if request.headers.get('If-None-Match') == '"v1"':
+                return response(304, None, {'ETag': '"v1"'})
+            return response(200, {'login': 'someuser'}, {'content-type': 'application/json', 'ETag': '"v1"'})
+        return handler
+
+    def test_cache_hit(self):
+        calls = []
+        h = self.getHandler('github')
+        h.cache = cache.MemoryCache(default_ttl=60)
+        with HTTMock(self.mock_github_etag(calls)):
+            self.assertEqual(h.get('user'), {'login': 'someuser'})
+            self.assertEqual(h.get('user'), {'login': 'someuser'})
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(h.cache_stats, {'hits': 1, 'misses': 1, 'revalidations': 0})
+
+    def test_cache_revalidates_with_etag(self):
+        calls = []
+        h = self.getHandler('github')
+        h.cache = cache.MemoryCache(default_ttl=60, ttls={r'/user$': 0})
+        with HTTMock(self.mock_github_etag(calls)):
+            h.get('user')
+            self.assertEqual(h.get('user'), {'login': 'someuser'})
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(calls[1]['If-None-Match'], '"v1"')
+        self.assertEqual(h.cache_stats, {'hits': 0, 'misses': 1, 'revalidations': 1})
+
+    def test_cache_skips_other_methods(self):
+        calls = []
+        h = self.getHandler('github')
+        h.cache = cache.MemoryCache()
+        with HTTMock(self.mock_github_etag(calls)):
+            h.post('user')
+            h.post('user')
+        self.assertEqual(len(calls), 2)
+        self.assertEqual(len(h.cache), 0)
+
+    def test_memory_cache_eviction(self):
+        c = cache.MemoryCache(max_entries=2, max_bytes=25)
+        for key in 'abc':
+            c.set(key, cache.CacheEntry(200, {}, b'0123456789', key, None, 0))
+        self.assertEqual(len(c), 2)
+        self.assertTrue(c.get('a') is None)
+        c.get('b')
+        c.set('d', cache.CacheEntry(200, {}, b'0123456789', 'd', None, 0))
+        self.assertTrue(c.get('b') is not None and c.get('c') is None)
+        c.set('e', cache.CacheEntry(200, {}, b'0123456789' * 3, 'e', None, 0))
+        self.assertTrue(c.get('e') is None)
+        self.assertEqual(c.size, 20)
+
+    def test_sqlite_cache_revalidates_across_instances(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+        calls = []
+        h = self.getHandler('github')
+        h.cache = cache.SQLiteCache(path, default_ttl=60, ttls={r'/user$': 0}, min_compress_size=0)
+        with HTTMock(self.mock_github_etag(calls)):
+            h.get('user')
+            # A fresh process would open the same file
+            h.cache = cache.SQLiteCache(path, ttls={r'/user$': 0})
+            self.assertEqual(h.get('user'), {'login': 'someuser'})
+        self.assertEqual(calls[1]['If-None-Match'], '"v1"')
+        self.assertEqual(h.cache_stats, {'hits': 0, 'misses': 1, 'revalidations': 1})
+        self.assertEqual(len(h.cache), 1)
+
+    def test_sqlite_cache_eviction(self):
+        c = cache.SQLiteCache(os.path.join(tempfile.mkdtemp(), 'cache.db'), max_bytes=2500, min_compress_size=100)
+        c.touch_interval = 0
+        body = b'0123456789' * 100
+        for key in 'abc':
+            c.set(key, cache.CacheEntry(200, {'ETag': key}, body, key, 'utf-8', 0))
+            time.sleep(.01)
+        # Compressed, so all fit
+        self.assertEqual(len(c), 3)
+        self.assertEqual(c.get('a').content, body)
+        self.assertEqual(c.get('a').etag, 'a')
+
+        c.compress_level = 0
+        for key in 'de':
+            c.set(key, cache.CacheEntry(200, {}, body, key, None, 0))
+            time.sleep(.01)
+        c.get('b')
+        c.set('g', cache.CacheEntry(200, {}, body, 'g', None, 0))
+        # Least recently used first
+        self.assertEqual([key for key in 'abcdeg' if c.get(key) is not None], ['b', 'e', 'g'])
+        self.assertTrue(c.size <= 2500)
+        c.set('f', cache.CacheEntry(200, {}, body * 4, 'f', None, 0))
+        self.assertTrue(c.get('f') is None)
+        c.clear()
+        self.assertEqual((len(c), c.size), (0, 0))
+
+    def test_sqlite_cache_shared_across_processes(self):
+        path = os.path.join(tempfile.mkdtemp(), 'cache.db')
+        c = cache.SQLiteCache(path)
+        c.set('parent', cache.CacheEntry(200, {}, b'parent', 'parent', None, 0))
+        workers = [multiprocessing.Process(target=fill_sqlite_cache, args=(c, i)) for i in range(3)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual([w.exitcode for w in workers], [0, 0, 0])
+        self.assertEqual(len(c), 31)
+        self.assertEqual(c.get('2-9').content, b'2-9')
+
+    ##############################################
+    ## PAGINATION
+    ##############################################
+
+    @urlmatch(netloc=r'api\.github\.com', path=r'/user/followers')
+    def mock_github_pages(self, url, request):
+        page = int(dict(p.split('=') for p in url.query.split('&')).get('page', 1))
+        headers = {'content-type': 'application/json'}
+        if page < 3:
+            headers['Link'] = '<https://api.github.com/user/followers?per_page=100&page=%d>; rel="next"' % (page + 1)
+        return response(200, [{'login': 'user%d-%d' % (page, i)} for i in range(2)], headers)
+
+    def test_github_iter_items(self):
+        h = self.getHandler('github')
+        with HTTMock(self.mock_github_pages):
+            logins = [u['login'] for u in h.iter_items('user/followers')]
+        self.assertEqual(logins, ['user1-0', 'user1-1', 'user2-0', 'user2-1', 'user3-0', 'user3-1'])
+
+    def test_github_iter_pages_prefetch(self):
+        h = self.getHandler('github')
+        with HTTMock(self.mock_github_pages):
+            pages = list(h.iter_pages('user/followers', prefetch=True))
+        self.assertEqual(len(pages), 3)
+
+    def test_twitter_iter_items_cursor(self):
+        cursors = []
+
+        @urlmatch(netloc=r'api\.twitter\.com')
+        def handler(url, request):
+            cursors.append(url.query)
+            if 'cursor=7' in url.query:
+                return response(200, {'ids': [3], 'next_cursor': 0}, {})
+            return response(200, {'ids': [1, 2], 'next_cursor': 7}, {})
+
+        h = self.getHandler('twitter')
+        with HTTMock(handler):
+            ids = list(h.iter_items('followers/ids', content={'screen_name': 'someone'}))
+        self.assertEqual(ids, [1, 2, 3])
+        self.assertEqual(cursors, ['screen_name=someone', 'cursor=7&screen_name=someone'])
+
+    def test_twitter_iter_items_max_id(self):
+        @urlmatch(netloc=r'api\.twitter\.com')
+        def handler(url, request):
+            if 'max_id=9' in url.query:
+                return response(200, [], {})
+            return response(200, [{'id': 11}, {'id': 10}], {})
+
+        h = self.getHandler('twitter')
+        with HTTMock(handler):
+            self.assertEqual([t['id'] for t in h.iter_items('statuses/user_timeline')], [11, 10])
+
+    def test_mailchimp_iter_items(self):
+        bodies = []
+
+        @urlmatch(netloc=r'.*\.api\.mailchimp\.com')
+        def handler(url, request):
+            body = json.loads(request.body)
+            bodies.append(body)
+            start = body['start']
+            return response(200, {'total': 150, 'data': [{'id': start * 100 + i} for i in range(min(100, 150 - start * 100))]}, {})
+
+        h = self.getHandler('mailchimp')
+        with HTTMock(handler):
+            lists = list(h.iter_items('lists/list'))
+        self.assertEqual(len(lists), 150)
+        self.assertEqual([(b['start'], b['limit'], b['apikey']) for b in bodies],
+                         [(0, 100, 'myapikey-us2'), (1, 100, 'myapikey-us2')])
+
+    def test_basecamp_iter_items(self):
+        @urlmatch(netloc=r'basecamp\.com')
+        def handler(url, request):
+            if 'page=1' in url.query:
+                return response(200, [{'id': i} for i in range(50)], {'content-type': 'application/json'})
+            return response(200, [{'id': 50}], {'content-type': 'application/json'})
+
+        h = self.getHandler('basecamp')
+        with HTTMock(handler):
+            self.assertEqual(len(list(h.iter_items('projects'))), 51)
+
+    def test_iter_items_stops_when_page_ignored(self):
+        requested = []
+
+        @urlmatch(netloc=r'myorganisation\.harvestapp\.com')
+        def handler(url, request):
+            # Ignores the page parameter, always answers with the same full page
+            requested.append(url.query)
+            return response(200, [{'id': i} for i in range(50)], {'content-type': 'application/json'})
+
+        h = self.getHandler('harvest')
+        with HTTMock(handler):
+            self.assertEqual(len(list(h.iter_items('invoices'))), 50)
+            self.assertEqual(len(list(h.iter_pages('invoices', prefetch=True))), 1)
+        self.assertEqual(requested[:2], ['page=1', 'page=2'])
+
+        paginator = pagination.PageNumberPaginator(max_pages=3)
+        pages = [paginator.first_request('invoices', None)]
+        while pages[-1] is not None:
+            url, content = pages[-1]
+            pages.append(paginator.next_request(url, content, None, [{'id': content['page']}]))
+        self.assertEqual([request[1]['page'] for request in pages[:-1]], [1, 2, 3])
+
+    ##############################################
+    ## RATE LIMITS
+    ##############################################
+
+    def make_limiter(self, now=1000.0):
+        clock = {'now': now, 'slept': []}
+
+        def sleep(seconds):
+            clock['slept'].append(seconds)
+            clock['now'] += seconds
+
+        return ratelimit.RateLimiter(burst=2, clock=lambda: clock['now'], sleep=sleep), clock
+
+    def test_rate_limiter_waits_for_reset(self):
+        limiter, clock = self.make_limiter()
+        limiter.update('core', {'X-RateLimit-Remaining': '1', 'X-RateLimit-Reset': '1060'})
+        self.assertEqual(limiter.acquire('core'), 0)
+        self.assertEqual(limiter.acquire('core'), 60)
+        self.assertEqual(limiter.remaining('core'), None)
+        self.assertEqual(limiter.acquire('core'), 0)
+
+    def test_rate_limiter_paces_bursts(self):
+        limiter, clock = self.make_limiter()
+        limiter.update('core', {'x-rate-limit-remaining': '10', 'x-rate-limit-reset': '1010'})
+        for _ in range(4):
+            limiter.acquire('core')
+        # Two calls of burst, then one call per second
+        self.assertEqual(clock['slept'], [1.0, 1.0])
+        self.assertEqual(limiter.remaining('core'), 6)
+
+    def test_rate_limiter_credits_waits_between_updates(self):
+        limiter, clock = self.make_limiter()
+        limiter.burst = 10
+        reset = clock['now'] + 3600
+        for remaining in range(5000, 4900, -1):
+            limiter.update('core', {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': str(reset)})
+            limiter.acquire('core')
+            clock['now'] += 0.05
+        # The quota spread evenly: about 0.72s between calls after the burst, not growing waits
+        self.assertTrue(55 < sum(clock['slept']) < 70, sum(clock['slept']))
+        self.assertTrue(max(clock['slept']) < 0.8, max(clock['slept']))
+
+    def test_rate_limiter_retry_after(self):
+        limiter, clock = self.make_limiter(now=time.time())
+        limiter.update('core', {'Retry-After': '30'}, 429)
+        self.assertEqual(limiter.acquire('core'), 30)
+
+        limiter, clock = self.make_limiter(now=time.time())
+        limiter.update('core', {'Retry-After': formatdate(clock['now'] + 60, usegmt=True)}, 403)
+        self.assertTrue(55 <= limiter.acquire('core') <= 60)
+
+        # Unparseable or past dates do not hold calls back
+        limiter, clock = self.make_limiter(now=time.time())
+        limiter.update('core', {'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}, 403)
+        limiter.update('search', {'Retry-After': 'soon'}, 429)
+        self.assertEqual((limiter.acquire('core'), limiter.acquire('search')), (0, 0))
+
+    def test_rate_limiter_paces_low_quota_only(self):
+        limiter, clock = self.make_limiter()
+        limiter.burst = 10
+        reset = clock['now'] + 3600
+        for remaining in range(4900, 4800, -1):
+            limiter.update('core', {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Limit': '5000',
+                                    'X-RateLimit-Reset': str(reset)})
+            limiter.acquire('core')
+        self.assertEqual(clock['slept'], [])
+
+        # Under 10% of the limit, the rest of the quota is spread over the time left
+        for remaining in range(499, 479, -1):
+            limiter.update('core', {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Limit': '5000',
+                                    'X-RateLimit-Reset': str(reset)})
+            limiter.acquire('core')
+        self.assertEqual(len(clock['slept']), 20)
+        self.assertTrue(all(6 < slept < 8 for slept in clock['slept']), clock['slept'])
+
+    def test_rate_limiter_families_are_separate(self):
+        limiter, clock = self.make_limiter()
+        limiter.update('search', {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1060'})
+        self.assertEqual(limiter.acquire('core'), 0)
+        self.assertEqual(limiter.acquire('search'), 60)
+
+    def test_rate_limiter_shared_by_credentials(self):
+        h1, h2 = self.getHandler('github'), self.getHandler('github')
+        other = github.GithubPyrate("other@example.com", "mypass")
+        self.assertTrue(h1.get_rate_limiter() is h2.get_rate_limiter())
+        self.assertTrue(other.get_rate_limiter() is not h1.get_rate_limiter())
+        self.assertEqual(self.getHandler('harvest').get_rate_limiter(), None)
+
+    def test_github_rate_limit_headers(self):
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            return response(200, {}, {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1060',
+                                      'content-type': 'application/json'})
+
+        h = self.getHandler('github')
+        h.rate_limiter, clock = self.make_limiter()
+        with HTTMock(handler):
+            h.get('search/repositories')
+            h.get('user')
+            h.get('search/repositories')
+        self.assertEqual(clock['slept'], [60])
+        self.assertEqual(h.rate_limit_family('https://api.github.com/search/code?q=x'), 'search')
+
+    def test_twitter_rate_limit_family(self):
+        h = self.getHandler('twitter')
+        self.assertEqual(h.rate_limit_family('https://api.twitter.com/1.1/statuses/show/123.json?x=1'),
+                         'statuses/show/:id')
+        self.assertEqual(h.rate_limit_family('https://stream.twitter.com/1.1/statuses/filter.json?track=x'),
+                         'statuses/filter')
+
+    ##############################################
+    ## CREDENTIAL POOL
+    ##############################################
+
+    def make_pool(self, quotas):
+        members, users = [], {}
+        for i, remaining in enumerate(quotas):
+            h = github.GithubPyrate("user%d@example.com" % i, "mypass")
+            h.rate_limiter, clock = self.make_limiter()
+            if remaining is not None:
+                h.rate_limiter.update('core', {'X-RateLimit-Remaining': str(remaining), 'X-RateLimit-Reset': '1060'})
+            users[h.get_auth().headers['Authorization']] = i
+            members.append(h)
+
+        used = []
+
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            used.append(users[request.headers['Authorization']])
+            return response(200, {'path': url.path}, {'content-type': 'application/json'})
+
+        return pool.CredentialPool(members), handler, used
+
+    def test_pool_routes_by_remaining_quota(self):
+        p, handler, used = self.make_pool([10, 50, 20])
+        with HTTMock(handler):
+            p.get('repos/me/repo')
+            p.get('repos/me/other')
+        self.assertEqual(used, [1, 1])
+        self.assertEqual(p.choose('repos/me/repo'), 1)
+        self.assertRaises(ValueError, pool.CredentialPool, [])
+
+    def test_pool_parks_exhausted_credentials(self):
+        p, handler, used = self.make_pool([0, 0, 5])
+        p.members[1].rate_limiter.update('core', {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1030'})
+        self.assertEqual(p.choose('repos/me/repo'), 2)
+        p.members[2].rate_limiter.update('core', {'X-RateLimit-Remaining': '0', 'X-RateLimit-Reset': '1060'})
+        # All parked, the first one to reset wins
+        self.assertEqual(p.choose('repos/me/repo'), 1)
+
+    def test_pool_pins_user_scoped_endpoints(self):
+        p, handler, used = self.make_pool([10, 50])
+        with HTTMock(handler):
+            p.get('user/repos')
+            p.get('user')
+            p.get('notifications')
+            p.get('users/someone/repos')
+        self.assertEqual(used, [0, 0, 0, 1])
+        self.assertTrue(p.base_url is p.pinned.base_url)
+
+    def test_pool_spreads_unknown_quota(self):
+        p, handler, used = self.make_pool([None, None, None])
+        with HTTMock(handler):
+            res = p.do_many([('repos/me/repo%d' % i,) for i in range(6)], max_workers=1)
+        self.assertEqual([r['path'] for r in res], ['/repos/me/repo%d' % i for i in range(6)])
+        self.assertEqual(sorted(used), [0, 0, 1, 1, 2, 2])
+        self.assertEqual(p.in_flight, [0, 0, 0])
+
+    ##############################################
+    ## RETRIES
+    ##############################################
+
+    def mock_flaky_harvest(self, failures, calls):
+        @urlmatch(netloc=r'.*\.harvestapp\.com')
+        def handler(url, request):
+            calls.append(request.method)
+            if failures:
+                failure = failures.pop(0)
+                if failure == 'reset':
+                    raise requests.exceptions.ConnectionError('connection reset')
+                return response(failure, None, {'Retry-After': '7'} if failure == 429 else {})
+            return response(200, {'company': 'somecompany'}, {'content-type': 'application/json'})
+        return handler
+
+    def make_policy(self, **kwargs):
+        slept = []
+        kwargs.setdefault('budget', retry.RetryBudget())
+        return retry.RetryPolicy(sleep=slept.append, **kwargs), slept
+
+    def test_retry_on_server_errors(self):
+        calls = []
+        h = self.getHandler('harvest')
+        h.retry_policy, slept = self.make_policy(backoff_base=1)
+        with HTTMock(self.mock_flaky_harvest([503, 'reset', 429], calls)):
+            self.assertEqual(h.get('account/who_am_i')['company'], 'somecompany')
+        self.assertEqual(len(calls), 4)
+        self.assertTrue(0 <= slept[0] <= 1 and 0 <= slept[1] <= 2)
+        self.assertEqual(slept[2], 7)
+
+    def test_retry_gives_up(self):
+        calls = []
+        h = self.getHandler('harvest')
+        h.retry_policy, slept = self.make_policy(total=2)
+        with HTTMock(self.mock_flaky_harvest([502, 502, 502, 502], calls)):
+            h.get('account/who_am_i')
+        self.assertEqual(len(calls), 3)
+        self.assertEqual(len(slept), 2)
+
+    def test_retry_skips_unsafe_methods(self):
+        calls = []
+        h = self.getHandler('harvest')
+        h.retry_policy, slept = self.make_policy()
+        with HTTMock(self.mock_flaky_harvest(['reset'], calls)):
+            self.assertRaises(requests.exceptions.ConnectionError, h.post, 'account/who_am_i')
+        self.assertEqual(calls, ['POST'])
+
+    def test_retry_budget(self):
+        calls = []
+        h = self.getHandler('harvest')
+        h.retry_policy, slept = self.make_policy(budget=retry.RetryBudget(ratio=0.5, min_tokens=1))
+        with HTTMock(self.mock_flaky_harvest([503] * 10, calls)):
+            h.get('account/who_am_i')
+            h.get('account/who_am_i')
+        # 1 token to start with + 0.5 per request: the first request retries twice, the second not at all
+        self.assertEqual(len(calls), 4)
+
+    def test_retry_after_date(self):
+        policy = retry.RetryPolicy()
+        self.assertEqual(policy.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0)
+        self.assertEqual(policy.parse_retry_after('12'), 12)
+        self.assertEqual(policy.parse_retry_after('soon'), None)
+
+    ##############################################
+    ## STREAMING
+    ##############################################
+
+    @urlmatch(netloc=r'.*\.api\.mailchimp\.com')
+    def mock_mailchimp_export(self, url, request):
+        content = {'total': 3, 'data': [{'email': 'a@example.com'}, {'email': 'b@example.com'}, {'rate': 1.5}]}
+        return response(200, content, {}, stream=True)
+
+    def test_mailchimp_do_stream(self):
+        h = self.getHandler('mailchimp')
+        with HTTMock(self.mock_mailchimp_export):
+            items = list(h.do_stream('lists/members', {'id': 'abc'}))
+        self.assertEqual(items, [{'email': 'a@example.com'}, {'email': 'b@example.com'}, {'rate': 1.5}])
+
+    def test_do_stream_without_ijson(self):
+        h = self.getHandler('mailchimp')
+        ijson, jsonstream.ijson = jsonstream.ijson, None
+        try:
+            with HTTMock(self.mock_mailchimp_export):
+                items = list(h.do_stream('lists/members', {'id': 'abc'}))
+        finally:
+            jsonstream.ijson = ijson
+        self.assertEqual(len(items), 3)
+
+    def test_do_stream_raises_for_errors(self):
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            return response(404, {'message': 'Not Found'}, {}, stream=True)
+
+        h = self.getHandler('github')
+        with HTTMock(handler):
+            self.assertRaises(requests.HTTPError, list, h.do_stream('user/repos'))
+
+    def test_iter_json_items_chunked(self):
+        doc = json.dumps({'meta': {'data': [0]}, 'data': [{'id': 1}, 12345, 'x', None, -1.5e3]}).encode('utf-8')
+        for size in (1, 3, 64):
+            chunks = [doc[i:i + size] for i in range(0, len(doc), size)]
+            self.assertEqual(list(jsonstream.iter_json_items(chunks, ('data',))), [{'id': 1}, 12345, 'x', None, -1500.0])
+
+    ##############################################
+    ## JSON CODECS
+    ##############################################
+
+    def test_stdlib_codec(self):
+        codec = jsoncodec.get_codec('stdlib')
+        self.assertEqual(codec.dumps({'a': [1, 'é']}), '{"a":[1,"\\u00e9"]}'.encode('utf-8'))
+        self.assertEqual(codec.loads(b'{"a": [1, "b"]}'), {'a': [1, 'b']})
+        self.assertTrue(jsoncodec.get_codec('stdlib') is codec)
+
+    def test_default_codec_is_fastest_installed(self):
+        expected = 'stdlib'
+        for name in jsoncodec.PREFERENCE:
+            try:
+                jsoncodec.get_codec(name)
+            except ImportError:
+                continue
+            expected = name
+            break
+        self.assertEqual(jsoncodec.get_codec().name, expected)
+
+    def test_codec_per_service(self):
+        bodies = []
+
+        @urlmatch(netloc=r'.*\.api\.mailchimp\.com')
+        def handler(url, request):
+            bodies.append(request.body)
+            return response(200, {'msg': "Everything's Chimpy!"}, {})
+
+        h = self.getHandler('mailchimp')
+        h.json_codec = 'stdlib'
+        with HTTMock(handler):
+            self.assertEqual(h.do('helper/ping', {'x': 1}), {'msg': "Everything's Chimpy!"})
+        self.assertEqual(json.loads(bodies[0].decode('utf-8')), {'apikey': 'myapikey-us2', 'x': 1})
+
+    def test_json_bodies_any_codec(self):
+        bodies = []
+
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            bodies.append(request.body)
+            return response(201, {}, {'content-type': 'application/json'})
+
+        h = self.getHandler('github')
+        h.content_creation_limits = None
+        with HTTMock(handler):
+            for name in jsoncodec.PREFERENCE:
+                try:
+                    h.json_codec = jsoncodec.get_codec(name)
+                except ImportError:
+                    continue
+                h.post('repos/a/b/issues', {'title': 't', 'labels': {1: 'x'}, 'big': 2 ** 70})
+        self.assertTrue(bodies)
+        for body in bodies:
+            self.assertEqual(json.loads(body.decode('utf-8')), {'title': 't', 'labels': {'1': 'x'}, 'big': 2 ** 70})
+
+    def test_decoding_falls_back_to_stdlib(self):
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            if url.path == '/bom':
+                return response(200, b'\xef\xbb\xbf{"id": 1}', {'content-type': 'application/json'})
+            return response(200, b'{"id": 123456789012345678901234}', {'content-type': 'application/json'})
+
+        h = self.getHandler('github')
+        with HTTMock(handler):
+            for name in jsoncodec.PREFERENCE:
+                try:
+                    h.json_codec = jsoncodec.get_codec(name)
+                except ImportError:
+                    continue
+                self.assertEqual(h.get('bom'), {'id': 1})
+            # Exact with the standard library, see the jsoncodec module for the others
+            h.json_codec = jsoncodec.get_codec('stdlib')
+            self.assertEqual(h.get('big'), {'id': 123456789012345678901234})
+
+    def test_set_default_codec(self):
+        jsoncodec.set_default_codec('stdlib')
+        try:
+            self.assertEqual(self.getHandler('github').get_json_codec().name, 'stdlib')
+        finally:
+            jsoncodec.set_default_codec(None)
+
+    ##############################################
+    ## INSTRUMENTATION
+    ##############################################
+
+    def test_hooks_and_metrics(self):
+        events = []
+        h = self.getHandler('harvest')
+        h.register_hook('request', lambda record: events.append(('request', record.endpoint)))
+        h.register_hook('response', lambda record: events.append(('response', record.status_code)))
+        h.register_hook('error', lambda record: events.append(('error', type(record.error).__name__)))
+        calls = []
+        h.retry_policy = None
+        with HTTMock(self.mock_flaky_harvest(['reset'], calls)):
+            self.assertRaises(requests.exceptions.ConnectionError, h.get, 'projects/12')
+            h.get('projects/12')
+        self.assertEqual(events, [('request', 'projects/:id'), ('error', 'ConnectionError'),
+                                  ('request', 'projects/:id'), ('response', 200)])
+
+        metrics = h.metrics.as_dict()['harvest']['projects/:id']
+        self.assertEqual(metrics['latency']['count'], 2)
+        self.assertEqual(metrics['latency']['buckets'][float('inf')], 2)
+        self.assertEqual(metrics['statuses'], {200: 1})
+        self.assertEqual(metrics['errors'], {'ConnectionError': 1})
+        self.assertTrue(metrics['bytes']['received'] > 0)
+
+        text = h.metrics.to_prometheus()
+        self.assertTrue('# TYPE pyrate_request_duration_seconds histogram' in text)
+        self.assertTrue('pyrate_request_duration_seconds_count{service="harvest",endpoint="projects/:id"} 2' in text)
+        self.assertTrue('pyrate_responses_total{service="harvest",endpoint="projects/:id",status="200"} 1' in text)
+
+    def test_metrics_endpoints_bounded(self):
+        h = self.getHandler('github')
+        self.assertEqual(h.endpoint_label(h.base_url + 'repos/me/repo1/issues/12'), 'repos/{owner}/{name}/issues/:id')
+        self.assertEqual(h.endpoint_label(h.base_url + 'repos/me/repo1'), 'repos/{owner}/{name}')
+        self.assertEqual(h.endpoint_label(h.base_url + 'orgs/myorg/repos?page=2'), 'orgs/{org}/repos')
+
+        with HTTMock(self.mock_github):
+            for i in range(50):
+                h.get('repos/me/repo%d' % i)
+        self.assertEqual(list(h.metrics.as_dict()['github']), ['repos/{owner}/{name}'])
+
+        h.metrics = main.Metrics(max_endpoints=2)
+        with HTTMock(self.mock_github):
+            for path in ('user', 'user/orgs', 'notifications', 'emojis', 'user'):
+                h.get(path)
+        metrics = h.metrics.as_dict()['github']
+        self.assertEqual(sorted(metrics), [':other', 'user', 'user/orgs'])
+        self.assertEqual((metrics['user']['latency']['count'], metrics[':other']['latency']['count']), (2, 2))
+
+    def test_connection_timings(self):
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = b'{"company": "somecompany"}'
+                self.send_response(200)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        records = []
+        try:
+            h = self.getHandler('harvest')
+            h.base_url = 'http://127.0.0.1:%d/' % server.server_port
+            h.register_hook('response', records.append)
+            self.assertEqual(h.get('account/who_am_i'), {'company': 'somecompany'})
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            h.close()
+
+        timing = records[0].timing
+        self.assertTrue(timing['connect'] > 0)
+        self.assertEqual(timing['tls'], 0)
+        self.assertTrue(timing['ttfb'] > 0)
+        self.assertTrue(timing['total'] >= timing['connect'] + timing['ttfb'])
+        self.assertEqual(records[0].response_bytes, 26)
+
+    def test_compression(self):
+        received = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                if self.headers.get('Content-Encoding') == 'gzip':
+                    body = zlib.decompress(body, 16 + zlib.MAX_WBITS)
+                received.append((self.headers.get('Content-Encoding'), self.headers['Accept-Encoding'],
+                                 json.loads(body.decode('utf-8'))))
+                body = compression.gzip_compress(json.dumps({'items': ['same'] * 1000}).encode('utf-8'))
+                self.send_response(201)
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        records = []
+        try:
+            h = self.getHandler('github')
+            h.base_url = 'http://127.0.0.1:%d/' % server.server_port
+            h.compress_requests = True
+            h.register_hook('response', records.append)
+            small = h.post('user/repos', {'name': 'small'})
+            large = h.post('user/repos', {'name': 'large', 'description': 'x' * 2000})
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            h.close()
+
+        self.assertEqual(small, large)
+        self.assertEqual(len(large['items']), 1000)
+        self.assertEqual([(encoding, content['name']) for encoding, _, content in received],
+                         [(None, 'small'), ('gzip', 'large')])
+        self.assertEqual(received[1][2]['description'], 'x' * 2000)
+        self.assertTrue(set(['gzip', 'deflate']) <= set(received[0][1].split(', ')))
+
+        self.assertEqual(records[0].request_bytes_saved, 0)
+        self.assertTrue(records[1].request_bytes_saved > 1900)
+        self.assertEqual(records[1].response_bytes, len(json.dumps({'items': ['same'] * 1000})))
+        self.assertTrue(records[1].response_bytes_saved > 7900)
+        saved = h.metrics.as_dict()['github']['user/repos']['bytes_saved']
+        self.assertEqual(saved['sent'], records[1].request_bytes_saved)
+        self.assertTrue('pyrate_request_bytes_saved_total{service="github",endpoint="user/repos",direction="received"}'
+                        in h.metrics.to_prometheus())
+
+    ##############################################
+    ## AUTH
+    ##############################################
+
+    def test_oauth1_signer_reused(self):
+        signed = []
+
+        @urlmatch(netloc=r'api\.twitter\.com')
+        def handler(url, request):
+            signed.append(request.headers['Authorization'])
+            return response(200, {'id': 1}, {})
+
+        h = self.getHandler('twitter')
+        with HTTMock(handler):
+            h.do('statuses/show/1')
+            provider = h.auth
+            h.do('statuses/show/2')
+        self.assertTrue(h.auth is provider)
+        self.assertEqual(len(signed), 2)
+        self.assertTrue(all('oauth_signature=' in value for value in signed))
+        self.assertNotEqual(signed[0], signed[1])
+
+    def test_oauth1_signature_matches_oauthlib(self):
+        from oauthlib.oauth1 import Client
+
+        provider = auth.OAuth1Auth('key', 'sec ret', 'token', 'token~secret')
+        client = Client('key', client_secret='sec ret', resource_owner_key='token',
+                        resource_owner_secret='token~secret', nonce='abc', timestamp='1400000000')
+        url = 'https://API.twitter.com:443/1.1/search/tweets.json?q=caf%C3%A9+%26+bar&count=2&empty='
+        body = 'status=Hello%20Ladies%20%2B%20Gentlemen%2C%20a%20signed%20OAuth%20request%21&include_entities=true'
+
+        def signature(header):
+            return dict(part.split('=', 1) for part in header[len('OAuth '):].split(', '))['oauth_signature']
+
+        for method, data in (('GET', None), ('POST', body)):
+            headers = {'Content-Type': auth.FORM_CONTENT_TYPE} if data else {}
+            expected = client.sign(url, method, data, headers)[1]['Authorization']
+            actual = provider.authorization(method, url, provider.body_params(headers.get('Content-Type'), data),
+                                            nonce='abc', timestamp='1400000000')
+            self.assertEqual(signature(actual), signature(expected))
+
+    def test_api_key_header(self):
+        seen = []
+
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            seen.append((request.headers.get('X-Api-Key'), request.headers.get('Authorization')))
+            return response(200, {}, {})
+
+        h = self.getHandler('github')
+        h.auth = auth.ApiKeyAuth('secret', 'X-Api-Key', 'header')
+        with HTTMock(handler):
+            h.do('user')
+        self.assertEqual(seen, [('secret', None)])
+        self.assertRaises(ValueError, auth.ApiKeyAuth, 'secret', location='cookie')
+
+    def test_bearer_refreshed_before_expiry(self):
+        now = [1000.0]
+        tokens = []
+
+        def refresh():
+            tokens.append('token%d' % len(tokens))
+            return tokens[-1], 300
+
+        provider = auth.BearerAuth(refresh=refresh, refresh_margin=60, clock=lambda: now[0])
+        self.assertEqual(provider.get_header(), 'Bearer token0')
+        now[0] += 200
+        self.assertEqual(provider.get_header(), 'Bearer token0')
+        now[0] += 50  # within the margin
+        self.assertEqual(provider.get_header(), 'Bearer token1')
+
+        # Threads holding the same stale state refresh once
+        state = provider._state
+        provider.refresh(state)
+        provider.refresh(state)
+        self.assertEqual(tokens, ['token0', 'token1', 'token2'])
+
+    def test_bearer_auth_requests(self):
+        seen = []
+
+        @urlmatch(netloc=r'api\.github\.com')
+        def handler(url, request):
+            seen.append(request.headers['Authorization'])
+            return response(200, {}, {})
+
+        h = self.getHandler('github')
+        h.auth = auth.BearerAuth('abc', account='me')
+        with HTTMock(handler):
+            h.do('user')
+        self.assertEqual(seen, ['Bearer abc'])
+        self.assertNotEqual(h.auth_identity(), self.getHandler('github').auth_identity())
+
+    ##############################################
+    ## STREAMING API
+    ##############################################
+
+    def test_stream_message_parser(self):
+        parser = streaming.MessageParser()
+        self.assertEqual(parser.feed(b'{"a": 1}\r\n\r\n{"b"'), [b'{"a": 1}'])
+        self.assertEqual(parser.feed(b': 2}\r'), [])
+        self.assertEqual(parser.feed(b'\n'), [b'{"b": 2}'])
+
+        parser = streaming.MessageParser(delimited=True)
+        self.assertEqual(parser.feed(b'\r\n10\r\n{"a": '), [])
+        self.assertEqual(parser.feed(b'1}\r\n11\r\n{"b": 2'), [b'{"a": 1}'])
+        self.assertEqual(parser.feed(b'0}\r\n'), [b'{"b": 20}'])
+
+    def test_stream_backoff(self):
+        backoff = streaming.StreamBackoff()
+        self.assertEqual([backoff.network_error() for i in range(3)], [.25, .5, .75])
+        self.assertEqual([backoff.http_error(503) for i in range(8)], [5, 10, 20, 40, 80, 160, 320, 320])
+        self.assertEqual([backoff.http_error(420) for i in range(2)], [60, 120])
+        backoff.reset()
+        self.assertEqual(backoff.network_error(), .25)
+
+    def run_stream_server(self, connections):
+        # Serves connections[i](handler) to the i-th connection
+        served = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                served.append(self.path)
+                connections[min(len(served), len(connections)) - 1](self)
+
+            do_POST = do_GET
+
+            def log_message(self, *args):
+                pass
+
+        class Server(HTTPServer):
+            def handle_error(self, request, client_address):
+                pass  # clients hanging up on stalled streams
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        def stop():
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        return 'http://127.0.0.1:%d/1.1/' % server.server_port, served, stop
+
+    def stream_messages(self, *messages, **kwargs):
+        def respond(handler):
+            handler.send_response(kwargs.get('status', 200))
+            handler.end_headers()
+            for message in messages:
+                handler.wfile.write(json.dumps(message).encode('utf-8') + b'\r\n')
+                handler.wfile.write(b'\r\n')  # keep-alive
+                handler.wfile.flush()
+            time.sleep(kwargs.get('stall', 0))
+        return respond
+
+    def fast_backoff(self):
+        backoff = streaming.StreamBackoff()
+        backoff.network_step = backoff.http_start = .01
+        return backoff
+
+    def test_twitter_stream_reconnects(self):
+        url, served, stop = self.run_stream_server([
+            self.stream_messages(status=503),
+            self.stream_messages({'id': 1}, {'id': 2}, stall=.6),
+            self.stream_messages({'id': 3}),
+        ])
+        h = self.getHandler('twitter')
+        h.stream_url = url
+        try:
+            with h.stream('statuses/filter', {'track': 'python'}, http_method='POST', stall_timeout=.2,
+                          backoff=self.fast_backoff()) as stream:
+                messages = [message['id'] for i, message in zip(range(3), stream)]
+        finally:
+            stop()
+
+        self.assertEqual(messages, [1, 2, 3])
+        self.assertEqual(served[0], '/1.1/statuses/filter.json')
+        self.assertTrue(stream.connections >= 3)
+
+    def test_twitter_stream_overflow(self):
+        url, served, stop = self.run_stream_server([self.stream_messages(*[{'id': i} for i in range(10)], stall=.5)])
+        h = self.getHandler('twitter')
+        h.stream_url = url
+        try:
+            stream = h.stream('statuses/sample', queue_size=2, overflow='drop_oldest')
+            stream.start()
+            while stream.received < 10:
+                time.sleep(.01)
+            messages = [message['id'] for i, message in zip(range(2), stream)]
+            stream.close()
+        finally:
+            stop()
+
+        self.assertEqual(messages, [8, 9])
+        self.assertEqual(stream.dropped, 8)
+        self.assertTrue('delimited' not in served[0])
+
+    def test_twitter_stream_fatal_status(self):
+        url, served, stop = self.run_stream_server([self.stream_messages(status=401)])
+        h = self.getHandler('twitter')
+        h.stream_url = url
+        try:
+            stream = h.stream('statuses/sample', delimited=True)
+            self.assertRaises(streaming.StreamError, list, stream)
+        finally:
+            stop()
+        self.assertEqual(len(served), 1)
+        self.assertTrue('delimited=length' in served[0])
+        self.assertRaises(ValueError, h.stream, 'statuses/sample', overflow='ignore')
+
+    ##############################################
+    ## SERVICE REGISTRY
+    ##############################################
+
+    def test_get_service(self):
+        h = pyrate.get_service('github', 'email@example.com', 'mypass')
+        self.assertTrue(isinstance(h, github.GithubPyrate))
+        self.assertEqual(h.auth_identity(), self.getHandler('github').auth_identity())
+        self.assertTrue(pyrate.get_service_class('twitter') is twitter.TwitterPyrate)
+        self.assertTrue('mailchimp' in pyrate.available_services())
+        self.assertRaises(registry.ServiceNotFoundError, pyrate.get_service, 'nosuchservice')
+        if web is not None:
+            self.assertTrue(pyrate.get_service_class('github', asynchronous=True) is aio.AsyncGithubPyrate)
+
+    def test_register_service(self):
+        try:
+            pyrate.register_service('example', 'pyrate.services.harvest:HarvestPyrate')
+            h = pyrate.get_service('example', 'email@example.com', 'mypass', 'myorganisation')
+            self.assertTrue(isinstance(h, harvest.HarvestPyrate))
+        finally:
+            registry._services[False].pop('example', None)
+
+    def test_imports_deferred(self):
+        # In a fresh interpreter, as this one has imported everything already
+        code = ('import sys, pyrate; assert "requests" not in sys.modules; import pyrate.services.twitter; '
+                'print(sorted(set(sys.modules) & set(%r)))' % (DEFERRED_MODULES,))
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.join(TESTS_DIR, '..', '..'))
+        self.assertEqual(output.decode('ascii').strip(), '[]')
+
+    ##############################################
+    ## RECORD AND REPLAY
+    ##############################################
+
+    def test_cassette_record_and_replay(self):
+        hits = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, content):
+                body = compression.gzip_compress(json.dumps(content).encode('utf-8'))
+                self.send_response(201 if self.command == 'POST' else 200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                hits.append(self.path)
+                self.respond({'hits': len(hits)})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                self.respond({'name': json.loads(body.decode('utf-8'))['name']})
+
+            def log_message(self, *args):
+                pass
+
+        path = os.path.join(tempfile.mkdtemp(), 'github.cassette')
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        base_url = 'http://127.0.0.1:%d/' % server.server_port
+        try:
+            h = self.getHandler('github')
+            h.base_url = base_url
+            h.adapter = cassette.CassetteAdapter(cassette.Cassette(path), record=True)
+            recorded = [h.get('search/repositories', {'q': 'pyrate', 'page': 1}) for _ in range(2)]
+            recorded.append(h.post('user/repos', {'name': 'a'}))
+            recorded.append(h.post('user/repos', {'name': 'b'}))
+            h.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+        self.assertEqual(recorded, [{'hits': 1}, {'hits': 2}, {'name': 'a'}, {'name': 'b'}])
+        self.assertTrue(os.path.exists(path))
+
+        slept = []
+        h = self.getHandler('github')
+        h.base_url = base_url
+        h.adapter = cassette.CassetteAdapter(cassette.Cassette(path), latency=0.05, sleep=slept.append)
+        self.assertEqual(len(h.adapter.cassette), 4)
+        self.assertEqual(h.post('user/repos', {'name': 'b'}), {'name': 'b'})
+        self.assertEqual([h.get('search/repositories', {'page': 1, 'q': 'pyrate'}) for _ in range(3)],
+                         [{'hits': 1}, {'hits': 2}, {'hits': 2}])
+        self.assertRaises(cassette.CassetteMissError, h.post, 'user/repos', {'name': 'c'})
+        self.assertRaises(cassette.CassetteMissError, h.get, 'search/repositories', {'q': 'other'})
+        self.assertEqual(slept, [0.05] * 4)
+        self.assertEqual(h.metrics.as_dict()['github']['search/repositories']['statuses'], {200: 3})
+
+        h.adapter.cassette.rewind()
+        h.adapter.latency = 'recorded'
+        self.assertEqual(h.get('search/repositories', {'q': 'pyrate', 'page': 1}), {'hits': 1})
+        self.assertTrue(slept[-1] > 0)
+        h.close()
+
+    def test_cassette_matching(self):
+        key = cassette.request_key('get', 'https://API.github.com/search?q=a&page=1', None)
+        self.assertEqual(key, cassette.request_key('GET', 'https://api.github.com/search?page=1&q=a', b''))
+        self.assertNotEqual(key, cassette.request_key('POST', 'https://api.github.com/search?page=1&q=a', None))
+        self.assertNotEqual(cassette.request_key('POST', 'https://api.github.com/user/repos', '{"name": "a"}'),
+                            cassette.request_key('POST', 'https://api.github.com/user/repos', '{"name": "b"}'))
+
+        exchange = cassette.Exchange(key, 'GET', 'https://api.github.com/', 200, 'OK', [('X-Binary', '1')],
+                                     b'\x89PNG\xff')
+        self.assertEqual(cassette.Exchange.from_dict(json.loads(json.dumps(exchange.to_dict()))).content,
+                         b'\x89PNG\xff')
+
+    ##############################################
+    ## TRANSPORTS
+    ##############################################
+
+    def test_transport_default_is_session(self):
+        h = self.getHandler('github')
+        with HTTMock(self.mock_github):
+            h.do('#')
+            self.assertRaises(Exception, h.do, '#', http_method='TRACE')
+        self.assertTrue(isinstance(h.get_transport(), transport.RequestsTransport))
+        self.assertTrue(h.get_transport().session is h.session)
+        h.close()
+        self.assertTrue(h._transport is None)
+
+    def test_transport_urllib3(self):
+        seen = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def respond(self, content, status=200):
+                body = compression.gzip_compress(json.dumps(content).encode('utf-8'))
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Encoding', 'gzip')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                seen.append((self.command, self.path, self.headers.get('Authorization'), None))
+                if self.path.startswith('/old'):
+                    self.send_response(301)
+                    self.send_header('Location', '/repos/me/new')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                self.respond([{'name': 'repo%d' % i} for i in range(3)])
+
+            def do_PATCH(self):
+                body = self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8')
+                seen.append((self.command, self.path, self.headers.get('Content-Type'), body))
+                self.respond({'archived': True})
+
+            do_POST = do_PATCH
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        records = []
+        try:
+            h = self.getHandler('github')
+            h.base_url = 'http://127.0.0.1:%d/' % server.server_port
+            h.transport = 'urllib3'
+            h.register_hook('response', records.append)
+            self.assertEqual(h.get('old/path', {'page': 2}), [{'name': 'repo0'}, {'name': 'repo1'}, {'name': 'repo2'}])
+            self.assertEqual(h.archive_repo('repo'), {'archived': True})
+            self.assertEqual([repo['name'] for repo in h.do_stream('user/repos')], ['repo0', 'repo1', 'repo2'])
+
+            hv = self.getHandler('harvest')
+            hv.base_url = h.base_url
+            hv.transport = transport.Urllib3Transport(pool_maxsize=2)
+            hv.post('projects', {'name': 'x y'})
+            hv.close()
+            # Transports passed in are left open
+            self.assertEqual(len(hv.transport.pool_manager.pools), 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            h.close()
+
+        self.assertTrue(isinstance(h.transport, str))
+        self.assertEqual(seen[0][:2], ('GET', '/old/path?page=2'))
+        self.assertEqual(seen[1][:3], ('GET', '/repos/me/new', h.get_auth().headers['Authorization']))
+        self.assertEqual(seen[2][:3], ('PATCH', '/repos/email%40example.com/repo', None))
+        self.assertEqual(json.loads(seen[2][3]), {'archived': True})
+        self.assertEqual(seen[-1], ('POST', '/projects.json', 'application/x-www-form-urlencoded', 'name=x+y'))
+        self.assertEqual(records[0].status_code, 200)
+        self.assertTrue(records[0].timing['connect'] > 0)
+        self.assertTrue(records[0].response_bytes_saved > 0)
+
+        h = self.getHandler('github')
+        h.base_url = 'http://127.0.0.1:%d/' % server.server_port
+        h.transport = 'urllib3'
+        h.retry_policy = None
+        self.assertRaises(requests.exceptions.ConnectionError, h.get, 'user')
+        h.close()
+
+    def test_transport_by_name(self):
+        self.assertRaises(ValueError, transport.create_transport, 'carrier-pigeon')
+        if httpx is None:
+            self.assertRaises(ImportError, transport.create_transport, 'http2')
+        else:
+            t = transport.create_transport('http2')
+            self.assertTrue(isinstance(t, transport.HTTP2Transport))
+            t.close()
+
+    @unittest.skipUnless(httpx, 'httpx[http2] is not installed')
+    def test_transport_http2(self):
+        seen = []
+        repos = [{'name': 'repo%d' % i} for i in range(500)]
+        compressed = compression.gzip_compress(json.dumps(repos).encode('utf-8'))
+
+        def handler(request):
+            seen.append((request.method, str(request.url), request.headers.get('Authorization'), request.content))
+            if request.method == 'PATCH':
+                return httpx.Response(200, json={'archived': True})
+            # Streamed in chunks like a network response, bodies given as bytes are read upfront
+            chunks = iter([compressed[:500], compressed[500:]])
+            return httpx.Response(200, content=chunks, headers={'Content-Type': 'application/json',
+                                                                 'Content-Encoding': 'gzip'})
+
+        t = transport.HTTP2Transport()
+        t.client.close()
+        t.client = httpx.Client(transport=httpx.MockTransport(handler), follow_redirects=True)
+        h = self.getHandler('github')
+        h.transport = t
+        records = []
+        h.register_hook('response', records.append)
+        try:
+            self.assertEqual(h.get('user/repos', {'page': 2}), repos)
+            self.assertEqual(h.archive_repo('repo'), {'archived': True})
+
+            r = t.send('GET', 'https://api.github.com/user/repos', {}, None, None, stream=True)
+            self.assertEqual(r.raw.tell(), 0)
+            streamed = b''.join(r.iter_content(1000))
+            self.assertEqual(json.loads(streamed.decode('utf-8')), repos)
+            self.assertEqual(r.raw.tell(), len(compressed))
+            r.close()
+        finally:
+            h.close()
+            t.close()
+
+        self.assertEqual(seen[0][:3], ('GET', 'https://api.github.com/user/repos?page=2',
+                                       h.get_auth().headers['Authorization']))
+        self.assertEqual(seen[1][:2], ('PATCH', 'https://api.github.com/repos/email%40example.com/repo'))
+        self.assertEqual(json.loads(seen[1][3].decode('utf-8')), {'archived': True})
+        self.assertEqual((records[0].status_code, records[0].response_bytes), (200, len(json.dumps(repos))))
+        self.assertTrue(records[0].response_bytes_saved > 0)
+
+    ##############################################
+    ## SESSIONS
+    ##############################################
+
+    def test_session_reused(self):
+        h = self.getHandler('github')
+        with HTTMock(self.mock_github):
+            h.do('#')
+            session = h.session
+            h.do('#')
+        self.assertTrue(session is not None)
+        self.assertTrue(h.session is session)
+
+    def test_session_pool_settings(self):
+        h = self.getHandler('github')
+        h.pool_maxsize = 3
+        h.keep_alive = False
+        session = h.get_session()
+        self.assertEqual(session.get_adapter('https://api.github.com/')._pool_maxsize, 3)
+        self.assertEqual(session.headers['Connection'], 'close')
+
+    def test_session_context_manager(self):
+        with self.getHandler('github') as h:
+            with HTTMock(self.mock_github):
+                h.do('#')
+            self.assertTrue(h.session is not None)
+        self.assertTrue(h.session is None)
+
+    def test_session_environment_read_once(self):
+        session = main.create_session()
+        settings = session.merge_environment_settings('https://api.github.com/user', {}, None, None, None)
+        settings['proxies']['https'] = 'http://changed'
+        again = session.merge_environment_settings('https://api.github.com/repos', {}, None, None, None)
+        self.assertEqual(len(session._environments), 1)
+        self.assertFalse('http://changed' in again['proxies'].values())
+
+    def test_session_shared_per_host(self):
+        h1 = self.getHandler('github')
+        h2 = self.getHandler('github')
+        h1.share_session = h2.share_session = True
+        try:
+            self.assertTrue(h1.get_session() is h2.get_session())
+            h1.close()
+            self.assertTrue(h2.get_session() in main._shared_sessions.values())
+        finally:
+            main.close_shared_sessions()
+        self.assertEqual(main._shared_sessions, {})
+
+
+@unittest.skipIf(web is None, 'aiohttp is not installed')
+class TestAsyncPyrate(unittest.TestCase):
+
+    def run_with_server(self, routes, coro_func):
+        # Runs coro_func(server) against a local aiohttp app serving routes
+        async def runner():
+            app = web.Application()
+            app.add_routes(routes)
+            server = TestServer(app)
+            await server.start_server()
+            try:
+                return await coro_func(server)
+            finally:
+                await server.close()
+
+        return asyncio.run(runner())
+
+    def test_async_github_do_and_create_repo(self):
+        requests_seen = []
+
+        async def handle(request):
+            requests_seen.append((request.method, request.path, request.headers.get('Authorization'),
+                                  await request.text()))
+            return web.json_response({'current_user_url': 'github.com/someuser', 'name': 'repo'})
+
+        async def scenario(server):
+            async with aio.AsyncGithubPyrate("email@example.com", "mypass") as h:
+                h.base_url = str(server.make_url('/'))
+                self.assertTrue(await h.check_connection())
+                res = await h.create_repo('repo', 'description')
+            return res
+
+        res = self.run_with_server([web.route('*', '/{tail:.*}', handle)], scenario)
+        self.assertEqual(res['name'], 'repo')
+        self.assertEqual(requests_seen[1][:2], ('POST', '/user/repos'))
+        self.assertTrue(requests_seen[1][2].startswith('Basic '))
+        self.assertEqual(json.loads(requests_seen[1][3])['description'], 'description')
+
+    def test_async_twitter_tweet_is_signed(self):
+        auth_headers = []
+
+        async def handle(request):
+            auth_headers.append(request.headers.get('Authorization'))
+            return web.json_response({'id': '1'})
+
+        async def scenario(server):
+            async with aio.AsyncTwitterPyrate("000", "000", "000", "000") as h:
+                h.base_url = str(server.make_url('/'))
+                return await h.tweet("test")
+
+        self.assertTrue(self.run_with_server([web.post('/statuses/update.json', handle)], scenario))
+        self.assertTrue(auth_headers[0].startswith('OAuth '))
+
+    def test_async_concurrency_is_bounded(self):
+        state = {'current': 0, 'peak': 0}
+
+        async def handle(request):
+            state['current'] += 1
+            state['peak'] = max(state['peak'], state['current'])
+            await asyncio.sleep(0.01)
+            state['current'] -= 1
+            return web.json_response({'company': 'somecompany'})
+
+        async def scenario(server):
+            async with aio.AsyncHarvestPyrate("email@example.com", "mypass", "myorganisation") as h:
+                h.base_url = str(server.make_url('/'))
+                h.max_concurrency = 3
+                # Distinct requests, identical ones would be coalesced
+                return await asyncio.gather(*[h.get('account/who_am_i', {'n': i}) for i in range(12)])
+
+        res = self.run_with_server([web.get('/account/who_am_i.json', handle)], scenario)
+        self.assertEqual(len(res), 12)
+        self.assertEqual(state['peak'], 3)
+
+    def test_async_do_many(self):
+        state = {'current': 0, 'peak': 0}
+
+        async def handle(request):
+            state['current'] += 1
+            state['peak'] = max(state['peak'], state['current'])
+            await asyncio.sleep(0.01)
+            state['current'] -= 1
+            return web.json_response({'n': int(request.query['n'])})
+
+        async def scenario(server):
+            async with aio.AsyncHarvestPyrate("email@example.com", "mypass", "myorganisation") as h:
+                h.base_url = str(server.make_url('/'))
+                # An invalid method fails its own call only
+                calls = (('account/who_am_i', {'n': i}, 'TRACE' if i == 3 else 'GET') for i in range(10))
+                results = await h.do_many(calls, max_workers=4)
+                completed = [index async for index, _ in h.do_many([('account/who_am_i', {'n': 0})],
+                                                                   as_completed=True)]
+            return results, completed
+
+        results, completed = self.run_with_server([web.get('/account/who_am_i.json', handle)], scenario)
+        self.assertEqual([r['n'] for r in results if not isinstance(r, main.CallError)], [0, 1, 2, 4, 5, 6, 7, 8, 9])
+        self.assertTrue(isinstance(results[3], main.CallError))
+        self.assertEqual(state['peak'], 4)
+        self.assertEqual(completed, [0])
+
+    def test_async_identical_requests_coalesced(self):
+        paths = []
+
+        async def handle(request):
+            paths.append(request.path_qs)
+            await asyncio.sleep(0.05)
+            return web.json_response({'company': 'somecompany'})
+
+        async def scenario(server):
+            async with aio.AsyncHarvestPyrate("email@example.com", "mypass", "myorganisation") as h:
+                h.base_url = str(server.make_url('/'))
+                calls = [h.get('account/who_am_i') for _ in range(10)] + [h.get('account/who_am_i', {'a': 1})]
+                res = await asyncio.gather(*calls)
+                self.assertEqual(h._flights.shared, 9)
+                self.assertEqual(len(h._flights), 0)
+                return res
+
+        res = self.run_with_server([web.get('/account/who_am_i.json', handle)], scenario)
+        self.assertEqual(sorted(paths), ['/account/who_am_i.json', '/account/who_am_i.json?a=1'])
+        self.assertEqual(res[0], {'company': 'somecompany'})
+        self.assertTrue(res[0] is not res[1])
+
+    def test_async_retries_throttles_caches_and_records(self):
+        paths = []
+
+        async def handle(request):
+            paths.append(request.path_qs)
+            if len(paths) == 1:
+                return web.json_response({'message': 'Unavailable'}, status=503, headers={'Retry-After': '0'})
+            return web.json_response({'login': 'someuser'}, headers={
+                'X-RateLimit-Remaining': '0', 'X-RateLimit-Limit': '5000', 'X-RateLimit-Reset': str(time.time() + 0.2),
+                'Cache-Control': 'max-age=60'})
+
+        async def scenario(server):
+            async with aio.AsyncGithubPyrate("async@example.com", "mypass") as h:
+                h.base_url = str(server.make_url('/'))
+                h.retry_policy = retry.RetryPolicy(budget=None)
+                h.rate_limiter = ratelimit.RateLimiter()
+                h.cache = cache.MemoryCache()
+                records = []
+                h.register_hook('response', records.append)
+                started = time.time()
+                first = await h.get('user')
+                cached = await h.get('user')
+                # Quota used up, waits for the reset without blocking the loop
+                ticks = []
+                other, _ = await asyncio.gather(h.get('user/orgs'), self.tick(ticks))
+                return first, cached, other, records, time.time() - started, ticks, h
+
+        first, cached, other, records, elapsed, ticks, h = self.run_with_server(
+            [web.get('/{tail:.*}', handle)], scenario)
+        self.assertEqual(paths, ['/user', '/user', '/user/orgs'])
+        self.assertEqual((first, cached), ({'login': 'someuser'}, {'login': 'someuser'}))
+        self.assertEqual(h.cache_stats['hits'], 1)
+        self.assertEqual([r.status_code for r in records], [503, 200, 200])
+        self.assertTrue(records[2].timing['throttle'] > 0.1)
+        self.assertTrue(len(ticks) > 5)
+        self.assertEqual(h.metrics.as_dict()['github']['user']['statuses'], {503: 1, 200: 1})
+
+    async def tick(self, ticks):
+        for _ in range(10):
+            ticks.append(time.time())
+            await asyncio.sleep(0.01)
+
+    def test_async_github_bulk(self):
+        seen = []
+
+        async def handle(request):
+            seen.append((request.method, request.path))
+            if len(seen) == 1:
+                return web.json_response({'message': 'You have exceeded a secondary rate limit'}, status=403,
+                                         headers={'Retry-After': '0.1'})
+            if request.method == 'DELETE':
+                return web.Response(status=204)
+            return web.json_response({'name': request.match_info['name']})
+
+        async def scenario(server):
+            async with aio.AsyncGithubPyrate("async@example.com", "mypass") as h:
+                h.base_url = str(server.make_url('/'))
+                h.content_limiter = ratelimit.WindowLimiter(((80, 60),))
+                archived = [r async for r in h.archive_repos(['a', 'other/b'], max_in_flight=1)]
+                deleted = [r async for r in h.delete_repos(['c'], 'myorg')]
+                return archived, deleted, h.content_limiter.paused_until
+
+        started = time.time()
+        archived, deleted, paused_until = self.run_with_server(
+            [web.route('*', '/repos/{owner}/{name}', handle)], scenario)
+        self.assertEqual([(r.full_name, r.status) for r in archived],
+                         [('async@example.com/a', 200), ('other/b', 200)])
+        self.assertEqual(seen[:3], [('PATCH', '/repos/async@example.com/a')] * 2 + [('PATCH', '/repos/other/b')])
+        self.assertTrue(started + 0.1 <= paused_until < time.time())
+        self.assertEqual((deleted[0].full_name, deleted[0].status, deleted[0].ok), ('myorg/c', 204, True))
+
+    def test_async_github_graphql_batch(self):
+        seen = []
+
+        async def handle(request):
+            body = await request.json()
+            seen.append(body)
+            data = {'rateLimit': {'cost': 1, 'remaining': 4999, 'resetAt': '2026-01-01T00:00:00Z'}}
+            for alias in set(name.split('_')[0] for name in body['variables']):
+                owner, name = body['variables'][alias + '_owner'], body['variables'][alias + '_name']
+                data[alias] = None if name == 'missing' else {'nameWithOwner': '%s/%s' % (owner, name)}
+            return web.json_response({'data': data})
+
+        async def scenario(server):
+            async with aio.AsyncGithubPyrate("async@example.com", "mypass") as h:
+                h.base_url = str(server.make_url('/'))
+                h.graphql_max_aliases = 2
+                repos = await h.get_repos_metadata(['a', 'other/b', 'other/missing'], fields='nameWithOwner')
+                async with h.graphql_batch() as batch:
+                    lookup = batch.add('repository(owner: $owner, name: $name) { nameWithOwner }', owner='o',
+                                       name='c')
+                with self.assertRaises(TypeError):
+                    with h.graphql_batch():
+                        pass
+            return repos, lookup, batch
+
+        repos, lookup, batch = self.run_with_server([web.post('/graphql', handle)], scenario)
+        self.assertEqual(repos, {'a': {'nameWithOwner': 'async@example.com/a'},
+                                 'other/b': {'nameWithOwner': 'other/b'}, 'other/missing': None})
+        self.assertEqual(len(seen), 3)
+        self.assertEqual(lookup.result(), {'nameWithOwner': 'o/c'})
+        self.assertEqual((batch.queries, batch.cost), (1, 1))
+
+    def test_async_github_iter_items(self):
+        async def handle(request):
+            page = int(request.query.get('page', 1))
+            headers = {}
+            if page < 3:
+                url = request.url.update_query({'page': page + 1})
+                headers['Link'] = '<%s>; rel="next"' % url
+            return web.json_response([{'id': page * 10 + i} for i in range(2)], headers=headers)
+
+        async def scenario(server):
+            async with aio.AsyncGithubPyrate("async@example.com", "mypass") as h:
+                h.base_url = str(server.make_url('/'))
+                items = [item['id'] async for item in h.iter_items('user/repos')]
+                pages = [len(page) async for page in h.iter_pages('user/repos', prefetch=True)]
+            return items, pages
+
+        items, pages = self.run_with_server([web.get('/user/repos', handle)], scenario)
+        self.assertEqual(items, [10, 11, 20, 21, 30, 31])
+        self.assertEqual(pages, [2, 2, 2])
+
+    def test_async_do_stream(self):
+        async def export(request):
+            response = web.StreamResponse()
+            await response.prepare(request)
+            body = json.dumps({'total': 300, 'data': [{'email': '%d@example.com' % i} for i in range(300)]})
+            for start in range(0, len(body), 1000):
+                await response.write(body[start:start + 1000].encode('utf-8'))
+            return response
+
+        async def missing(request):
+            return web.json_response({'error': 'Not Found'}, status=404)
+
+        async def scenario(server):
+            async with aio.AsyncMailchimpPyrate("myapikey-us2") as h:
+                h.base_url = str(server.make_url('/'))
+                items = [item['email'] async for item in h.do_stream('lists/members', {'id': 'abc'})]
+                ijson, jsonstream.ijson = jsonstream.ijson, None
+                try:
+                    fallback = [item['email'] async for item in h.do_stream('lists/members', {'id': 'abc'})]
+                finally:
+                    jsonstream.ijson = ijson
+                with self.assertRaises(requests.HTTPError):
+                    async for _ in h.do_stream('lists/missing'):
+                        pass
+            return items, fallback
+
+        items, fallback = self.run_with_server([web.post('/lists/members.JSON', export),
+                                                web.post('/lists/missing.JSON', missing)], scenario)
+        self.assertEqual(items, ['%d@example.com' % i for i in range(300)])
+        self.assertEqual(fallback, items)
+
+    def test_async_mailchimp_subscribe(self):
+        async def lists(request):
+            return web.json_response({'total': 1, 'data': [{'id': 'abc', 'name': 'ListName'}]})
+
+        async def subscribe(request):
+            body = await request.json()
+            return web.json_response({'email': body['email']['email'], 'list': body['id']})
+
+        async def members(request):
+            body = await request.json()
+            data = [{'email': '%s/%d' % (body['id'], i)} for i in range(2)] if body['opts']['start'] == 0 else []
+            return web.json_response({'total': 2, 'data': data})
+
+        async def scenario(server):
+            async with aio.AsyncMailchimpPyrate("myapikey-us2") as h:
+                h.base_url = str(server.make_url('/'))
+                res = await h.subscribeToList('ListName', 'myemail@example.com')
+                return res, [member['email'] async for member in h.iterListMembers('ListName')]
+
+        res, members = self.run_with_server([web.post('/lists/list.JSON', lists),
+                                             web.post('/lists/subscribe.JSON', subscribe),
+                                             web.post('/lists/members.JSON', members)], scenario)
+        self.assertEqual(res, {'email': 'myemail@example.com', 'list': 'abc'})
+        self.assertEqual(members, ['abc/0', 'abc/1'])
+
+    def test_async_mailchimp_batch_subscribe(self):
+        batches = []
+
+        async def batch_subscribe(request):
+            body = await request.json()
+            batches.append(body)
+            errors = [{'email': row['email'], 'code': 502, 'error': 'Invalid email'}
+                      for row in body['batch'] if 'invalid' in row['email']['email']]
+            return web.json_response({'add_count': len(body['batch']) - len(errors), 'update_count': 0,
+                                      'error_count': len(errors), 'errors': errors})
+
+        async def batch_unsubscribe(request):
+            body = await request.json()
+            return web.json_response({'success_count': len(body['batch']), 'error_count': 0, 'errors': []})
+
+        async def scenario(server):
+            async with aio.AsyncMailchimpPyrate("myapikey-us2") as h:
+                h.base_url = str(server.make_url('/'))
+                h.batch_chunk_size = 4
+                h.storeListIndex([{'id': '8a4d2d7a2b', 'name': 'ListName'}])
+                members = ['member%d@example.com' % i for i in range(7)] + ['invalid@example.com']
+                subscribed = await h.batchSubscribe('8a4d2d7a2b', iter(members), double_optin=False)
+                unsubscribed = await h.batchUnsubscribe('8a4d2d7a2b', ['a@example.com'])
+            return subscribed, unsubscribed
+
+        subscribed, unsubscribed = self.run_with_server(
+            [web.post('/lists/batch-subscribe.JSON', batch_subscribe),
+             web.post('/lists/batch-unsubscribe.JSON', batch_unsubscribe)], scenario)
+        self.assertEqual(sorted(len(b['batch']) for b in batches), [4, 4])
+        self.assertTrue(batches[0]['double_optin'] is False)
+        self.assertEqual((subscribed.add_count, subscribed.error_count), (7, 1))
+        self.assertEqual(subscribed.errors[0]['email']['email'], 'invalid@example.com')
+        self.assertEqual(unsubscribed.success_count, 1)
+
+    def test_async_twitter_stream_reconnects(self):
+        connections = []
+
+        async def handle(request):
+            connections.append((await request.post()).get('track'))
+            response = web.StreamResponse()
+            await response.prepare(request)
+            if len(connections) == 1:
+                await response.write(b'{"id": 1}\r\n\r\n{"id"')
+                await asyncio.sleep(.5)  # stall mid-message
+            else:
+                await response.write(b'{"id": 2}\r\n')
+                await asyncio.sleep(5)
+            return response
+
+        async def scenario(server):
+            async with aio.AsyncTwitterPyrate("000", "000", "000", "000") as h:
+                h.stream_url = str(server.make_url('/1.1/'))
+                backoff = streaming.StreamBackoff()
+                backoff.network_step = .01
+                messages = []
+                async with h.stream('statuses/filter', {'track': 'python'}, http_method='POST', stall_timeout=.2,
+                                    backoff=backoff) as stream:
+                    async for message in stream:
+                        messages.append(message['id'])
+                        if len(messages) == 2:
+                            break
+            return messages
+
+        messages = self.run_with_server([web.post('/1.1/statuses/filter.json', handle)], scenario)
+        self.assertEqual(messages, [1, 2])
+        self.assertEqual(connections, ['python', 'python'])
+
 
     # FIXME: Test Suites not working
     '''
@@ -167,6 +2168,7 @@ class TestSequenceFunctions(unittest.TestCase):
     alltests = unittest.TestSuite([test_basecamp, test_github, test_harvest, test_mailchimp, test_twitter])
     '''
 
+
 if __name__ == '__main__':
     #unittest.TextTestRunner().run(test_basecamp)
     unittest.main()
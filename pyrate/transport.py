@@ -0,0 +1,271 @@
+"""Transports sending the requests of a pyrate over the network, see :attr:`pyrate.main.Pyrate.transport`.
+
+- ``'requests'`` (:class:`RequestsTransport`, the default) sends through the pooled :class:`requests.Session` of
+  the pyrate, with its adapters, proxies and redirects.
+- ``'urllib3'`` (:class:`Urllib3Transport`) talks to a urllib3 pool manager directly, skipping the per-request work
+  of the session for the lowest client-side overhead.
+- ``'http2'`` (:class:`HTTP2Transport`) multiplexes concurrent requests over a single HTTP/2 connection per host,
+  requires ``httpx`` (``pip install pyrate[http2]``).
+
+Every transport returns :class:`requests.Response` objects, so response handling, caching, rate limits and
+metrics work the same whichever is used.
+"""
+import datetime
+import time
+
+import requests
+from requests.hooks import dispatch_hook
+from requests.structures import CaseInsensitiveDict
+from requests.utils import default_user_agent, get_encoding_from_headers
+from urllib3 import exceptions, PoolManager, Timeout
+from urllib3.util.retry import Retry
+
+from pyrate.compression import accept_encoding
+from pyrate.instrumentation import TimedHTTPConnectionPool, TimedHTTPSConnectionPool
+
+try:
+    from urllib.parse import urlencode
+except ImportError:
+    from urllib import urlencode
+
+__docformat__ = 'sphinx en'
+
+HTTP_METHODS = ('GET', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS')
+
+FORM_CONTENT_TYPE = 'application/x-www-form-urlencoded'
+
+MAX_REDIRECTS = 30
+
+CHUNK_SIZE = 64 * 1024
+
+TRANSPORTS = {
+    'urllib3': 'Urllib3Transport',
+    'http2': 'HTTP2Transport',
+}
+
+
+def create_transport(name, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+    """Creates the transport called ``name`` (see :data:`TRANSPORTS`) with the given pool settings.
+
+    The ``'requests'`` transport is created by the pyrate, around its session.
+    """
+
+    if name not in TRANSPORTS:
+        raise ValueError("Unknown transport: %r" % (name,))
+    return globals()[TRANSPORTS[name]](pool_connections, pool_maxsize, pool_block, keep_alive)
+
+
+class Transport(object):
+    """Base class of the transports."""
+
+    def send(self, http_method, url, headers, body, auth, stream=False, hooks=None, timeout=None):
+        """Sends a request.
+
+        :param string http_method: One of :data:`HTTP_METHODS`
+        :param body: The encoded body, or a dict to send form-encoded
+        :param auth: The :class:`pyrate.auth.AuthProvider` of the pyrate, None for unauthenticated requests
+        :param bool stream: Whether to return before the body is read
+        :param dict hooks: requests style hooks, ``'response'`` hooks are called once the headers are in
+        :param timeout: Seconds to wait for the connection and for each read, or a ``(connect, read)`` pair
+        :rtype: :class:`requests.Response`
+        """
+        raise NotImplementedError('Please implement in subclass')
+
+    def close(self):
+        """Releases the connections of this transport."""
+        pass
+
+    def prepare(self, http_method, url, headers, body, auth):
+        """Encodes and authenticates a request for transports without a :class:`requests.Session`.
+
+        :rtype: tuple ``(url, headers, body)``
+        """
+
+        headers = dict(headers or {})
+        if isinstance(body, dict):
+            body = urlencode(body) if body else None
+            if body is not None:
+                headers.setdefault('Content-Type', FORM_CONTENT_TYPE)
+
+        if auth is not None:
+            url, headers, body = auth.sign(http_method, url, headers, body)
+        if body is not None and not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        return url, headers, body
+
+    def build_response(self, http_method, url, headers, body, status, reason, response_headers, raw, started_at,
+                       stream, hooks):
+        """Returns the :class:`requests.Response` of a request sent by this transport, reading the body unless
+        ``stream`` is set."""
+
+        request = requests.PreparedRequest()
+        request.method, request.url, request.body = http_method, url, body
+        request.headers = CaseInsensitiveDict(headers)
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = CaseInsensitiveDict(response_headers)
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = raw
+        response.url = url
+        response.request = request
+        response.elapsed = datetime.timedelta(seconds=time.time() - started_at)
+
+        response = dispatch_hook('response', hooks or {}, response)
+        if not stream:
+            response.content
+        return response
+
+
+class RequestsTransport(Transport):
+    """Sends requests through a :class:`requests.Session`.
+
+    The session is left open by :func:`close`, it belongs to whoever created it.
+    """
+
+    def __init__(self, session):
+        self.session = session
+
+    def send(self, http_method, url, headers, body, auth, stream=False, hooks=None, timeout=None):
+        return self.session.request(http_method, url, data=None if http_method == 'GET' else body, headers=headers,
+                                    auth=auth, stream=stream, hooks=hooks, timeout=timeout)
+
+
+class Urllib3Transport(Transport):
+    """Sends requests straight to a urllib3 pool manager, whose pools report connection timings.
+
+    Redirects are followed, proxy settings of the environment are not read.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+        self.pool_manager = PoolManager(num_pools=pool_connections, maxsize=pool_maxsize, block=pool_block)
+        self.pool_manager.pool_classes_by_scheme = {'http': TimedHTTPConnectionPool,
+                                                    'https': TimedHTTPSConnectionPool}
+        self.retries = Retry(total=None, connect=0, read=0, status=0, other=0, redirect=MAX_REDIRECTS,
+                             raise_on_redirect=False)
+        self.headers = CaseInsensitiveDict({'User-Agent': default_user_agent(), 'Accept': '*/*',
+                                            'Accept-Encoding': accept_encoding()})
+        if not keep_alive:
+            self.headers['Connection'] = 'close'
+
+    def send(self, http_method, url, headers, body, auth, stream=False, hooks=None, timeout=None):
+        merged = self.headers.copy()
+        merged.update(headers or {})
+        url, headers, body = self.prepare(http_method, url, merged, body, auth)
+        if isinstance(timeout, tuple):
+            timeout = Timeout(connect=timeout[0], read=timeout[1])
+        else:
+            timeout = Timeout(connect=timeout, read=timeout)
+
+        started_at = time.time()
+        try:
+            raw = self.pool_manager.urlopen(http_method, url, body=body, headers=headers, retries=self.retries,
+                                            timeout=timeout, preload_content=False, decode_content=False)
+        except exceptions.MaxRetryError as e:
+            if isinstance(e.reason, exceptions.ConnectTimeoutError):
+                raise requests.exceptions.ConnectTimeout(e)
+            if isinstance(e.reason, exceptions.ReadTimeoutError):
+                raise requests.exceptions.ReadTimeout(e)
+            raise requests.exceptions.ConnectionError(e)
+        except exceptions.ReadTimeoutError as e:
+            raise requests.exceptions.ReadTimeout(e)
+        except (exceptions.ProtocolError, exceptions.NewConnectionError) as e:
+            raise requests.exceptions.ConnectionError(e)
+
+        return self.build_response(http_method, raw.geturl() or url, headers, body, raw.status, raw.reason,
+                                   raw.headers, raw, started_at, stream, hooks)
+
+    def close(self):
+        self.pool_manager.clear()
+
+
+class HTTP2Transport(Transport):
+    """Sends requests with ``httpx`` over HTTP/2, multiplexing concurrent requests over one connection per host
+    (hosts without HTTP/2 support are talked to over HTTP/1.1).
+
+    The connection timings of :mod:`pyrate.instrumentation` are not taken by this transport.
+    """
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, pool_block=False, keep_alive=True):
+        try:
+            import httpx
+        except ImportError:
+            raise ImportError("The http2 transport requires httpx, pip install pyrate[http2]")
+
+        limits = httpx.Limits(max_connections=pool_connections * pool_maxsize,
+                              max_keepalive_connections=pool_connections * pool_maxsize if keep_alive else 0)
+        self.httpx = httpx
+        self.client = httpx.Client(http2=True, limits=limits, follow_redirects=True, max_redirects=MAX_REDIRECTS)
+
+    def send(self, http_method, url, headers, body, auth, stream=False, hooks=None, timeout=None):
+        httpx = self.httpx
+
+        url, headers, body = self.prepare(http_method, url, headers, body, auth)
+        if isinstance(timeout, tuple):
+            timeout = httpx.Timeout(None, connect=timeout[0], read=timeout[1])
+        elif timeout is not None:
+            timeout = httpx.Timeout(timeout)
+        else:
+            timeout = None
+
+        started_at = time.time()
+        try:
+            request = self.client.build_request(http_method, url, headers=headers, content=body, timeout=timeout)
+            r = self.client.send(request, stream=True)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e)
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e)
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e)
+
+        return self.build_response(http_method, str(r.url), headers, body, r.status_code, r.reason_phrase,
+                                   r.headers.multi_items(), StreamedBody(r), started_at, stream, hooks)
+
+    def close(self):
+        self.client.close()
+
+
+class StreamedBody(object):
+    """File-like body of an ``httpx`` response for :attr:`requests.Response.raw`, yielding decoded bytes.
+
+    :func:`tell` counts the bytes received over the wire, like urllib3's.
+    """
+
+    decode_content = True
+
+    def __init__(self, response):
+        self.response = response
+        self._chunks = response.iter_bytes()
+        self._buffer = b''
+
+    def read(self, amt=None):
+        if amt is None:
+            data, self._buffer = self._buffer + b''.join(self._chunks), b''
+            return data
+
+        while len(self._buffer) < amt:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        data, self._buffer = self._buffer[:amt], self._buffer[amt:]
+        return data
+
+    def stream(self, amt=CHUNK_SIZE, decode_content=None):
+        while True:
+            data = self.read(amt)
+            if not data:
+                break
+            yield data
+        self.close()
+
+    def tell(self):
+        return self.response.num_bytes_downloaded
+
+    def close(self):
+        self.response.close()
+
+    def release_conn(self):
+        pass
@@ -41,6 +41,12 @@ setup(
     tests_require=[
         'httmock==1.0.7',
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'streaming': ['ijson'],
+        'fast-json': ['orjson'],
+        'http2': ['httpx[http2]'],
+    },
     entry_points={
         'console_scripts': [
             'pyratetools = pyrate.scripts.cliutils:main',